@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import shlex
 from datetime import timedelta
 from rest_framework.settings import api_settings
 from decouple import config, UndefinedValueError
@@ -65,6 +66,10 @@ INSTALLED_APPS = DEFAULT_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [],
     'DEFAULT_PERMISSION_CLASSES': [],
+    'DEFAULT_RENDERER_CLASSES': [
+        'apps.dashboard.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     #'DEFAULT_AUTHENTICATION_CLASSES': (
     #    'rest_framework.authentication.TokenAuthentication',
     #    'rest_framework.authentication.SessionAuthentication',
@@ -85,6 +90,7 @@ REST_KNOX = {
 AUTH_USER_MODEL = 'accounts.User'
 
 MIDDLEWARE = [
+    'apps.dashboard.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -124,15 +130,6 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-        #'NAME': os.path.join(BASE_DIR, 'working.sqlite3'),
-    },
-    'working': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'working.sqlite3'),
-    },
-    'primary': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
     },
     'scraped': {
         'ENGINE': 'django.db.backends.mysql',
@@ -141,15 +138,27 @@ DATABASES = {
         'PASSWORD': config('DB_PASSWORD'),
         'HOST': config('DB_HOST'),
         'PORT': config('DB_PORT'),
+        # Connections are kept open across requests, see DATABASE_ROUTING['PING_AFTER']
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=300, cast=int),
+        'OPTIONS': {'connect_timeout': 5},
     },
-    'august': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'august_db.sqlite3'),
-    },
-    'updated': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'updated.sqlite3'),
+}
+
+# Read replicas of the scraped DB, as a comma separated list of hosts sharing its credentials
+for idx, host in enumerate([host for host in config('DB_REPLICA_HOSTS', default='').split(',') if host.strip()], start=1):
+    DATABASES[f'scraped_replica_{idx}'] = dict(DATABASES['scraped'], HOST=host.strip(), TEST={'MIRROR': 'scraped'})
+
+# Unmanaged scraped models live in the `scraped` DB (apps/dashboard/routers.py)
+DATABASE_ROUTERS = ['apps.dashboard.routers.ScrapedRouter']
+
+DATABASE_ROUTING = {
+    'HOMES': {
+        f'dashboard.{model}': 'scraped'
+        for model in ('productlisting', 'dailyproductlisting', 'productdetails', 'qanda', 'reviews', 'sponsoredproductdetails')
     },
+    'REPLICAS': {'scraped': [alias for alias in DATABASES if alias.startswith('scraped_replica_')]},
+    'HEALTH_CHECK_INTERVAL': 10, # Seconds a replica health check is trusted
+    'PING_AFTER': 60, # Seconds a persistent connection can sit idle before it is pinged on reuse
 }
 
 
@@ -202,6 +211,64 @@ STATICFILES_STORAGE ='whitenoise.storage.CompressedManifestStaticFilesStorage'
 # Default Paginator Class (https://stackoverflow.com/questions/31740039/django-rest-framework-pagination-extremely-slow-count)
 DEFAULT_PAGINATION_CLASS = 'apps.dashboard.paginator.FasterPageNumberPagination'
 
+# Response cache of the dashboard analytics endpoints (apps/dashboard/cache.py)
+# BACKEND is one of 'locmem', 'file' (LOCATION = directory), 'redis' (LOCATION = url), or empty to disable
+DASHBOARD_CACHE = {
+    'BACKEND': config('DASHBOARD_CACHE_BACKEND', default='locmem'),
+    'LOCATION': config('DASHBOARD_CACHE_LOCATION', default=''),
+    'OPTIONS': {},
+    # Seconds between two reads of the data version. 0 reads it at the start of every request
+    'VERSION_CHECK_INTERVAL': config('DASHBOARD_CACHE_VERSION_CHECK_INTERVAL', default=0, cast=float),
+}
+
+# Limits of the dashboard widgets (apps/dashboard/snapshot.py)
+DASHBOARD_WIDGETS = {
+    'MAX_WINDOWS': 104, # Windows of the rating over time
+    'MAX_WINDOW_DAYS': 366, # Days per window of the rating over time
+}
+
+# Per request metrics of the dashboard API (apps/dashboard/metrics.py), exposed at api/dashboard/metrics
+DASHBOARD_METRICS = {
+    'ENABLED': config('DASHBOARD_METRICS_ENABLED', default=True, cast=bool),
+    'PATH_PREFIXES': ['/api/dashboard/'],
+    'SLOW_REQUEST_SECONDS': config('DASHBOARD_SLOW_REQUEST_SECONDS', default=1.0, cast=float),
+    'SLOW_SAMPLES': 50, # Slow requests kept
+    'MAX_SAMPLE_QUERIES': 100, # SQL statements kept per request
+}
+
+# Scraper job queue (apps/taskscheduler/scraper_jobs.py), run by `manage.py run_scraper_workers`
+# COMMAND placeholders: {python}, {config} (a path from CONFIGS) and {category}. The category is also in $SCRAPER_CATEGORY
+SCRAPER_JOBS = {
+    'COMMAND': shlex.split(config('SCRAPER_COMMAND', default='{python} scraper/scraper.py --config {config}')),
+    'CONFIGS': {
+        'listing': os.path.join(BASE_DIR, 'scraper', 'listing.conf'),
+    },
+    'CWD': BASE_DIR,
+    'WORKERS': config('SCRAPER_WORKERS', default=2, cast=int), # Worker processes
+    'MAX_CONCURRENT': config('SCRAPER_MAX_CONCURRENT', default=1, cast=int), # Scrapes running at once, over all workers
+    'MAX_ATTEMPTS': 3,
+    'RETRY_DELAY': 300, # Seconds, times the number of attempts so far
+    'TIMEOUT': 6 * 60 * 60, # Seconds before a scrape is killed
+    'HEARTBEAT_INTERVAL': 30,
+    'STALE_AFTER': 5 * 60, # Running jobs without a heartbeat for this long are requeued
+    'POLL_INTERVAL': 5,
+    'LOG_DIR': os.path.join(BASE_DIR, 'scraper_logs'),
+    'REFRESH_AFTER_SCRAPE': True,
+}
+
+# CSV exports of the scraped tables (apps/dashboard/exports.py)
+EXPORTS = {
+    # Bytes of gzipped CSV sent as an email attachment, larger exports must be downloaded from api/dashboard/export/<table>
+    'MAX_ATTACHMENT_SIZE': config('EXPORT_MAX_ATTACHMENT_SIZE', default=10 * 1024 * 1024, cast=int),
+}
+
+# Full-text index of the review / Q&A text (apps/dashboard/search.py), filled by `manage.py build_search_index`
+SEARCH_INDEX = {
+    'PATH': config('SEARCH_INDEX_PATH', default=os.path.join(BASE_DIR, 'search_index.sqlite3')),
+    'CHUNK_SIZE': 5000, # Rows read from the scraped DB per batch
+    'MAX_LIMIT': 100, # Results per page
+}
+
 # Corsheader
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_ALLOW_CREDENTIALS = True
@@ -222,3 +289,21 @@ try:
     from local_settings import *
 except ImportError:
     pass
+
+# Benchmarks (manage.py benchmark) run on SQLite stand-ins of the default and scraped DBs, under BENCH_DIR
+BENCH_DIR = config('BENCH_DIR', default='')
+if BENCH_DIR:
+    BENCH_DIR = os.path.abspath(BENCH_DIR)
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BENCH_DIR, 'default.sqlite3'),
+        },
+        'scraped': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BENCH_DIR, 'scraped.sqlite3'),
+        },
+    }
+    SEARCH_INDEX = dict(SEARCH_INDEX, PATH=os.path.join(BENCH_DIR, 'search_index.sqlite3'))
+    EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
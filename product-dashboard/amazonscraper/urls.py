@@ -19,5 +19,6 @@ from django.urls import path, include
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/dashboard/', include('apps.dashboard.urls')),
+    path('api/scraper/', include('apps.taskscheduler.urls')),
     path('', include('apps.accounts.urls')),
 ]
@@ -0,0 +1 @@
+default_app_config = 'apps.dashboard.apps.DashboardConfig'
\ No newline at end of file
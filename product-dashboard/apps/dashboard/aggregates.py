@@ -0,0 +1,219 @@
+import datetime
+import json
+import os
+
+from django.db import transaction
+from django.db.models import Avg, Count, Max
+from django.db.models.functions import TruncDate
+
+from .models import (AggregateWatermark, ProductAggregate, Productdetails,
+                     Productlisting, ReviewAggregate, Reviews)
+from .periods import PERIODS
+from .timeseries import DATE_FORMAT
+
+# Incremental builder of ProductAggregate / ReviewAggregate from the scraped DB.
+# Watermarks on Productdetails.date_completed and Reviews (review_date, id) select the products scraped since
+# the last build, which are rebuilt in chunks. The counts relative to the latest review date (periods, months)
+# are recomputed from the stored daily counts when that date moves, without reading the reviews again
+
+CHUNK_SIZE = 500 # Products rebuilt per batch
+
+DAYS_PER_MONTH = 30
+
+LISTING_FIELDS = ('product_id', 'category', 'short_title', 'duplicate_set', 'brand', 'is_duplicate', 'total_ratings')
+
+DETAILS_FIELDS = ('product_id', 'product_title', 'brand', 'model', 'subcategories', 'num_reviews', 'curr_price', 'featurewise_reviews', 'is_duplicate')
+
+
+def load_sentiment_index():
+    # Only the converted index, the raw sentiment files are far too slow to parse for a build
+    from apps.taskscheduler.management import SENTIMENT_INDEX_DIR
+    from apps.taskscheduler.sentiments import SentimentIndex
+    if not os.path.exists(os.path.join(SENTIMENT_INDEX_DIR, 'meta.json')):
+        return None
+    return SentimentIndex.load(SENTIMENT_INDEX_DIR)
+
+
+def get_watermark(source):
+    return AggregateWatermark.objects.filter(source=source).first() or AggregateWatermark(source=source)
+
+
+def months_ago(day, as_of):
+    # 1 for the 30 days up to `as_of`, 2 for the 30 before, ...
+    return max((as_of - day).days, 0) // DAYS_PER_MONTH + 1
+
+
+def relative_review_counts(daily, as_of):
+    """Returns the `review_info` / `total_reviews` blobs of `ProductAggregate` for the daily counts of a
+    `ReviewAggregate.review_info`: the reviews of the last 1, 3, 6... months and the reviews per month before `as_of`
+    """
+    period_reviews = {str(period): 0 for period in PERIODS}
+    monthly_reviews = {}
+    for _date, value in daily.items():
+        try:
+            day = datetime.datetime.strptime(_date, DATE_FORMAT).date()
+        except (TypeError, ValueError):
+            continue
+        count = value.get('num_reviews') or 0
+        month = months_ago(day, as_of)
+        monthly_reviews[month] = monthly_reviews.get(month, 0) + count
+        for period in PERIODS:
+            if month <= period:
+                period_reviews[str(period)] += count
+    total_reviews = {str(month): monthly_reviews[month] for month in sorted(monthly_reviews)}
+    return json.dumps(period_reviews), json.dumps(total_reviews)
+
+
+def load_daily_reviews(product_ids, using='scraped'):
+    """Returns {product_id: {"dd/mm/YYYY": {"num_reviews", "rating"}}}, the daily review counts / average ratings
+    """
+    reviews = Reviews.objects.using(using).filter(product_id__in=product_ids, review_date__isnull=False)
+    rows = reviews.annotate(day=TruncDate('review_date')).values('product_id', 'day').annotate(num_reviews=Count('id'), rating=Avg('rating')).order_by('product_id', 'day')
+    daily = {}
+    for row in rows:
+        rating = round(row['rating'], 2) if row['rating'] is not None else None
+        daily.setdefault(row['product_id'], {})[row['day'].strftime(DATE_FORMAT)] = {'num_reviews': row['num_reviews'], 'rating': rating}
+    return daily
+
+
+def build_chunk(product_ids, as_of, sentiment_index=None, using='scraped'):
+    """Rebuilds the aggregate rows of `product_ids` from the scraped tables, in 3 reads and one transaction.
+    Products without details are removed. Returns the categories of the old and new rows
+    """
+    listings = {row['product_id']: row for row in Productlisting.objects.using(using).filter(product_id__in=product_ids).values(*LISTING_FIELDS)}
+    details = {row['product_id']: row for row in Productdetails.objects.using(using).filter(product_id__in=product_ids).values(*DETAILS_FIELDS)}
+    daily = load_daily_reviews(product_ids, using=using)
+
+    categories = set()
+    old_sentiments = {}
+    for product_id, category, sentiments in ProductAggregate.objects.filter(product_id__in=product_ids).values_list('product_id', 'category', 'sentiments'):
+        categories.add(category)
+        old_sentiments[product_id] = sentiments
+
+    products, reviews = [], []
+    for product_id in product_ids:
+        detail = details.get(product_id)
+        if detail is None:
+            continue
+        listing = listings.get(product_id, {})
+        review_info = daily.get(product_id, {})
+        period_reviews, total_reviews = relative_review_counts(review_info, as_of)
+        common = dict(
+            product_id=product_id, category=listing.get('category'), brand=detail['brand'] or listing.get('brand'),
+            model=detail['model'], subcategories=detail['subcategories'], product_title=detail['product_title'],
+            num_reviews=detail['num_reviews'], curr_price=detail['curr_price'], short_title=listing.get('short_title'),
+            is_duplicate=detail['is_duplicate'] if detail['is_duplicate'] is not None else listing.get('is_duplicate'),
+            duplicate_set=listing.get('duplicate_set'), total_reviews=total_reviews,
+        )
+        # Without a sentiment index the sentiments of the previous build are kept
+        if sentiment_index is not None:
+            sentiments = json.dumps(sentiment_index.product_counts(product_id))
+        else:
+            sentiments = old_sentiments.get(product_id)
+        products.append(ProductAggregate(
+            **common, review_info=period_reviews, featurewise_reviews=detail['featurewise_reviews'],
+            listing_reviews=listing.get('total_ratings'), sentiments=sentiments,
+        ))
+        reviews.append(ReviewAggregate(**common, review_info=json.dumps(review_info)))
+        categories.add(common['category'])
+
+    with transaction.atomic():
+        ProductAggregate.objects.filter(product_id__in=product_ids).delete()
+        ReviewAggregate.objects.filter(product_id__in=product_ids).delete()
+        ProductAggregate.objects.bulk_create(products)
+        ReviewAggregate.objects.bulk_create(reviews)
+
+    categories.discard(None)
+    return categories
+
+
+def refresh_relative_counts(as_of, chunk_size=CHUNK_SIZE):
+    """Recomputes the period / monthly review counts of every product relative to `as_of`, from the daily counts
+    of `ReviewAggregate`. Only the rows that differ are written. Returns the categories of the changed rows
+    """
+    current = {}
+    for product_id, review_info, total_reviews in ProductAggregate.objects.values_list('product_id', 'review_info', 'total_reviews').iterator():
+        current[product_id] = (review_info, total_reviews)
+
+    categories = set()
+    products, reviews = [], []
+    for product_id, category, review_info in ReviewAggregate.objects.values_list('product_id', 'category', 'review_info').iterator():
+        if product_id not in current:
+            continue
+        try:
+            daily = json.loads(review_info) if review_info else {}
+        except ValueError:
+            continue
+        period_reviews, total_reviews = relative_review_counts(daily, as_of)
+        if current[product_id] == (period_reviews, total_reviews):
+            continue
+        products.append(ProductAggregate(product_id=product_id, review_info=period_reviews, total_reviews=total_reviews))
+        reviews.append(ReviewAggregate(product_id=product_id, total_reviews=total_reviews))
+        categories.add(category)
+
+    with transaction.atomic():
+        ProductAggregate.objects.bulk_update(products, ['review_info', 'total_reviews'], batch_size=chunk_size)
+        ReviewAggregate.objects.bulk_update(reviews, ['total_reviews'], batch_size=chunk_size)
+
+    categories.discard(None)
+    return categories
+
+
+def build_aggregates(full=False, chunk_size=CHUNK_SIZE, sentiment_index=None, using='scraped'):
+    """Rebuilds the aggregates of the products whose details were completed or which got new reviews since the
+    last build, or of every product if `full` (which also drops the products gone from the scraped DB).
+    Returns the number of rebuilt products and the set of categories whose aggregates changed
+    """
+    if sentiment_index is None:
+        sentiment_index = load_sentiment_index()
+
+    details_mark, reviews_mark = get_watermark('details'), get_watermark('reviews')
+    details = Productdetails.objects.using(using)
+    reviews = Reviews.objects.using(using)
+
+    # Bounds are read first: rows scraped during the build are left to the next one
+    last_completed = details.aggregate(last_date=Max('date_completed'))['last_date']
+    bounds = reviews.aggregate(last_date=Max('review_date'), last_id=Max('id'))
+    # Periods are counted back from the latest review, like the daily series (see timeseries.py)
+    as_of = (bounds['last_date'] or datetime.datetime.now()).date()
+
+    categories = set()
+    if full:
+        product_ids = set(details.values_list('product_id', flat=True))
+        stale = [(product_id, category) for product_id, category in ProductAggregate.objects.values_list('product_id', 'category').iterator() if product_id not in product_ids]
+        stale_ids = [product_id for product_id, _ in stale]
+        with transaction.atomic():
+            for idx in range(0, len(stale_ids), chunk_size):
+                ProductAggregate.objects.filter(product_id__in=stale_ids[idx:idx + chunk_size]).delete()
+                ReviewAggregate.objects.filter(product_id__in=stale_ids[idx:idx + chunk_size]).delete()
+        categories.update(category for _, category in stale)
+    else:
+        product_ids = set()
+        if last_completed is not None:
+            completed = details.filter(date_completed__lte=last_completed)
+            if details_mark.last_date is not None:
+                completed = completed.filter(date_completed__gt=details_mark.last_date)
+            product_ids.update(completed.values_list('product_id', flat=True))
+        # Reviews are matched on their id: a scrape can add reviews dated before the latest review_date
+        if bounds['last_id'] is not None:
+            new_reviews = reviews.filter(id__lte=bounds['last_id'], product__isnull=False)
+            if reviews_mark.last_id is not None:
+                new_reviews = new_reviews.filter(id__gt=reviews_mark.last_id)
+            product_ids.update(new_reviews.values_list('product_id', flat=True).distinct())
+
+    ordered = sorted(product_ids)
+    for idx in range(0, len(ordered), chunk_size):
+        categories |= build_chunk(ordered[idx:idx + chunk_size], as_of, sentiment_index=sentiment_index, using=using)
+
+    if full or reviews_mark.last_date is None or reviews_mark.last_date.date() != as_of:
+        categories |= refresh_relative_counts(as_of, chunk_size=chunk_size)
+
+    if last_completed is not None and (details_mark.last_date is None or last_completed > details_mark.last_date):
+        details_mark.last_date = last_completed
+    details_mark.save()
+    if bounds['last_id'] is not None:
+        reviews_mark.last_date, reviews_mark.last_id = bounds['last_date'], bounds['last_id']
+    reviews_mark.save()
+
+    categories.discard(None)
+    return len(ordered), categories
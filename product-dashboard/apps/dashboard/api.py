@@ -1,38 +1,39 @@
-import copy
-import csv
-import datetime
-import io
-import itertools
-import json
 import os
-import traceback
-import uuid
-
-from decouple import config
-from django.apps import apps
-from django.conf import settings
-from django.contrib.auth import authenticate, login
-from django.core.mail import EmailMessage, get_connection
-from django.db.models import Avg, Count, F
-from django.http import Http404
-from django.shortcuts import get_object_or_404
+
+from django.core.mail import EmailMessage
+from django.http import HttpResponse, StreamingHttpResponse
 from django.template.loader import render_to_string
-from django.utils.encoding import force_bytes, force_text
-from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
-from rest_framework import generics, permissions, status
+from rest_framework import status
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from apps.accounts.api import AdminAuthenticationPermission
-from apps.taskscheduler.management import REVIEW_DATAFRAME
-
-from .models import (Dailyproductlisting, ProductAggregate, Productdetails,
-                     Productlisting, Qanda, ReviewAggregate, Reviews,
-                     SubcategoryMap)
+from apps.taskscheduler.management import get_review_index
+
+from .models import (Dailyproductlisting, ProductAggregate, Productlisting,
+                     Qanda, Reviews)
+from .cache import get_response_cache
+from .exports import (EXPORT_MODELS, attachment_part, export_queryset,
+                      file_size, iter_csv, iter_gzip, max_attachment_size,
+                      spooled_export)
+from .metrics import get_registry, load_json
+from .paginator import COUNT_ESTIMATED, COUNT_EXACT, paginated_response
+from .search import KINDS, search_settings
+from .search import search as search_documents
+from .snapshot import MAX_WIDGETS, WidgetError, compute_widget, compute_widgets
 from .serializers import (DailyProductListingSerializer,
-                          ProductDetailSerializer, ProductListingSerializer,
-                          QandASerializer, ReviewSerializer)
+                          ProductListingSerializer, QandASerializer,
+                          ReviewSerializer)
+
+
+def widget_response(category, widget_type, params):
+    # The analytics endpoints are adapters over the snapshot engine (see snapshot.py)
+    try:
+        return Response(compute_widget(category, widget_type, params), status=status.HTTP_200_OK)
+    except WidgetError as ex:
+        return Response(str(ex), status=status.HTTP_400_BAD_REQUEST)
 
 
 class DashboardListing(APIView):
@@ -46,53 +47,36 @@ class DashboardListing(APIView):
 
 class DashboardProductListing(APIView):
 
+    count_mode = COUNT_EXACT
 
     def get(self, request, page_no=None):
         """Lists the Product Listing in the Dashboard
         """
-        queryset = Productlisting.objects.using('scraped').all()
-        if page_no is None:
-            page_no = 1
-        if page_no <= 0:
-            return Response("Page Number must be >= 1", status=status.HTTP_400_BAD_REQUEST)
-        
-        ITEMS_PER_PAGE = 10
-        queryset = queryset[(page_no - 1) * ITEMS_PER_PAGE : (page_no) * ITEMS_PER_PAGE]
-        
-        serializer = ProductListingSerializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        queryset = Productlisting.objects.all()
+        return paginated_response(request, self, queryset, ProductListingSerializer, ordering='product_id', page_no=page_no)
 
 
 class DashboardDailyProductListing(APIView):
 
+    count_mode = COUNT_ESTIMATED
 
     def get(self, request, page_no=None):
         """Lists the Daily Product Listing in the Dashboard
         """
         query_params = request.query_params
         
-        if query_params in ({}, None):
-            queryset = Dailyproductlisting.objects.using('scraped').all()
-        else:
-            if 'category' in query_params:
-                queryset = Dailyproductlisting.objects.using('scraped').filter(category=query_params['category'])
-            elif 'product_id' in query_params:
-                queryset = Dailyproductlisting.objects.using('scraped').filter(product_id=query_params['product_id'])
-        
-        if page_no is None:
-            page_no = 1
-        if page_no <= 0:
-            return Response("Page Number must be >= 1", status=status.HTTP_400_BAD_REQUEST)
+        queryset = Dailyproductlisting.objects.all()
+        if 'category' in query_params:
+            queryset = queryset.filter(category=query_params['category'])
+        elif 'product_id' in query_params:
+            queryset = queryset.filter(product_id=query_params['product_id'])
         
-        ITEMS_PER_PAGE = 10
-        queryset = queryset[(page_no - 1) * ITEMS_PER_PAGE : (page_no) * ITEMS_PER_PAGE]
-        
-        serializer = DailyProductListingSerializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return paginated_response(request, self, queryset, DailyProductListingSerializer, ordering='id', page_no=page_no)
 
 
 class DashboardReviews(APIView):
 
+    count_mode = COUNT_ESTIMATED
 
     def get(self, request, product_id=None, page_no=None):
         if request.query_params == {}:
@@ -106,63 +90,36 @@ class DashboardReviews(APIView):
         
         review_type = request.query_params['type']
 
-        if page_no is None:
-            page_no = 1
-        if page_no <= 0:
-            return Response("Page Number must be >= 1", status=status.HTTP_400_BAD_REQUEST)
+        threshold = 3.0
+        queryset = Reviews.objects.filter(rating__isnull=False)
+        if product_id != 'all':
+            queryset = queryset.filter(product_id=product_id)
 
         if review_type == 'positive':
             # Positive Reviews
-            threshold = 3.0
-            if product_id == 'all':
-                queryset = Reviews.objects.using('scraped').filter(rating__isnull=False, rating__gte=threshold)
-            else:
-                queryset = Reviews.objects.using('scraped').filter(product_id=product_id, rating__isnull=False, rating__gte=threshold)
-            
-            ITEMS_PER_PAGE = 10
-            queryset = queryset[(page_no - 1) * ITEMS_PER_PAGE : (page_no) * ITEMS_PER_PAGE]
-            
-            serializer = ReviewSerializer(queryset, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        elif review_type == 'negative':
+            queryset = queryset.filter(rating__gte=threshold)
+        else:
             # Negative Reviews
-            threshold = 3.0
-            if product_id == 'all':
-                queryset = Reviews.objects.using('scraped').filter(rating__isnull=False, rating__lt=threshold)
-            else:
-                queryset = Reviews.objects.using('scraped').filter(product_id=product_id, rating__isnull=False, rating__lt=threshold)
+            queryset = queryset.filter(rating__lt=threshold)
 
-            ITEMS_PER_PAGE = 10
-            queryset = queryset[(page_no - 1) * ITEMS_PER_PAGE : (page_no) * ITEMS_PER_PAGE]
-            
-            serializer = ReviewSerializer(queryset, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        return Response("Invalid Request", status=status.HTTP_400_BAD_REQUEST)
+        return paginated_response(request, self, queryset, ReviewSerializer, ordering='id', page_no=page_no)
 
 
 class DashboardQandA(APIView):
 
+    count_mode = COUNT_EXACT
 
     def get(self, request, product_id=None, page_no=None):
         """Lists the QandAs in the Dashboard
         """
         if product_id is None:
             return Response("product_id cannot be null", status=status.HTTP_400_BAD_REQUEST)
-        
-        if page_no is None:
-            page_no = 1
-        if page_no <= 0:
-            return Response("Page Number must be >= 1", status=status.HTTP_400_BAD_REQUEST)
 
-        queryset = Qanda.objects.using('scraped').filter(product_id=product_id)
-        if queryset.count() == 0:
+        queryset = Qanda.objects.filter(product_id=product_id)
+        if not queryset.exists():
             return Response(f"No QandA exists for this product - {product_id}", status=status.HTTP_404_NOT_FOUND)
         
-        ITEMS_PER_PAGE = 10
-        queryset = queryset[(page_no - 1) * ITEMS_PER_PAGE : (page_no) * ITEMS_PER_PAGE]
-        
-        serializer = QandASerializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return paginated_response(request, self, queryset, QandASerializer, ordering='id', page_no=page_no)
 
 
 class BrandListAPI(APIView):
@@ -170,156 +127,20 @@ class BrandListAPI(APIView):
     #permission_classes = [IsAuthenticated, AdminAuthenticationPermission]
 
     def get(self, request, category):
-        query_params = request.query_params
-        if 'subcategory' not in query_params:
-            subcategory = None
-        else:
-            subcategory = query_params['subcategory']
-        
-        if subcategory is None:
-            subcategories = None
-        else:
-            q = SubcategoryMap.objects.filter(category=category)
-            if q:
-                try:
-                    subcategories = json.loads(q.first().subcategory_map)[subcategory]
-                except:
-                    try:
-                        _map = json.loads(q.first().subcategory_map)
-                        flag = False
-                        for name in _map:
-                            for subc in _map[name]:
-                                if subc == subcategory:
-                                    subcategories = [subcategory]
-                                    flag = True
-                        if flag == False:
-                            return Response(f"subcategory {subcategory} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-                    except:
-                        return Response(f"subcategory {subcategory} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-
-        agg = []
-        idx = 0
-        if subcategories is not None:
-            for subcategory in subcategories:
-                if idx == 0:
-                    agg = ProductAggregate.objects.filter(is_duplicate=False, category=category, brand__isnull=False, model__isnull=False, subcategories__iregex=f'.*"{subcategory}".*')
-                else:
-                    queryset = ProductAggregate.objects.filter(is_duplicate=False, brand__isnull=False, category=category, subcategories__iregex=f'.*"{subcategory}".*')
-                    agg = agg.union(queryset)
-                idx += 1
-            agg = agg.values_list('brand', flat=True).order_by('pk').distinct().order_by()
-        else:
-            agg = ProductAggregate.objects.filter(is_duplicate=False, category=category, brand__isnull=False, model__isnull=False).order_by('pk').values_list('brand', flat=True).distinct().order_by()
-
-        return Response(agg, status=status.HTTP_200_OK)
+        return widget_response(category, 'brandlist', {'subcategory': request.query_params.get('subcategory')})
 
 
 class ModelListAPI(APIView):
 
     def get(self, request, category, brand):
-        query_params = request.query_params
-        
-        if 'subcategory' not in query_params:
-            subcategory = None
-        else:
-            subcategory = query_params['subcategory']
-        
-        if subcategory is None:
-            subcategories = None
-        else:
-            q = SubcategoryMap.objects.filter(category=category)
-            if q:
-                try:
-                    subcategories = json.loads(q.first().subcategory_map)[subcategory]
-                except:
-                    try:
-                        _map = json.loads(q.first().subcategory_map)
-                        flag = False
-                        for name in _map:
-                            for subc in _map[name]:
-                                if subc == subcategory:
-                                    subcategories = [subcategory]
-                                    flag = True
-                        if flag == False:
-                            return Response(f"subcategory {subcategory} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-                    except:
-                        return Response(f"subcategory {subcategory} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-
-        agg = []
-        idx = 0
-        if subcategories is not None:
-            for subcategory in subcategories:
-                if idx == 0:
-                    agg = ProductAggregate.objects.filter(is_duplicate=False, category=category, brand__iexact=brand, model__isnull=False, subcategories__iregex=f'.*"{subcategory}".*')
-                else:
-                    queryset = ProductAggregate.objects.filter(is_duplicate=False, brand__iexact=brand, category=category, model__isnull=False, subcategories__iregex=f'.*"{subcategory}".*')
-                    agg = agg.union(queryset)
-                idx += 1
-            agg = agg.values_list('short_title', flat=True).distinct().order_by()
-            #agg = agg.values_list('model', flat=True).distinct().order_by()
-        else:
-            agg = ProductAggregate.objects.filter(is_duplicate=False, category=category, brand__iexact=brand, model__isnull=False).values_list('short_title', flat=True).distinct().order_by()
-            #agg = ProductAggregate.objects.filter(is_duplicate=False, category=category, brand__iexact=brand, model__isnull=False).values_list('model', flat=True).distinct().order_by()
-
-        return Response(agg, status=status.HTTP_200_OK)
+        return widget_response(category, 'modellist', {'brand': brand, 'subcategory': request.query_params.get('subcategory')})
 
 
 class BrandandModelListAPI(APIView):
 
     def get(self, request, category):
-        query_params = request.query_params
-        if 'subcategory' not in query_params:
-            subcategory = None
-        else:
-            subcategory = query_params['subcategory']
-        
-        if subcategory is None:
-            subcategories = None
-        else:
-            q = SubcategoryMap.objects.filter(category=category)
-            if q:
-                try:
-                    subcategories = json.loads(q.first().subcategory_map)[subcategory]
-                except:
-                    try:
-                        _map = json.loads(q.first().subcategory_map)
-                        flag = False
-                        for name in _map:
-                            for subc in _map[name]:
-                                if subc == subcategory:
-                                    subcategories = [subcategory]
-                                    flag = True
-                        if flag == False:
-                            return Response(f"subcategory {subcategory} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-                    except:
-                        return Response(f"subcategory {subcategory} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-
-        agg = []
-        idx = 0
-        if subcategories is not None:
-            for subcategory in subcategories:
-                if idx == 0:
-                    agg = ProductAggregate.objects.filter(is_duplicate=False, category=category, brand__isnull=False, model__isnull=False, subcategories__iregex=f'.*"{subcategory}".*')
-                else:
-                    queryset = ProductAggregate.objects.filter(is_duplicate=False, brand__isnull=False, category=category, subcategories__iregex=f'.*"{subcategory}".*')
-                    agg = agg.union(queryset)
-                idx += 1
-            agg = agg.values('brand', 'model', 'num_reviews', 'short_title').order_by('pk').distinct().order_by()
-        else:
-            agg = ProductAggregate.objects.filter(is_duplicate=False, category=category, brand__isnull=False, model__isnull=False).order_by('pk').values('brand', 'model', 'short_title', 'num_reviews').distinct().order_by('-num_reviews')
-
-        results = {}
-        for item in agg:
-            model = item['short_title']
-            brand = item['brand']
-            if brand not in results:
-                results[brand] = set()            
-            results[brand].add(model)
-        
-        for brand in results:
-            results[brand] = list(results[brand])
-        
-        return Response(results, status=status.HTTP_200_OK)
+        # {brand: [models]}, most reviewed first
+        return widget_response(category, 'brand-model', {'subcategory': request.query_params.get('subcategory')})
 
 
 class ReviewBreakDownAPI(APIView):
@@ -350,7 +171,7 @@ class ReviewBreakDownAPI(APIView):
             if instance is None:
                 return Response(f"No such model - {model}", status=status.HTTP_404_NOT_FOUND)
         
-        return Response({'product_title': instance.product_title, 'model': model, 'brand': instance.brand, 'sentiments': json.loads(instance.sentiments)}, status=status.HTTP_200_OK)
+        return Response({'product_title': instance.product_title, 'model': model, 'brand': instance.brand, 'sentiments': load_json(instance.sentiments)}, status=status.HTTP_200_OK)
 
 
 class GetFeaturesAPI(APIView):
@@ -379,14 +200,7 @@ class GetFeaturesAPI(APIView):
 
 class SentimentReviewsAPI(APIView):
 
-    @staticmethod
-    def get_range_dataframe(indexed_df, product_id, feature, sentiment_type='pos'):
-        if sentiment_type == 'pos':
-            return indexed_df[((indexed_df['product_id'] == product_id) & (indexed_df[feature] > 0))]['id']
-        elif sentiment_type == 'neg':
-            return indexed_df[((indexed_df['product_id'] == product_id) & (indexed_df[feature] < 0))]['id']
-        else:
-            return None
+    MAX_IDS_PER_QUERY = 1000
 
 
     def get(self, request, category):
@@ -409,7 +223,6 @@ class SentimentReviewsAPI(APIView):
         if 'feature' not in query_params:
             return Response(f"`feature` needs to be sent in query params", status=status.HTTP_400_BAD_REQUEST)
         
-        model = query_params['model']
         feature = query_params['feature']
 
         if 'sentiment_type' not in query_params:
@@ -420,6 +233,18 @@ class SentimentReviewsAPI(APIView):
         if sentiment_type not in ('pos', 'neg',):
             return Response(f"Sentiment Type can only be `pos` or `neg`", status=status.HTTP_400_BAD_REQUEST)
         
+        # Optional paging over review ids: `after` is the last id seen
+        try:
+            after = int(query_params['after']) if 'after' in query_params else None
+            limit = int(query_params['limit']) if 'limit' in query_params else None
+            assert limit is None or limit > 0
+        except (AssertionError, ValueError):
+            return Response("`after` and `limit` must be integers", status=status.HTTP_400_BAD_REQUEST)
+        
+        review_index = get_review_index()
+        if review_index is None:
+            return Response("Sentiment index is not loaded", status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        
         if product_id is not None:
             instance = ProductAggregate.objects.filter(category=category, product_id=f'{product_id}').order_by('-num_reviews').first()
             if instance is None:
@@ -429,193 +254,29 @@ class SentimentReviewsAPI(APIView):
             if instance is None:
                 return Response(f"No such model - {model}", status=status.HTTP_404_NOT_FOUND)
         
-        review_ids = SentimentReviewsAPI.get_range_dataframe(REVIEW_DATAFRAME, instance.product_id, feature, sentiment_type)
+        review_ids = review_index.lookup(instance.product_id, feature, sentiment_type, after=after, limit=limit).tolist()
         
-        if review_ids is None:
-            return Response([], status=status.HTTP_200_OK)
-        
-        # Fetch reviews from Scraped DB
-        queryset = Reviews.objects.using('scraped').filter(pk__in=list(review_ids)).values('title', 'body', 'review_date', 'rating',)
+        # Fetch reviews from Scraped DB, in bounded id batches
+        results = []
+        for idx in range(0, len(review_ids), self.MAX_IDS_PER_QUERY):
+            queryset = Reviews.objects.filter(pk__in=review_ids[idx:idx + self.MAX_IDS_PER_QUERY]).values('id', 'title', 'body', 'review_date', 'rating',).order_by('id')
+            results.extend(queryset)
 
-        return Response(queryset, status=status.HTTP_200_OK)
+        return Response(results, status=status.HTTP_200_OK)
 
 
 class RatingsoverTimeAPI(APIView):
     
 
     def get(self, request, category):
-        # For last 3 months
+        # Average rating over consecutive windows (weekly by default) ending on `end_date`
         query_params = request.query_params
         
         if 'brand' not in query_params:
             return Response("Need to specify a brand", status=status.HTTP_400_BAD_REQUEST)
         
-        brands = request.GET.getlist('brand')
-
-        NUM_WEEKS = 8
-
-        if 'weeks' not in query_params:
-            pass
-        else:
-            NUM_WEEKS = int(query_params['weeks'])
-
-        final_results = {}
-
-        if 'subcategory' not in query_params:
-            subcategory = None
-        else:
-            subcategory = query_params['subcategory']
-        
-        if subcategory is None:
-            subcategories = None
-        else:
-            q = SubcategoryMap.objects.filter(category=category)
-            if q:
-                try:
-                    subcategories = json.loads(q.first().subcategory_map)[subcategory]
-                except:
-                    try:
-                        _map = json.loads(q.first().subcategory_map)
-                        flag = False
-                        for name in _map:
-                            for subc in _map[name]:
-                                if subc == subcategory:
-                                    subcategories = [subcategory]
-                                    flag = True
-                        if flag == False:
-                            return Response(f"subcategory {subcategory} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-                    except:
-                        return Response(f"subcategory {subcategory} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-
-        for brand in brands:
-            if brand not in final_results:
-                final_results[brand] = []
-                agg = []
-                idx = 0
-                if subcategories is not None:
-                    for subcategory in subcategories:
-                        if idx == 0:
-                            agg = ProductAggregate.objects.filter(brand__iexact=brand, category=category, subcategories__iregex=f'.*"{subcategory}".*')
-                        else:
-                            queryset = ProductAggregate.objects.filter(brand__iexact=brand, category=category, subcategories__iregex=f'.*"{subcategory}".*')
-                            agg = agg.union(queryset)
-                        idx += 1
-                else:
-                    agg = ProductAggregate.objects.filter(brand__iexact=brand, category=category)
-            
-            queryset = agg.values('product_title', 'product_id', 'model', 'short_title', 'duplicate_set')
-
-            results = []
-            
-            duplicate_sets = set()
-            short_titles = set()
-
-            last_date = datetime.datetime(year=2020, month=9, day=30)
-            # first_date = last_date - datetime.timedelta(weeks=4*NUM_MONTHS)
-
-            # { "brand":"apple", "model":"airpod" [ { "date":"07-28-2020", "rating":3.4 } ] }
-
-            for item in queryset:
-                product_id = item['product_id']
-                model = item['model']
-                product_title = item['product_title']
-                short_title = item['short_title']
-                duplicate_set = item['duplicate_set']
-                if duplicate_set in duplicate_sets or short_title in short_titles:
-                    continue
-                else:
-                    duplicate_sets.add(duplicate_set)
-                    short_titles.add(short_title)
-                    result = []
-                try:
-                    _queryset = ReviewAggregate.objects.filter(duplicate_set=item['duplicate_set']).order_by('num_reviews')
-
-                    review_info = {}
-
-                    for instance in _queryset:
-                        temp = json.loads(instance.review_info) if instance.review_info else {}
-                        for val in temp:
-                            if "rating" not in temp[val] or temp[val]['rating'] in (None, "NaN", 0,):
-                                if val not in review_info:
-                                    review_info[val] = temp[val]
-                                continue
-                            else:
-                                review_info[val] = temp[val]
-                        break
-                                
-                    #review_info = json.loads(instance.review_info) if instance.review_info else {}
-
-                    flag = False
-
-                    for week in range(NUM_WEEKS+1):
-                        weekly_reviews = 0
-                        weekly_total = 0
-                        start_date = last_date - datetime.timedelta(days=week*7)
-                        if week == 8:   
-                            end_date = datetime.datetime(year=2020, month=8, day=1)
-                        else:
-                            end_date = last_date - datetime.timedelta(days=week*7 + 7 - 1)
-
-                        for day in range(week*7, week*7 + 7):
-                            # Last 1 week
-                            curr_day = last_date - datetime.timedelta(days=day)
-                            prev_day = curr_day - datetime.timedelta(days=1)
-                            _date = prev_day.strftime("%d/%m/%Y")
-                            
-                            '''
-                            try:
-                                if prev_day.month == 8 and flag == False:
-                                    # Route august reviews
-                                    __queryset = ReviewAggregate.objects.using('august').filter(duplicate_set=item['duplicate_set']).order_by('num_reviews')
-                                    #review_info = json.loads(aug_instance.review_info) if aug_instance.review_info else {}
-                                    review_info = {}
-
-                                    for _instance in __queryset:
-                                        temp = json.loads(_instance.review_info) if _instance.review_info else {}
-                                        for val in temp:
-                                            if "rating" not in temp[val] or temp[val]['rating'] in (None, "NaN", 0,):
-                                                if val not in review_info:
-                                                    review_info[val] = temp[val]
-                                                continue
-                                            else:
-                                                review_info[val] = temp[val]
-                                    flag = True
-                            except Exception as ex:
-                                traceback.print_exc()
-                                print(ex)
-                                print(f"Error during routing August Reviews")
-                            '''
-                            
-
-                            if _date in review_info:
-                                value = review_info[_date]
-                                if 'num_reviews' not in value:
-                                    print(f"KeyError: {value} has no num_reviews")
-                                weekly_reviews += value["num_reviews"]
-                                try:
-                                    if value["rating"] == 'NaN':
-                                        continue
-                                    weekly_total += int(round(float(value["rating"]) * float(value["num_reviews"])))
-                                except Exception as ex:
-                                    print(f"Error during counting reviews: {ex}")
-                                #result.append({"date": _date, "rating": value["rating"], "num_reviews": value["num_reviews"]})
-                        try:
-                            avg_reviews = weekly_total / weekly_reviews
-                        except ZeroDivisionError:
-                            avg_reviews = "NaN"
-                         
-                        result.append({"start_date": start_date.strftime("%d/%m/%Y"), "end_date": end_date.strftime("%d/%m/%Y"), "rating": avg_reviews, "num_reviews": weekly_reviews})
-                
-                    results.append({"product_title": product_title, "model": short_title, "ratings": result, "duplicate_set": duplicate_set})
-                except Exception as ex:
-                    traceback.print_exc()
-                    print(ex)
-                    results.append({"product_title": product_title, "model": short_title, "ratings": result, "duplicate_set": duplicate_set})
-                    continue
-            
-            final_results[brand] = results
-        
-        return Response(final_results, status=status.HTTP_200_OK)
+        params = {name: query_params[name] for name in ('subcategory', 'weeks', 'window', 'windows', 'end_date') if name in query_params}
+        return widget_response(category, 'rating', {**params, 'brand': request.GET.getlist('brand')})
 
 
 class AspectBasedRatingAPI(APIView):
@@ -629,174 +290,32 @@ class AspectBasedRatingAPI(APIView):
         if 'brand' not in query_params:
             return Response("Need to specify a brand", status=status.HTTP_400_BAD_REQUEST)
         
-        brands = request.GET.getlist('brand')
+        return widget_response(category, 'aspect-rating', {'brand': request.GET.getlist('brand'), 'subcategory': query_params.get('subcategory')})
 
-        final_results = {}
 
-        if 'subcategory' not in query_params:
-            subcategory = None
-        else:
-            subcategory = query_params['subcategory']
-        
-        if subcategory is None:
-            subcategories = None
-        else:
-            q = SubcategoryMap.objects.filter(category=category)
-            if q:
-                try:
-                    subcategories = json.loads(q.first().subcategory_map)[subcategory]
-                except:
-                    try:
-                        _map = json.loads(q.first().subcategory_map)
-                        flag = False
-                        for name in _map:
-                            for subc in _map[name]:
-                                if subc == subcategory:
-                                    subcategories = [subcategory]
-                                    flag = True
-                        if flag == False:
-                            return Response(f"subcategory {subcategory} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-                    except:
-                        return Response(f"subcategory {subcategory} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-
-        for brand in brands:
-            agg = []
-            idx = 0
-            queryset = ProductAggregate.objects.filter(category=category, brand__iexact=brand).values('product_title', 'model', 'featurewise_reviews', 'short_title', 'duplicate_set')
-            results = []
-            duplicate_sets = set()
-            short_titles = set()
-
-            if subcategories is not None:
-                for subcategory in subcategories:
-                    if idx == 0:
-                        agg = ProductAggregate.objects.filter(brand__iexact=brand, category=category, subcategories__iregex=f'.*"{subcategory}".*')
-                    else:
-                        queryset = ProductAggregate.objects.filter(brand__iexact=brand, category=category, subcategories__iregex=f'.*"{subcategory}".*')
-                        agg = agg.union(queryset)
-                    idx += 1
-            else:
-                agg = ProductAggregate.objects.filter(brand__iexact=brand, category=category)
-            
-            queryset = agg.values('product_title', 'featurewise_reviews', 'model', 'short_title', 'duplicate_set')
-
-            for item in queryset:
-                if item['duplicate_set'] in duplicate_sets or item['short_title'] in short_titles:
-                    continue
-                if item['featurewise_reviews'] is None:
-                    item['featurewise_reviews'] = json.dumps({})
-                duplicate_sets.add(item['duplicate_set'])
-                short_titles.add(item['short_title'])
-                #models.add(item['short_title'])
-                _item = {"product_title": item['product_title'], "model": item['short_title'], "aspect_rating": {**(json.loads(item['featurewise_reviews']))}}
-                results.append(_item)
-            final_results[brand] = results
-        
-        return Response(final_results, status=status.HTTP_200_OK)
+class AspectComparisonAPI(APIView):
+
+    def get(self, request, category):
+        """Aspect scores per brand (`brand` repeated, all brands by default), or per leaf with `group_by=subcategory`:
+        mean, mean weighted by review count and percentiles (`percentile` repeated, 25/50/75 by default), aligned with `aspects`
+        """
+        query_params = request.query_params
+        params = {name: query_params[name] for name in ('subcategory', 'group_by') if name in query_params}
+        for name in ('brand', 'aspect', 'percentile'):
+            params[name] = query_params.getlist(name)
+        return widget_response(category, 'aspect-comparison', params)
 
 
 class BrandMarketShare(APIView):
 
     def get(self, request, category, max_products=10, period=None):
         # Get the brand Market Share
-        # Output: brand, model, num_reviews
-        # Period can be '1M', '3M', '6M'
-
-        if max_products <= 0:
-            return Response("max_products must be a positive integer", status=status.HTTP_400_BAD_REQUEST)
-
-        # Count number of reviews until the last N months
-        if period is None:
-            period = 1
-        else:
-            if period not in (1, 3, 6, 8, 9):
-                return Response("Period must be one of 1, 3 or 6, 8, 9", status=status.HTTP_400_BAD_REQUEST)
-        
+        # Output: brand, num_reviews
+        # Period can be '1M', '3M', '6M', '8M', '9M'
+        # `start` / `end` (YYYY-MM-DD) count the reviews of that date range instead of the period
         query_params = request.query_params
-        if 'subcategory' not in query_params:
-            subcategory = None
-        else:
-            subcategory = query_params['subcategory']
-        
-        if subcategory is None:
-            subcategories = None
-        else:
-            q = SubcategoryMap.objects.filter(category=category)
-            if q:
-                try:
-                    subcategories = json.loads(q.first().subcategory_map)[subcategory]
-                except:
-                    try:
-                        _map = json.loads(q.first().subcategory_map)
-                        flag = False
-                        for name in _map:
-                            for subc in _map[name]:
-                                if subc == subcategory:
-                                    subcategories = [subcategory]
-                                    flag = True
-                        if flag == False:
-                            return Response(f"subcategory {subcategory} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-                    except:
-                        return Response(f"subcategory {subcategory} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-        
-        last_date = datetime.datetime.now() - datetime.timedelta(days=7)
-        first_date = last_date - datetime.timedelta(weeks=4*period)
-
-        agg = []
-        idx = 0
-        if subcategories is not None:
-            for subcategory in subcategories:
-                if idx == 0:
-                    agg = ProductAggregate.objects.filter(brand__isnull=False, model__isnull=False, category=category, subcategories__iregex=f'.*"{subcategory}".*')
-                else:
-                    queryset = ProductAggregate.objects.filter(brand__isnull=False, model__isnull=False, category=category, subcategories__iregex=f'.*"{subcategory}".*')
-                    agg = agg.union(queryset)
-                idx += 1
-        else:
-            agg = ProductAggregate.objects.filter(category=category, brand__isnull=False, model__isnull=False)
-        
-        queryset = agg.values('product_title', 'brand', 'model', 'product_id', 'review_info', 'short_title', 'duplicate_set').order_by('-review_info').distinct()
-
-
-        brands = dict()
-        results = []
-        duplicate_sets = set()
-        short_titles = set()
-
-        curr = 0
-
-        for item in queryset:
-            result = {}
-            result['brand'] = item['brand']
-            #result['model'] = item['model']
-            result['model'] = item['short_title']
-            result['product_title'] = item['product_title']
-
-            if item['duplicate_set'] in duplicate_sets or item['short_title'] in short_titles:
-                continue
-            else:
-                if item['duplicate_set'] not in duplicate_sets:
-                    duplicate_sets.add(item['duplicate_set'])
-                if item['short_title'] not in short_titles:
-                    short_titles.add(item['short_title'])
-
-            if result['brand'] not in brands:
-                brands[result['brand']] = dict()
-                brands[result['brand']]['product_title'] = result['product_title']
-                brands[result['brand']]['model'] = result['model']
-                brands[result['brand']]['reviews'] = 0
-                curr += 1
-            # Get Num reviews
-            num_reviews = json.loads(item['review_info'])[str(period)]
-            
-            if brands[result['brand']]['reviews'] != num_reviews:
-                brands[result['brand']]['reviews'] += num_reviews
-            
-        
-        for brand in brands:
-            results.append({'brand': brand, 'num_reviews': brands[brand]['reviews']})
-
-        return Response(sorted(results, key=lambda x: -x['num_reviews'])[:max_products], status=status.HTTP_200_OK)
+        params = {name: query_params[name] for name in ('subcategory', 'start', 'end') if name in query_params}
+        return widget_response(category, 'brandmarketshare', {**params, 'max_products': max_products, 'period': period})
 
 
 class CummulativeModelMarketShare(APIView):
@@ -805,143 +324,17 @@ class CummulativeModelMarketShare(APIView):
     def get(self, request, category, max_products=10, period=None):
         # Get the category Market Share
         # Output: brand, model, num_reviews
-        # Period can be '1M', '3M', '6M'
-
-        if max_products <= 0:
-            return Response("max_products must be a positive integer", status=status.HTTP_400_BAD_REQUEST)
-
-        # Count number of reviews until the last N months
-        if period is None:
-            period = 1
-        else:
-            if period not in (1, 3, 6, 8, 9):
-                return Response("Period must be one of 1, 3 or 6, 8, 9", status=status.HTTP_400_BAD_REQUEST)
-        
+        # Period can be '1M', '3M', '6M', '8M', '9M'
+        # `start` / `end` (YYYY-MM-DD) count the reviews of that date range instead of the period
         query_params = request.query_params
-        if 'subcategory' not in query_params:
-            subcategory = None
-        else:
-            subcategory = query_params['subcategory']
-        
-        if 'brand' not in query_params:
-            _brand = None
-        else:
-            _brand = query_params['brand']
-        
-        if subcategory is None:
-            subcategories = None
-        else:
-            q = SubcategoryMap.objects.filter(category=category)
-            if q:
-                try:
-                    subcategories = json.loads(q.first().subcategory_map)[subcategory]
-                except:
-                    try:
-                        _map = json.loads(q.first().subcategory_map)
-                        flag = False
-                        for name in _map:
-                            for subc in _map[name]:
-                                if subc == subcategory:
-                                    subcategories = [subcategory]
-                                    flag = True
-                        if flag == False:
-                            print("Flag is false")
-                            return Response(f"subcategory {subcategory} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-                    except:
-                        print("Exc cat mar share")
-                        return Response(f"subcategory {subcategory} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-        
-        last_date = datetime.datetime.now() - datetime.timedelta(days=7)
-        first_date = last_date - datetime.timedelta(weeks=4*period)
-
-        agg = []
-        idx = 0
-        if subcategories is not None:
-            for subcategory in subcategories:
-                if idx == 0:
-                    agg = ProductAggregate.objects.filter(brand__isnull=False, model__isnull=False, category=category, subcategories__iregex=f'.*"{subcategory}".*')
-                else:
-                    queryset = ProductAggregate.objects.filter(brand__isnull=False, model__isnull=False, category=category, subcategories__iregex=f'.*"{subcategory}".*')
-                    agg = agg.union(queryset)
-                idx += 1
-        else:
-            agg = ProductAggregate.objects.filter(category=category, brand__isnull=False, model__isnull=False)
-        
-        if _brand is not None:
-            agg = agg.filter(brand=_brand)
-
-        queryset = agg.values('product_title', 'brand', 'model', 'product_id', 'review_info', 'short_title', 'duplicate_set').order_by('-review_info').distinct()
-
-        models = dict()
-        results = []
-        duplicate_sets = set()
-        short_titles = set()
-
-        curr = 0
-
-        for item in queryset:
-            duplicate_set = item['duplicate_set']
-            short_title = item['short_title']
-            if duplicate_set in duplicate_sets or short_title in short_titles:
-                continue
-            else:
-                duplicate_sets.add(duplicate_set)
-            result = {}
-            result['brand'] = item['brand']
-            #result['model'] = item['model']
-            result['model'] = item['short_title']
-            result['product_title'] = item['product_title']
-
-            if result['model'] not in models:
-                models[result['model']] = dict()
-                models[result['model']]['product_title'] = result['product_title']
-                models[result['model']]['brand'] = result['brand']
-                models[result['model']]['reviews'] = 0
-                curr += 1
-            else:
-                continue
-            # Get Num reviews
-            num_reviews = json.loads(item['review_info'])[str(period)]
-            
-            if models[result['model']]['reviews'] != num_reviews:
-                models[result['model']]['reviews'] += num_reviews
-        
-        for model in models:
-            results.append({'product_title': models[model]['product_title'], 'model': model, 'brand': models[model]['brand'], 'num_reviews': models[model]['reviews']})
-
-        return Response(sorted(results, key=lambda x: -x['num_reviews'])[:max_products], status=status.HTTP_200_OK)
+        params = {name: query_params[name] for name in ('subcategory', 'brand', 'start', 'end') if name in query_params}
+        return widget_response(category, 'modelmarketshare', {**params, 'max_products': max_products, 'period': period})
 
 
 class FetchSubcategories(APIView):
 
-    def get(self, request, category):        
-        subcategories = set()
-        features = set()
-        prices = set()
-
-        if 'subcategory' in request.query_params:
-            subcategory = request.query_params['subcategory']
-        else:
-            subcategory = None
-        
-        qs = SubcategoryMap.objects.filter(category=category)
-        if qs.exists():
-            instance = qs.first()
-            if subcategory is not None:
-                subcategory_list = json.loads(instance.subcategory_map)[subcategory]
-                for subcategory in subcategory_list:
-                    subcategories.add(subcategory)
-            else:
-                subcategory_map = json.loads(instance.subcategory_map)
-                for subcategory in subcategory_map:
-                    if subcategory == "Price":
-                        for item in subcategory_map[subcategory]:
-                            prices.add(item)
-                    else:
-                        for item in subcategory_map[subcategory]:
-                            features.add(item)
-        
-        return Response({'features': list(features), 'price': list(prices)}, status=status.HTTP_200_OK)
+    def get(self, request, category):
+        return widget_response(category, 'fetchsubcategories', {'subcategory': request.query_params.get('subcategory')})
 
     
     def post(self, request, category):
@@ -975,12 +368,6 @@ class FetchSubcategories(APIView):
             except:
                 period = 1
 
-        if period not in (1, 3, 6, 8, 9):
-            return Response("Period must be one of 1, 3 or 6, 8, 9", status=status.HTTP_400_BAD_REQUEST)
-        
-        last_date = datetime.datetime.now() - datetime.timedelta(days=7)
-        first_date = last_date - datetime.timedelta(weeks=4*period)
-
         if ('subcategories' not in request.data):
             subcategories = request.POST.get('subcategories')
             #subcategories = request.POST.getlist('subcategories[]')
@@ -995,89 +382,9 @@ class FetchSubcategories(APIView):
 
         print(f"Max products = {max_products}, period = {period}")
 
-        _subcategories = SubcategoryMap.objects.filter(category=category)
-
-        if _subcategories:
-            try:
-                if subcategories == "all":
-                    _subcategories = list(itertools.chain(*(json.loads(_subcategories.first().subcategory_map).values())))
-                else:
-                    _subcategories = json.loads(_subcategories.first().subcategory_map)[subcategories]
-                subcategories = _subcategories
-            except:
-                try:
-                    _map = json.loads(_subcategories.first().subcategory_map)
-                    flag = False
-                    for name in _map:
-                        for subc in _map[name]:
-                            if subc == subcategories:
-                                subcategories = [subcategories]
-                                flag = True
-                    if flag == False:
-                        return Response(f"subcategory {subcategories} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-                except:
-                    return Response(f"subcategory {subcategories} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-        else:
-            return Response({}, status=status.HTTP_200_OK)
-        
-        print(subcategories)
-
-        #if not isinstance(subcategories, list):
-        #    return Response("subcategories must be a list", status=status.HTTP_400_BAD_REQUEST)
-
-        results = {}
-        duplicate_sets = set()
-        short_titles = set()
-
-        for subcategory in subcategories:
-            queryset = ProductAggregate.objects.filter(category=category, model__isnull=False, brand__isnull=False, subcategories__iregex=f'.*"{subcategory}".*').values('product_title', 'brand', 'model', 'product_id', 'review_info', 'subcategories', 'short_title', 'duplicate_set').order_by('-model').distinct()
-            subcategory_results = []
-            temp = {}
-            brands = {}
-
-            curr = 0
-
-            for item in queryset:
-                duplicate_set = item['duplicate_set']
-                short_title = item['short_title']
-                if duplicate_set in duplicate_sets or short_title in short_titles:
-                    continue
-                else:
-                    duplicate_sets.add(duplicate_set)
-                result = {}
-                result['brand'] = item['brand']
-                result['model'] = item['short_title']
-                #result['model'] = item['model']
-                result['product_title'] = item['product_title']
-                subcategories = [subcategory]
-                #subcategories = item['subcategories']
-                
-                #subcategories = json.loads(subcategories) if subcategories is not None else ["all"]
-
-                if result['brand'] not in brands:
-                    brands[result['brand']] = dict()
-                    brands[result['brand']]['product_title'] = result['product_title']
-                    brands[result['brand']]['model'] = result['model']
-                    brands[result['brand']]['reviews'] = json.loads(item['review_info'])[str(period)]
-                    brands[result['brand']]['subcategories'] = subcategories
-                    curr += 1
-                else:
-                    reviews = brands[result['brand']]['reviews']
-                    new_reviews = json.loads(item['review_info'])[str(period)]
-                    if (new_reviews != reviews):
-                        brands[result['brand']]['reviews'] += new_reviews
-            
-            for brand in brands:
-                for subcategory in brands[brand]['subcategories']:
-                    if subcategory in results:
-                        results[subcategory].append({'product_title': brands[brand]['product_title'], 'brand': brand, 'model': brands[brand]['model'], 'num_reviews': brands[brand]['reviews']})
-                    else:
-                        results[subcategory] = [{'product_title': brands[brand]['product_title'], 'brand': brand, 'model': brands[brand]['model'], 'num_reviews': brands[brand]['reviews']}]
-
-                # Sort by descending order of num_reviews
-                results[subcategory] = sorted(results[subcategory], key=lambda x: -x['num_reviews'])[:max_products]
-        
-        return Response(results, status=status.HTTP_200_OK)
+        # Brand totals per subcategory, each brand shown with its most reviewed model
+        params = {name: request.data[name] for name in ('start', 'end') if name in request.data}
+        return widget_response(category, 'fetchsubcategories', {**params, 'subcategories': subcategories, 'max_products': max_products, 'period': period})
 
 
 class SubCategoryMarketShare(APIView):
@@ -1086,263 +393,102 @@ class SubCategoryMarketShare(APIView):
     def get(self, request, category, subcategory, max_products=10, period=None):
         # Get the subcategory Market Share
         # Output: brand, model, num_reviews
-        # Period can be '1M', '3M', '6M'
+        # Period can be '1M', '3M', '6M', '8M', '9M'
+        # `start` / `end` (YYYY-MM-DD) count the reviews of that date range instead of the period
+        query_params = request.query_params
+        params = {name: query_params[name] for name in ('start', 'end') if name in query_params}
+        return widget_response(category, 'subcategorymarketshare', {**params, 'max_products': max_products, 'period': period, 'subcategory': subcategory})
 
-        if max_products <= 0:
-            return Response("max_products must be a positive integer", status=status.HTTP_400_BAD_REQUEST)
+class IndividualModelMarketShare(APIView):
 
-        # Count number of reviews until the last N months
-        if period is None:
-            period = 1
-        else:
-            if period not in (1, 3, 6, 8, 9):
-                return Response("Period must be one of 1, 3 or 6, 8, 9", status=status.HTTP_400_BAD_REQUEST)
+
+    def post(self, request, category=None):
+        # Get the individual model Market Share
+        # Output: subcategory, brand, model, num_reviews
+        # Period can be '1M', '3M', '6M', '8M', '9M'
+
+        if category is None:
+            if 'category' not in request.data:
+                return Response("Need to send category", status=status.HTTP_400_BAD_REQUEST)
+            category = request.data['category']
+
+        if  'model' not in request.data:
+            return Response("Need to send model", status=status.HTTP_400_BAD_REQUEST)
         
-        last_date = datetime.datetime.now() - datetime.timedelta(days=7)
-        first_date = last_date - datetime.timedelta(weeks=4*period)
+        params = {name: request.data[name] for name in ('model', 'subcategory', 'max_products', 'period', 'start', 'end') if name in request.data}
+        return widget_response(category, 'individualmarketshare', params)
 
-        if subcategory == 'all':
-            queryset = ProductAggregate.objects.filter(category=category, model__isnull=False, brand__isnull=False).values('product_title', 'brand', 'model', 'product_id', 'review_info', 'subcategories', 'short_title', 'duplicate_set').order_by('-model').distinct()
-        else:
-            queryset = ProductAggregate.objects.filter(category=category, model__isnull=False, brand__isnull=False, subcategories__iregex=f'.*"{subcategory}".*').values('product_title', 'brand', 'model', 'product_id', 'review_info', 'subcategories', 'short_title', 'duplicate_set').order_by('-model').distinct()
 
-        results = {}
-        subcategory_results = []
-        temp = {}
-        models = {}
-        duplicate_sets = set()
+class ReviewCount(APIView):
 
-        curr = 0
+    def get(self, request, category):
+        query_params = request.query_params
+        return widget_response(category, 'review-count', {'subcategory': query_params.get('subcategory'), 'period': query_params.get('period')})
 
-        for item in queryset:
-            if item['duplicate_set'] not in duplicate_sets:
-                duplicate_sets.add(item['duplicate_set'])
-            else:
-                continue
-            result = {}
-            result['brand'] = item['brand']
-            result['model'] = item['short_title']
-            #result['model'] = item['model']
-            result['product_title'] = item['product_title']
-            subcategories = [subcategory]
-            #subcategories = item['subcategories']
-            
-            #subcategories = json.loads(subcategories) if subcategories is not None else ["all"]
-
-            if result['model'] not in models:
-                models[result['model']] = dict()
-                models[result['model']]['product_title'] = result['product_title']
-                models[result['model']]['brand'] = result['brand']
-                models[result['model']]['reviews'] = json.loads(item['review_info'])[str(period)]
-                models[result['model']]['subcategories'] = subcategories
-                curr += 1          
-        
-        for model in models:
-            for subcategory in models[model]['subcategories']:
-                if subcategory in results:
-                    results[subcategory].append({'product_title': models[model]['product_title'], 'model': model, 'brand': models[model]['brand'], 'num_reviews': models[model]['reviews']})
-                else:
-                    results[subcategory] = [{'product_title': models[model]['product_title'], 'model': model, 'brand': models[model]['brand'], 'num_reviews': models[model]['reviews']}]
-
-            # Sort by descending order of num_reviews
-            results[subcategory] = sorted(results[subcategory], key=lambda x: -x['num_reviews'])[:max_products]
-        
-        return Response(results, status=status.HTTP_200_OK)
 
-class IndividualModelMarketShare(APIView):
 
+class BatchWidgetsAPI(APIView):
 
     def post(self, request, category):
-        # Get the individual model Market Share
-        # Output: subcategory, brand, model, num_reviews
-        # Period can be '1M', '3M', '6M'
+        """Computes several dashboard widgets of a category in one round-trip, from a single read of its aggregates.
+        Body: {"widgets": [{"id": "brands", "type": "brandmarketshare", "params": {"period": 3, "subcategory": "Wireless"}}, ...]}
+        Widget types are the names of the endpoints they stand for, see snapshot.WIDGETS
+        """
+        widgets = request.data.get('widgets') if isinstance(request.data, dict) else None
+        if not isinstance(widgets, list) or not all(isinstance(widget, dict) for widget in widgets):
+            return Response("widgets must be a list of widget specs", status=status.HTTP_400_BAD_REQUEST)
+        if len(widgets) > MAX_WIDGETS:
+            return Response(f"At most {MAX_WIDGETS} widgets per request", status=status.HTTP_400_BAD_REQUEST)
 
-        if 'subcategory' not in request.data:
-            subcategory = None
-        
-        if  'model' not in request.data:
-            return Response("Need to send model", status=status.HTTP_400_BAD_REQUEST)
-        
-        model = request.data['model']
-        
-        if 'max_products' in request.data:
-            max_products = request.data['max_products']
-        else:
-            max_products = 10
-        
-        if 'period' not in request.data:
-            period = 6
-        else:
-            period = request.data['period']
+        return Response(compute_widgets(category, widgets), status=status.HTTP_200_OK)
 
-        if max_products <= 0:
-            return Response("max_products must be a positive integer", status=status.HTTP_400_BAD_REQUEST)
 
-        # Count number of reviews until the last N months
-        if period not in (1, 3, 6, 8, 9):
-            return Response("Period must be one of 1, 3 or 6, 8, 9", status=status.HTTP_400_BAD_REQUEST)
-        
-        last_date = datetime.datetime.now() - datetime.timedelta(days=7)
-        first_date = last_date - datetime.timedelta(weeks=4*period)
-        
-        results = []
-        num_products = 0
-        models = set()
-        duplicate_sets = set()
-        short_titles = set()
-        curr = 0
-
-        if subcategory is not None:
-            queryset = ProductAggregate.objects.filter(category=category, model=model, subcategories__iregex=f'.*"{subcategory}".*').values('product_title', 'brand', 'model', 'product_id', 'review_info', 'short_title', 'duplicate_set').order_by('-product_id').distinct()
-        else:
-            queryset = ProductAggregate.objects.filter(model=model, category=category).values('product_title', 'brand', 'model', 'product_id', 'review_info', 'short_title', 'duplicate_set').order_by('-product_id').distinct()
+class SearchAPI(APIView):
 
-        for item in queryset:
-            if item['duplicate_set'] in duplicate_sets or item['short_title'] in short_titles:
-                continue
-            else:
-                duplicate_sets.add(item['duplicate_set'])
-                short_titles.add(item['short_title'])
-            
-            num_reviews = json.loads(item['review_info'])[str(period)]
-            
-            if item['short_title'] not in models:
-                models.add(item['short_title'])
-                #models.add(item['model'])
-                curr += 1
-            
-            results.append({"subcategory": subcategory, "product_title": item['product_title'], "brand": item['brand'], "model": item['short_title'], "num_reviews": num_reviews})
-            if curr == max_products:
-                break
-        
-        return Response(results, status=status.HTTP_200_OK)
+    def get(self, request):
+        """Full-text search over the review and Q&A text, best match first.
+        Filters: category, product_id, kind (review / qanda), min_rating, max_rating. Pass the returned `next` as `cursor` for the next page
+        """
+        query_params = request.query_params
 
+        if not query_params.get('q'):
+            return Response("`q` needs to be sent in query params", status=status.HTTP_400_BAD_REQUEST)
 
-class ReviewCount(APIView):
+        kind = query_params.get('kind')
+        if kind is not None and kind not in KINDS:
+            return Response(f"kind must be one of {', '.join(KINDS)}", status=status.HTTP_400_BAD_REQUEST)
 
-    def get(self, request, category):
-        query_params = request.query_params
-        if 'subcategory' not in query_params:
-            subcategory = None
-        else:
-            subcategory = query_params['subcategory']
-        
-        if 'period' not in query_params:
-            period = None
-        else:
-            try:
-                period = int(query_params['period'])
-                assert period > 0 and period <= 12
-            except:
-                return Response("period query param must be an integer", status=status.HTTP_400_BAD_REQUEST)
-        
-        if subcategory is None:
-            subcategories = None
-        else:
-            q = SubcategoryMap.objects.filter(category=category)
-            if q:
-                try:
-                    subcategories = json.loads(q.first().subcategory_map)[subcategory]
-                except:
-                    try:
-                        _map = json.loads(q.first().subcategory_map)
-                        flag = False
-                        for name in _map:
-                            for subc in _map[name]:
-                                if subc == subcategory:
-                                    subcategories = [subcategory]
-                                    flag = True
-                        if flag == False:
-                            return Response(f"subcategory {subcategory} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-                    except:
-                        return Response(f"subcategory {subcategory} not found for category {category}", status=status.HTTP_400_BAD_REQUEST)
-
-        agg = []
-        idx = 0
-        if subcategories is not None:
-            for subcategory in subcategories:
-                if idx == 0:
-                    agg = ProductAggregate.objects.filter(category=category, brand__isnull=False, model__isnull=False, subcategories__iregex=f'.*"{subcategory}".*')
-                else:
-                    queryset = ProductAggregate.objects.filter(brand__isnull=False, category=category, subcategories__iregex=f'.*"{subcategory}".*')
-                    agg = agg.union(queryset)
-                idx += 1
-            agg = agg.values('brand', 'model', 'num_reviews', 'short_title', 'duplicate_set').order_by('pk').distinct().order_by()
-        else:
-            agg = ProductAggregate.objects.filter(category=category, brand__isnull=False, model__isnull=False).order_by('pk').values('brand', 'model', 'short_title', 'num_reviews', 'duplicate_set').distinct().order_by('-num_reviews')
+        max_limit = search_settings().get('MAX_LIMIT', 100)
+        try:
+            limit = int(query_params.get('limit', 20))
+            min_rating = float(query_params['min_rating']) if 'min_rating' in query_params else None
+            max_rating = float(query_params['max_rating']) if 'max_rating' in query_params else None
+            assert 0 < limit <= max_limit
+        except (AssertionError, ValueError):
+            return Response(f"`limit` must be an integer between 1 and {max_limit}, ratings must be numbers", status=status.HTTP_400_BAD_REQUEST)
 
-        duplicate_sets = set()
-        short_titles = set()
-        
-        total_reviews = 0
-        
-        for item in agg:
-            if item['duplicate_set'] in duplicate_sets or item['short_title'] in short_titles:
-                continue
-            # Get from August also
-            try:
-                instance = ProductAggregate.objects.filter(duplicate_set=item['duplicate_set']).order_by('-num_reviews').distinct().first()
-                if not instance:
-                    continue
-                
-                info = instance.total_reviews
-                if instance.total_reviews is None:
-                    info = None
-                else:
-                    info = json.loads(instance.total_reviews)
-                
-                if period is None:
-                    if info is None:
-                        total_reviews += 0
-                    else:
-                        for _period in info:
-                            total_reviews += info[_period]
-                else:
-                    if info is None:
-                        total_reviews += 0
-                    else:
-                        if str(period) in info:
-                            total_reviews += info[str(period)]
-                        else:
-                            total_reviews += 0
-                
-            except Exception as ex:
-                print(ex)
-                total_reviews += 0
-            
-            duplicate_sets.add(item['duplicate_set'])
-            short_titles.add(item['short_title'])
-                
-        return Response({'total_reviews': total_reviews}, status=status.HTTP_200_OK)
+        try:
+            results, next_cursor = search_documents(
+                query_params['q'], category=query_params.get('category'), product_id=query_params.get('product_id'), kind=kind,
+                min_rating=min_rating, max_rating=max_rating, limit=limit, cursor=query_params.get('cursor'),
+            )
+        except ValueError as ex:
+            return Response(str(ex), status=status.HTTP_400_BAD_REQUEST)
 
+        return Response({'results': results, 'next': next_cursor}, status=status.HTTP_200_OK)
 
 
 class SendEmailAPI(APIView):
 
+    authentication_classes = [BasicAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated, AdminAuthenticationPermission]
 
     def get(self, request, category=None):
-        # First get the csv data
-        fields = [field.get_attname_column()[1] for field in Productlisting._meta.fields]
+        # First get the csv data, streamed into a gzipped temporary file
         file_name = f"ProductListing"
         file_name = file_name.replace('"', r'\"')
-        csvfile = io.StringIO()
-        writer = csv.writer(csvfile)
-
-        # Write the headers first
-        headers = fields
-        
-        writer.writerow(headers)
 
-        if category is not None:
-            queryset = Productlisting.objects.using('scraped').filter(category=category)
-        else:
-            queryset = Productlisting.objects.using('scraped').all()
-        
-        # Now write the data
-        for obj in queryset:
-            row = [getattr(obj, field) for field in fields]
-            writer.writerow(row)
+        queryset = export_queryset(Productlisting, category)
         
         # Send an Email
         mail_subject = 'Your Exported Product Data'
@@ -1358,7 +504,73 @@ class SendEmailAPI(APIView):
         to_email = request.user.email
         
         email = EmailMessage(mail_subject, message, to=[to_email])
-        email.attach(f'{file_name}.csv', csvfile.getvalue(), 'text/csv')
+        with spooled_export(Productlisting, queryset) as csvfile:
+            if file_size(csvfile) > max_attachment_size():
+                link = request.build_absolute_uri(f'/api/dashboard/export/productlisting?category={category}')
+                return Response(f"The export is too large to be emailed, download it from {link}", status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            email.attach(attachment_part(csvfile, f'{file_name}.csv.gz'))
 
         email.send()
         return Response(f"An Email has been sent to your account - {request.user.email}. Please check the attachment for details", status=status.HTTP_200_OK)
+
+
+class ExportCSVAPI(APIView):
+
+    authentication_classes = [BasicAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated, AdminAuthenticationPermission]
+
+    def get(self, request, table):
+        """Streams a scraped table as a (gzipped) CSV download
+        """
+        if table not in EXPORT_MODELS:
+            return Response(f"table must be one of {', '.join(EXPORT_MODELS)}", status=status.HTTP_404_NOT_FOUND)
+        
+        model = EXPORT_MODELS[table]
+        queryset = export_queryset(model, request.query_params.get('category'))
+
+        lines = iter_csv(model, queryset)
+        file_name = model._meta.db_table
+
+        if request.query_params.get('compress', 'true').lower() in ('0', 'false', 'no'):
+            response = StreamingHttpResponse(lines, content_type='text/csv')
+            response['Content-Disposition'] = f'attachment; filename="{file_name}.csv"'
+        else:
+            response = StreamingHttpResponse(iter_gzip(lines), content_type='application/gzip')
+            response['Content-Disposition'] = f'attachment; filename="{file_name}.csv.gz"'
+        return response
+
+
+class CacheStatsAPI(APIView):
+
+    authentication_classes = [BasicAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated, AdminAuthenticationPermission]
+
+    def get(self, request):
+        """Hit / miss counters of the response cache in this process
+        """
+        cache = get_response_cache()
+        if cache is None:
+            return Response({'enabled': False}, status=status.HTTP_200_OK)
+        return Response({'enabled': True, **cache.stats()}, status=status.HTTP_200_OK)
+
+
+class MetricsAPI(APIView):
+
+    authentication_classes = [BasicAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated, AdminAuthenticationPermission]
+
+    def get(self, request):
+        """Request metrics of this process, in the Prometheus text format
+        """
+        return HttpResponse(get_registry().export(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class SlowRequestsAPI(APIView):
+
+    authentication_classes = [BasicAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated, AdminAuthenticationPermission]
+
+    def get(self, request):
+        """Latest requests slower than SLOW_REQUEST_SECONDS in this process, with the SQL they ran
+        """
+        return Response(get_registry().slow(), status=status.HTTP_200_OK)
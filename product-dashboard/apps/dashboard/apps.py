@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 
 class DashboardConfig(AppConfig):
-    name = 'dashboard'
+    name = 'apps.dashboard'
+    label = 'dashboard'
+
+    def ready(self):
+        from apps.dashboard import signals
@@ -0,0 +1,190 @@
+import json
+import re
+import time
+import tracemalloc
+
+import numpy as np
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from . import urls
+from .models import Dailyproductlisting, Productlisting, Qanda, Reviews
+from .renderers import FastJSONRenderer
+from .serializers import (DailyProductListingSerializer,
+                          ProductListingSerializer, QandASerializer,
+                          ReviewSerializer, projected_fields)
+
+# Endpoint benchmarks over the synthetic dataset (see synthetic.py)
+
+# Path converters of urls.py, filled from the dataset summary
+PATH_ARGS = {
+    'category': lambda dataset: dataset['category'],
+    'brand': lambda dataset: dataset['brand'],
+    'product_id': lambda dataset: dataset['product_id'],
+    'subcategory': lambda dataset: dataset['subcategory'],
+    'period': lambda dataset: 3,
+    'max_products': lambda dataset: 10,
+    'page_no': lambda dataset: 5,
+    'top_n': lambda dataset: 4,
+    'table': lambda dataset: 'productlisting',
+}
+
+# (method, query params / POST data) per route, keyed by the route pattern
+REQUESTS = {
+    'productlisting': [('GET', {}), ('GET', {'page_size': 50}), ('GET', {'page_size': 50, 'fields': 'product_id,title,price,avg_rating'})],
+    'dailyproductlisting': [('GET', {}), ('GET', {'page_size': 50})],
+    'reviews/<str:product_id>': [('GET', {'type': 'positive'}), ('GET', {'type': 'negative', 'page_size': 50}), ('GET', {'type': 'negative', 'page_size': 50, 'fields': 'title,body,rating'})],
+    'reviews/<str:product_id>/<int:page_no>': [('GET', {'type': 'positive'})],
+    'dailyproductlisting/<int:page_no>': [('GET', {'category': '{category}'})],
+    'export/<str:table>': [('GET', {'category': '{category}'})],
+    'brandlist/<str:category>': [('GET', {}), ('GET', {'subcategory': '{subcategory}'})],
+    'modellist/<str:category>/<str:brand>': [('GET', {}), ('GET', {'subcategory': '{subcategory}'})],
+    'brand-model/<str:category>': [('GET', {}), ('GET', {'subcategory': 'Type'})],
+    'fetchsubcategories/<str:category>': [('GET', {}), ('POST', {'subcategories': 'all', 'period': 3, 'max_products': 10})],
+    'brandmarketshare/<str:category>/<int:period>/<int:max_products>': [('GET', {}), ('GET', {'start': '2020-07-01', 'end': '2020-09-30'})],
+    'individualmarketshare': [('POST', {'category': '{category}', 'model': '{model}', 'period': 3})],
+    'individualmarketshare/<str:category>': [('POST', {'model': '{model}', 'period': 3})],
+    'rating/<str:category>': [('GET', {'brand': '{brand}'}), ('GET', {'brand': '{brand}', 'subcategory': '{subcategory}', 'window': 'month', 'windows': 6})],
+    'review-count/<str:category>': [('GET', {}), ('GET', {'subcategory': '{subcategory}', 'period': 3})],
+    'aspect-rating/<str:category>': [('GET', {'brand': '{brand}'})],
+    'aspect-comparison/<str:category>': [('GET', {}), ('GET', {'group_by': 'subcategory'})],
+    'review-breakdown/<str:category>': [('GET', {'model': '{model}'})],
+    'fetch-reviews/<str:category>': [('GET', {'product_id': '{product_id}', 'feature': '{feature}'})],
+    'email/<str:category>': [],  # Sends mail
+    'batch/<str:category>': [('POST', {'widgets': [
+        {'type': 'brandmarketshare', 'params': {'period': 3, 'subcategory': '{subcategory}'}},
+        {'type': 'modelmarketshare', 'params': {'period': 3, 'subcategory': '{subcategory}'}},
+        {'type': 'review-count', 'params': {'subcategory': '{subcategory}'}},
+        {'type': 'rating', 'params': {'brand': '{brand}', 'subcategory': '{subcategory}'}},
+        {'type': 'aspect-rating', 'params': {'brand': '{brand}', 'subcategory': '{subcategory}'}},
+        {'type': 'fetchsubcategories', 'params': {}},
+    ]})],
+}
+
+
+# List endpoints whose serialization is measured on its own, see measure_serialization
+SERIALIZERS = {
+    'productlisting': (Productlisting, ProductListingSerializer, 'product_id'),
+    'dailyproductlisting': (Dailyproductlisting, DailyProductListingSerializer, 'id'),
+    'reviews': (Reviews, ReviewSerializer, 'id'),
+    'qanda': (Qanda, QandASerializer, 'id'),
+}
+
+
+def fill(value, dataset):
+    if isinstance(value, str):
+        return value.format(**dataset)
+    if isinstance(value, list):
+        return [fill(item, dataset) for item in value]
+    if isinstance(value, dict):
+        return {name: fill(item, dataset) for name, item in value.items()}
+    return value
+
+
+def build_requests(dataset):
+    """Returns [(name, method, path, params)] covering every route of urls.py, and the routes left out
+    """
+    requests, skipped = [], []
+    for pattern in urls.urlpatterns:
+        route = str(pattern.pattern)
+        try:
+            path = '/api/dashboard/' + re.sub(r'<(\w+):(\w+)>', lambda match: str(PATH_ARGS[match.group(2)](dataset)), route)
+        except KeyError:
+            skipped.append(route)
+            continue
+        for method, params in REQUESTS.get(route, [('GET', {})]):
+            params = {name: fill(value, dataset) for name, value in params.items()}
+            query = '&'.join(f'{name}={value}' for name, value in params.items()) if method == 'GET' else ''
+            requests.append((f"{method} {route}{'?' + query if query else ''}", method, path, params))
+        if route in REQUESTS and not REQUESTS[route]:
+            skipped.append(route)
+    return requests, skipped
+
+
+def send(client, method, path, params):
+    if method == 'GET':
+        return client.get(path, params)
+    return client.post(path, json.dumps(params), content_type='application/json')
+
+
+def measure(client, method, path, params, repeat=20, warmup=2):
+    """Returns the latencies (ms) of `repeat` requests, then the query count and peak traced memory of one more
+    """
+    for _ in range(warmup):
+        response = send(client, method, path, params)
+
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = send(client, method, path, params)
+        if getattr(response, 'streaming', False):
+            b''.join(response.streaming_content)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    contexts = [CaptureQueriesContext(connections[alias]) for alias in ('default', 'scraped')]
+    for context in contexts:
+        context.__enter__()
+    tracemalloc.start()
+    try:
+        response = send(client, method, path, params)
+        if getattr(response, 'streaming', False):
+            b''.join(response.streaming_content)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        for context in reversed(contexts):
+            context.__exit__(None, None, None)
+
+    return {
+        'status': response.status_code,
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+        'queries': sum(len(context.captured_queries) for context in contexts),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, threshold=0.2):
+    """Returns [(scale, name, metric, old, new)] for every metric that got worse than `threshold` (relative) vs `baseline`
+    """
+    regressions = []
+    for scale, routes in results.items():
+        for name, metrics in routes.items():
+            old = baseline.get(scale, {}).get(name)
+            # Serialization comparisons are reported, not checked
+            if old is None or 'p50_ms' not in metrics:
+                continue
+            for metric in ('p50_ms', 'p95_ms', 'peak_kb'):
+                if metrics[metric] > old[metric] * (1 + threshold):
+                    regressions.append((scale, name, metric, old[metric], metrics[metric]))
+            if metrics['queries'] > old['queries']:
+                regressions.append((scale, name, 'queries', old['queries'], metrics['queries']))
+    return regressions
+
+
+def timed(function, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = function()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return round(float(np.percentile(latencies, 50)), 3), len(body)
+
+
+def measure_serialization(model, serializer_class, ordering, rows=100, fields=None, repeat=20):
+    """Fetches and renders a page of `rows` rows the old way (model instances, ModelSerializer, json) and the way
+    the list endpoints do (`values()` of the projected fields, FastJSONRenderer). Returns the p50 latencies (ms)
+    and body sizes of both
+    """
+    queryset = model.objects.order_by(ordering)
+
+    def old():
+        return JSONRenderer().render(serializer_class(queryset[:rows], many=True).data)
+
+    def lean():
+        return FastJSONRenderer().render(list(queryset.values(*projected_fields(serializer_class, fields))[:rows]))
+
+    old_ms, old_bytes = timed(old, repeat)
+    lean_ms, lean_bytes = timed(lean, repeat)
+    return {'old_ms': old_ms, 'lean_ms': lean_ms, 'old_kb': round(old_bytes / 1024, 1), 'lean_kb': round(lean_bytes / 1024, 1)}
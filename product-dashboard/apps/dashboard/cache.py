@@ -0,0 +1,313 @@
+import functools
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import request_started, setting_changed
+from django.db.models import F
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+from .metrics import render_response
+from .models import DataVersion
+
+# Response cache of the analytics endpoints. Their output only depends on the request and on the data,
+# so entries are keyed by a data version stamp and never expire: refreshing a data source bumps its version
+
+DATA_SOURCES = ('aggregate', 'scraped')
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+_data_version = threading.local() # Last stamp read by this thread
+
+
+def bump_data_version(*sources):
+    """Marks `sources` (default: all of them) as refreshed, which invalidates every cached response
+    """
+    for source in sources or DATA_SOURCES:
+        if not DataVersion.objects.filter(source=source).update(version=F('version') + 1):
+            DataVersion.objects.get_or_create(source=source, defaults={'version': 1})
+    _data_version.stamp = None
+
+
+def get_data_version():
+    """Returns the current data version stamp.
+    It is read at most once per request, and at most every VERSION_CHECK_INTERVAL seconds if that is set
+    """
+    stamp = getattr(_data_version, 'stamp', None)
+    if stamp is None:
+        versions = dict(DataVersion.objects.values_list('source', 'version'))
+        stamp = '.'.join(str(versions.get(source, 0)) for source in DATA_SOURCES)
+        _data_version.stamp = stamp
+        _data_version.checked_on = time.monotonic()
+    return stamp
+
+
+@receiver(request_started)
+def expire_data_version(**kwargs):
+    interval = cache_settings().get('VERSION_CHECK_INTERVAL', 0)
+    if time.monotonic() - getattr(_data_version, 'checked_on', 0) >= interval:
+        _data_version.stamp = None
+
+
+class LocMemLRUCache:
+    """Per process LRU cache, bounded by the total size of the stored values
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = int(max_bytes)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, version, key):
+        with self.lock:
+            value = self.entries.get((version, key))
+            if value is not None:
+                self.entries.move_to_end((version, key))
+            return value
+
+    def set(self, version, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop((version, key), None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[(version, key)] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {'entries': len(self.entries), 'size': self.size, 'max_bytes': self.max_bytes}
+
+
+class FileCache:
+    """Cache shared by the processes of a host, one file per entry under `location/<version>/`.
+    Directories of older versions are removed when a newer version is first written
+    """
+
+    def __init__(self, location):
+        if not location:
+            raise ImproperlyConfigured("The file response cache needs a LOCATION directory")
+        self.location = location
+        self.current = None
+
+    def _path(self, version, key):
+        return os.path.join(self.location, version, key[:2], key)
+
+    def get(self, version, key):
+        try:
+            with open(self._path(version, key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, version, key, value):
+        if self.current != version:
+            self.current = version
+            self._remove_versions(keep=version)
+
+        path = self._path(version, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+
+    def _remove_versions(self, keep=None):
+        if not os.path.isdir(self.location):
+            return
+        for name in os.listdir(self.location):
+            if name != keep:
+                shutil.rmtree(os.path.join(self.location, name), ignore_errors=True)
+
+    def clear(self):
+        self.current = None
+        self._remove_versions()
+
+    def stats(self):
+        entries, size = 0, 0
+        for root, _, files in os.walk(self.location):
+            for name in files:
+                entries += 1
+                size += os.path.getsize(os.path.join(root, name))
+        return {'entries': entries, 'size': size, 'location': self.location}
+
+
+class RedisCache:
+    """Cache on a Redis compatible server, shared by every process and host.
+    Keys of older versions are left to expire after `timeout` seconds
+    """
+
+    def __init__(self, location, timeout=24 * 60 * 60, prefix='dashboard'):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("The redis response cache needs the `redis` package")
+        if not location:
+            raise ImproperlyConfigured("The redis response cache needs a LOCATION url")
+        self.location = location
+        self.client = redis.Redis.from_url(location)
+        self.timeout = int(timeout)
+        self.prefix = prefix
+
+    def _key(self, version, key):
+        return f"{self.prefix}:{version}:{key}"
+
+    def get(self, version, key):
+        return self.client.get(self._key(version, key))
+
+    def set(self, version, key, value):
+        self.client.set(self._key(version, key), value, ex=self.timeout)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=f"{self.prefix}:*"):
+            self.client.delete(key)
+
+    def stats(self):
+        return {'location': self.location}
+
+
+BACKENDS = {
+    'locmem': lambda options: LocMemLRUCache(**options),
+    'file': lambda options: FileCache(**options),
+    'redis': lambda options: RedisCache(**options),
+}
+
+
+def cache_settings():
+    return getattr(settings, 'DASHBOARD_CACHE', {})
+
+
+class ResponseCache:
+    """A cache backend plus the hit / miss counters of this process
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'errors': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def get(self, version, key):
+        try:
+            value = self.backend.get(version, key)
+        except Exception as ex:
+            print(f"Error: {ex}. Exception while reading the response cache")
+            self.count('errors')
+            value = None
+        self.count('hits' if value is not None else 'misses')
+        return value
+
+    def set(self, version, key, value):
+        try:
+            self.backend.set(version, key, value)
+        except Exception as ex:
+            print(f"Error: {ex}. Exception while writing the response cache")
+            self.count('errors')
+
+    def clear(self):
+        self.backend.clear()
+        with self.lock:
+            self.counters = dict.fromkeys(self.counters, 0)
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_ratio'] = counters['hits'] / lookups if lookups else None
+        try:
+            counters['backend'] = self.backend.stats()
+        except Exception as ex:
+            counters['backend'] = {'error': str(ex)}
+        counters['data_version'] = get_data_version()
+        return counters
+
+
+_response_cache = {}
+
+
+def get_response_cache():
+    """Returns the configured `ResponseCache`, or None when caching is disabled
+    """
+    if 'instance' not in _response_cache:
+        config = cache_settings()
+        name = config.get('BACKEND')
+        if not name:
+            _response_cache['instance'] = None
+        elif name not in BACKENDS:
+            raise ImproperlyConfigured(f"Unknown response cache backend {name}, should be one of {', '.join(BACKENDS)}")
+        else:
+            options = dict(config.get('OPTIONS', {}))
+            if config.get('LOCATION'):
+                options['location'] = config['LOCATION']
+            _response_cache['instance'] = ResponseCache(BACKENDS[name](options))
+    return _response_cache['instance']
+
+
+@receiver(setting_changed)
+def reset_response_cache(setting, **kwargs):
+    if setting == 'DASHBOARD_CACHE':
+        _response_cache.clear()
+        _data_version.stamp = None
+
+
+def request_key(request):
+    # Query params are sorted, so their order does not matter. Accept picks the renderer (JSON / browsable API)
+    params = sorted((name, values) for name, values in request.GET.lists())
+    raw = repr((request.path, params, request.META.get('HTTP_ACCEPT', '')))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def encode_entry(response):
+    header = f"{response.status_code}\n{response['Content-Type']}\n".encode('utf-8')
+    return header + response.content
+
+
+def decode_entry(value):
+    status_code, content_type, content = bytes(value).split(b'\n', 2)
+    return int(status_code), content_type.decode('utf-8'), content
+
+
+def cache_response(view):
+    """Wraps a view so that its successful GET responses are served from the response cache
+    """
+    @functools.wraps(view)
+    def wrapped(request, *args, **kwargs):
+        cache = get_response_cache()
+        if cache is None or request.method != 'GET':
+            return view(request, *args, **kwargs)
+
+        version = get_data_version()
+        key = request_key(request)
+        value = cache.get(version, key)
+        if value is not None:
+            status_code, content_type, content = decode_entry(value)
+            response = HttpResponse(content, status=status_code, content_type=content_type)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            render_response(response)
+            cache.set(version, key, encode_entry(response))
+        response['X-Cache'] = 'MISS'
+        return response
+
+    return wrapped
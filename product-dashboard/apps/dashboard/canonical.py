@@ -0,0 +1,95 @@
+import json
+
+from django.db import transaction
+
+from .models import CanonicalProduct, ProductAggregate
+from .snapshot import clear_category_snapshots
+
+# Canonical products: every duplicate cluster of a category collapsed into a single row, so that the
+# endpoints aggregate over clusters directly instead of skipping duplicates while they iterate
+
+CANONICAL_FIELDS = ('brand', 'model', 'short_title', 'product_title', 'duplicate_set', 'num_reviews', 'curr_price',
+                    'review_info', 'total_reviews', 'featurewise_reviews', 'subcategories')
+
+
+def find_clusters(products):
+    """Groups the products sharing a duplicate_set or a short_title, transitively.
+    Unlike skipping seen keys while iterating, the result does not depend on the order of the rows
+    """
+    parent = list(range(len(products)))
+
+    def find(idx):
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    owners = {}
+    for idx, product in enumerate(products):
+        for key in (('duplicate_set', product['duplicate_set']), ('short_title', product['short_title'])):
+            if key[1] is None:
+                continue
+            if key in owners:
+                parent[find(idx)] = find(owners[key])
+            else:
+                owners[key] = idx
+
+    clusters = {}
+    for idx, product in enumerate(products):
+        clusters.setdefault(find(idx), []).append(product)
+    return list(clusters.values())
+
+
+def pick_representative(members):
+    # Products with a brand and a model first, then the most reviewed one
+    return min(members, key=lambda product: (product['brand'] is None or product['model'] is None, -(product['num_reviews'] or 0), product['product_id']))
+
+
+def build_canonical_rows(category, products):
+    """Returns {representative product_id: CanonicalProduct fields} for the products of a category
+    """
+    rows = {}
+    for members in find_clusters(products):
+        representative = pick_representative(members)
+        row = {field: representative[field] for field in CANONICAL_FIELDS}
+        row['category'] = category
+        row['member_ids'] = json.dumps(sorted(member['product_id'] for member in members))
+        rows[representative['product_id']] = row
+    return rows
+
+
+def rebuild_canonical_products(categories=None):
+    """Brings `CanonicalProduct` in sync with `ProductAggregate`. Only the clusters that differ are written.
+    Returns the number of written and deleted rows
+    """
+    if categories is None:
+        categories = list(ProductAggregate.objects.filter(category__isnull=False).values_list('category', flat=True).distinct().order_by())
+        # Categories without any product left
+        CanonicalProduct.objects.exclude(category__in=categories).delete()
+
+    written = deleted = 0
+    for category in categories:
+        products = list(ProductAggregate.objects.filter(category=category).values('product_id', *CANONICAL_FIELDS).order_by('product_id'))
+        wanted = build_canonical_rows(category, products)
+
+        existing = {}
+        for row in CanonicalProduct.objects.filter(category=category).values('product_id', 'category', 'member_ids', *CANONICAL_FIELDS).iterator():
+            existing[row.pop('product_id')] = row
+
+        stale = [product_id for product_id in existing if product_id not in wanted]
+        changed = [product_id for product_id, row in wanted.items() if existing.get(product_id) != row]
+
+        with transaction.atomic():
+            # Rewritten rows are deleted first, their representative may have been in another category
+            removed = stale + changed
+            for idx in range(0, len(removed), 500):
+                CanonicalProduct.objects.filter(product_id__in=removed[idx:idx + 500]).delete()
+            CanonicalProduct.objects.bulk_create([CanonicalProduct(product_id=product_id, **wanted[product_id]) for product_id in changed])
+
+        written += len(changed)
+        deleted += len(stale)
+
+    if written or deleted:
+        # Snapshots of this process are reloaded now, the others on the next data version
+        clear_category_snapshots()
+    return written, deleted
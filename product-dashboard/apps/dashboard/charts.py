@@ -0,0 +1,88 @@
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+# Chart rendering, done in a pool of worker processes.
+# Only the object oriented Figure API is used (no global pyplot state), and this module does not
+# import Django, so the spawned workers can import it without setting up the project
+
+RENDER_WORKERS = 2
+
+RENDER_TIMEOUT = 30 # Seconds a request waits for its chart
+
+DEFAULT_TOP_N = 4
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def render(func, *args):
+    """Runs `func(*args)` in the render pool and returns its result
+    """
+    global _pool
+    try:
+        return get_pool().submit(func, *args).result(timeout=RENDER_TIMEOUT)
+    except BrokenProcessPool:
+        # A worker died, start with a fresh pool next time
+        with _pool_lock:
+            _pool = None
+        raise
+
+
+def to_png(fig):
+    canvas = FigureCanvasAgg(fig)
+    with io.BytesIO() as buffer:
+        canvas.print_png(buffer)
+        return buffer.getvalue()
+
+
+def pie_slices(totals, top_n=DEFAULT_TOP_N):
+    """Returns the (labels, sizes) of the `top_n` largest entries of {label: size}, plus one 'others' slice
+    """
+    ranked = sorted(totals.items(), key=lambda x: x[1], reverse=True)
+    labels = [label for label, _ in ranked[:top_n]] + ['others']
+    sizes = [size for _, size in ranked[:top_n]] + [sum(size for _, size in ranked[top_n:])]
+    return labels, sizes
+
+
+def render_pie_chart(labels, sizes):
+    fig = Figure(figsize=(12, 5))
+    ax = fig.add_subplot(111)
+    ax.pie(sizes, labels=labels, autopct='%1.1f%%', shadow=True, startangle=90)
+    ax.set_ylabel('reviews')
+    ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
+    return to_png(fig)
+
+
+def render_bar_chart(labels, values, title, xlabel, ylabel):
+    fig = Figure(figsize=(8, 3))
+    ax = fig.add_subplot(111)
+
+    pos = [idx + 2 for idx in range(len(labels))]
+    ax.barh(pos, values, align='center')
+    ax.set_yticks(pos)
+    ax.set_yticklabels(labels, fontsize=15)
+    ax.set_xticks([])
+    ax.invert_yaxis()
+
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+
+    fig.tight_layout()
+    return to_png(fig)
@@ -0,0 +1,143 @@
+import base64
+import csv
+import os
+import tempfile
+import zlib
+from email.mime.base import MIMEBase
+
+from django.conf import settings
+
+from .models import (Dailyproductlisting, Productdetails, Productlisting,
+                     Qanda, Reviews)
+
+# Tables which can be exported, by URL name
+EXPORT_MODELS = {
+    'productlisting': Productlisting,
+    'dailyproductlisting': Dailyproductlisting,
+    'productdetails': Productdetails,
+    'qanda': Qanda,
+    'reviews': Reviews,
+}
+
+CHUNK_SIZE = 2000 # Rows fetched per query
+
+GZIP_BUFFER_SIZE = 64 * 1024 # Bytes of CSV compressed at once
+
+SPOOL_MAX_SIZE = 8 * 1024 * 1024 # Spooled exports go to disk beyond this
+
+MAX_ATTACHMENT_SIZE = 10 * 1024 * 1024 # Default of EXPORTS['MAX_ATTACHMENT_SIZE']
+
+ATTACHMENT_READ_SIZE = 57 * 1024 # A multiple of 57 bytes, which base64 encodes to whole 76 character lines
+
+
+class Echo:
+    # File-like object for csv.writer, which hands back each formatted line
+    def write(self, value):
+        return value
+
+
+def export_queryset(model, category=None):
+    queryset = model.objects.all()
+    if category is None:
+        return queryset
+    if model in (Productlisting, Dailyproductlisting):
+        return queryset.filter(category=category)
+    if model is Productdetails:
+        return queryset.filter(product_id__in=Productlisting.objects.filter(category=category).values('product_id'))
+    return queryset.filter(product__category=category)
+
+
+def iter_rows(queryset, fields, chunk_size=CHUNK_SIZE):
+    """Yields `values_list` rows of `queryset`, `chunk_size` rows per query.
+    Chunks are walked by primary key (keyset), so no query ever materializes more than one chunk,
+    even on the MySQL client, which buffers whole result sets
+    """
+    pk = queryset.model._meta.pk.attname
+    fields = list(fields)
+    if pk not in fields:
+        columns = fields + [pk]
+    else:
+        columns = fields
+    pk_idx = columns.index(pk)
+
+    queryset = queryset.order_by(pk)
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(**{f'{pk}__gt': last})
+        rows = list(chunk.values_list(*columns)[:chunk_size])
+        if not rows:
+            break
+        for row in rows:
+            yield row[:len(fields)]
+        last = rows[-1][pk_idx]
+        if len(rows) < chunk_size:
+            break
+
+
+def iter_csv(model, queryset, chunk_size=CHUNK_SIZE):
+    """Yields the CSV export of `queryset` line by line, header first
+    """
+    writer = csv.writer(Echo())
+    fields = [field.attname for field in model._meta.fields]
+    yield writer.writerow([field.get_attname_column()[1] for field in model._meta.fields])
+    for row in iter_rows(queryset, fields, chunk_size=chunk_size):
+        yield writer.writerow(row)
+
+
+def iter_gzip(lines, buffer_size=GZIP_BUFFER_SIZE):
+    """Compresses an iterable of text lines into gzip chunks, on the fly
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    buffer = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= buffer_size:
+            chunk = compressor.compress(b''.join(buffer))
+            buffer, size = [], 0
+            if chunk:
+                yield chunk
+    chunk = compressor.compress(b''.join(buffer)) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def spooled_export(model, queryset, chunk_size=CHUNK_SIZE):
+    """Writes the gzipped CSV export of `queryset` to a spooled temporary file, rewound to the start
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    for chunk in iter_gzip(iter_csv(model, queryset, chunk_size=chunk_size)):
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
+
+
+def max_attachment_size():
+    return (getattr(settings, 'EXPORTS', None) or {}).get('MAX_ATTACHMENT_SIZE', MAX_ATTACHMENT_SIZE)
+
+
+def file_size(f):
+    position = f.tell()
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(position)
+    return size
+
+
+def attachment_part(f, file_name, content_type='application/gzip'):
+    """Returns the email attachment of the file `f`, base64 encoded chunk by chunk rather than read whole.
+    Check its size against max_attachment_size() first
+    """
+    part = MIMEBase(*content_type.split('/', 1))
+    lines = []
+    while True:
+        chunk = f.read(ATTACHMENT_READ_SIZE)
+        if not chunk:
+            break
+        lines.append(base64.encodebytes(chunk).decode('ascii'))
+    part.set_payload(''.join(lines))
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.add_header('Content-Disposition', 'attachment', filename=file_name)
+    return part
@@ -0,0 +1,28 @@
+import json
+
+from django.db.models import Q, Sum
+
+from .models import Productdetails, Productlisting
+
+# Batched access to the aggregate / scraped DBs. Every loader costs a fixed number of
+# queries, no matter how many brands / models / duplicate sets a request covers
+
+
+def load_brand_review_totals(category):
+    """Returns {brand: total num_reviews} over the scraped products of `category`.
+    Summed in SQL on `ProductDetails.brand`, only rows without a brand fall back to parsing `byline_info`
+    """
+    listed = Productlisting.objects.filter(category=category).values('product_id')
+    details = Productdetails.objects.filter(product_id__in=listed, num_reviews__isnull=False)
+
+    totals = {}
+    for item in details.exclude(brand__isnull=True).exclude(brand='').values('brand').annotate(total=Sum('num_reviews')).order_by():
+        totals[item['brand']] = item['total']
+
+    for byline_info, num_reviews in details.filter(Q(brand__isnull=True) | Q(brand='')).values_list('byline_info', 'num_reviews').iterator():
+        try:
+            brand = json.loads(byline_info)['info'].replace('Brand:', '').strip()
+        except (TypeError, ValueError, KeyError, AttributeError):
+            continue
+        totals[brand] = totals.get(brand, 0) + num_reviews
+    return totals
@@ -0,0 +1,92 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from apps.accounts.models import User
+from apps.dashboard.benchmark import (SERIALIZERS, build_requests, compare,
+                                      measure, measure_serialization)
+from apps.dashboard.synthetic import generate
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks every dashboard route on synthetic datasets of several scales (SQLite only, the DBs are refilled)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1,5', help='Comma separated dataset scales')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=20, help='Timed requests per route')
+        parser.add_argument('--filter', default=None, help='Only routes containing this string')
+        parser.add_argument('--cache', action='store_true', help='Keep the response cache enabled')
+        parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+        parser.add_argument('--baseline', default=None, help='Compare against the results in this JSON file')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown reported as a regression')
+        parser.add_argument('--save-baseline', action='store_true', help='Write the results to --baseline')
+        parser.add_argument('--serialization', action='store_true', help='Also compare the serialization of the list endpoints with ModelSerializer')
+        parser.add_argument('--rows', type=int, default=100, help='Rows per page of the serialization comparison')
+
+    def handle(self, *args, **options):
+        data_dir = settings.BENCH_DIR
+        if not data_dir:
+            raise CommandError("Set BENCH_DIR to run the benchmarks on SQLite stand-ins, e.g. `BENCH_DIR=bench python manage.py benchmark`")
+
+        call_command('migrate', run_syncdb=True, verbosity=0)
+        user, _ = User.objects.get_or_create(email='bench@example.com', defaults={'real_name': 'bench', 'is_superuser': True})
+
+        cache_settings = settings.DASHBOARD_CACHE if options['cache'] else {}
+        results = {}
+        cwd = os.getcwd()
+        for scale in options['scales'].split(','):
+            try:
+                dataset = generate(scale=float(scale), seed=options['seed'], output_dir=data_dir)
+            except ValueError as ex:
+                raise CommandError(str(ex))
+            self.stdout.write(f"\nScale {scale}: " + ', '.join(f"{count} {model}" for model, count in dataset['counts'].items()))
+
+            requests, skipped = build_requests(dataset)
+            if skipped:
+                self.stdout.write(f"Skipped: {', '.join(skipped)}")
+
+            client = Client()
+            client.force_login(user)
+            results[scale] = {}
+            # Sentiment / parameter files are read from the working directory
+            os.chdir(data_dir)
+            try:
+                with override_settings(DASHBOARD_CACHE=cache_settings):
+                    for name, method, path, params in requests:
+                        if options['filter'] and options['filter'] not in name:
+                            continue
+                        metrics = measure(client, method, path, params, repeat=options['repeat'])
+                        results[scale][name] = metrics
+                        self.stdout.write(f"{metrics['status']:>4} {metrics['p50_ms']:>9.2f} {metrics['p95_ms']:>9.2f} ms {metrics['queries']:>4} queries {metrics['peak_kb']:>9.1f} KB  {name}")
+            finally:
+                os.chdir(cwd)
+
+            if options['serialization']:
+                self.stdout.write(f"\nSerialization of {options['rows']} rows: ModelSerializer + json vs values() + FastJSONRenderer")
+                for name, (model, serializer_class, ordering) in SERIALIZERS.items():
+                    metrics = measure_serialization(model, serializer_class, ordering, rows=options['rows'], repeat=options['repeat'])
+                    results[scale][f'serialization {name}'] = metrics
+                    self.stdout.write(f"{metrics['old_ms']:>9.2f} -> {metrics['lean_ms']:>7.2f} ms {metrics['old_kb']:>9.1f} KB  {name}")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        if options['baseline']:
+            if options['save_baseline'] or not os.path.exists(options['baseline']):
+                with open(options['baseline'], 'w') as f:
+                    json.dump(results, f, indent=2)
+                self.stdout.write(f"\nBaseline written to {options['baseline']}")
+                return
+
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = compare(results, baseline, threshold=options['threshold'])
+            self.stdout.write(f"\n{len(regressions)} regressions vs {options['baseline']}")
+            for scale, name, metric, old, new in regressions:
+                self.stdout.write(f"  scale {scale} {name}: {metric} {old} -> {new}")
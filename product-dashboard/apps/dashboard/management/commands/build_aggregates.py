@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from apps.dashboard.aggregates import CHUNK_SIZE
+from apps.dashboard.pipeline import refresh_from_scraped
+
+
+class Command(BaseCommand):
+    help = 'Builds ProductAggregate / ReviewAggregate from the scraped DB, only for the products scraped since the last build'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild every product and drop the ones gone from the scraped DB')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Products rebuilt per batch')
+
+    def handle(self, *args, **options):
+        refresh_from_scraped(full=options['full'], chunk_size=options['chunk_size'])
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from apps.dashboard.search import index_documents
+
+
+class Command(BaseCommand):
+    help = 'Adds the reviews / questions scraped since the last run to the full-text search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Reindex every review and question')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Rows read from the scraped DB per batch')
+
+    def handle(self, *args, **options):
+        num_documents = index_documents(full=options['full'], chunk_size=options['chunk_size'])
+        self.stdout.write(f"Indexed {num_documents} reviews / questions")
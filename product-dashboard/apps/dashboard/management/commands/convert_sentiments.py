@@ -0,0 +1,27 @@
+import pickle
+
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from apps.taskscheduler.management import (SENTIMENT_INDEX_DIR,
+                                           construct_indexed_df)
+from apps.taskscheduler.sentiments import SentimentIndex
+
+
+class Command(BaseCommand):
+    help = 'Converts sentiment_analysis.csv + indexed_sentiments.pkl into the memory-mapped sentiment index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--csv', default='sentiment_analysis.csv')
+        parser.add_argument('--pickle', default='indexed_sentiments.pkl')
+        parser.add_argument('--output', default=SENTIMENT_INDEX_DIR)
+
+    def handle(self, *args, **options):
+        df = pd.read_csv(options['csv'], sep=",", encoding="utf-8")
+        with open(options['pickle'], 'rb') as f:
+            indexed_sentiments = pickle.load(f)
+
+        index = SentimentIndex.from_dataframe(construct_indexed_df(df, indexed_sentiments))
+        index.save(options['output'])
+
+        self.stdout.write(f"Wrote {len(index.ids)} review ids under {len(index.slots)} keys to {options['output']}")
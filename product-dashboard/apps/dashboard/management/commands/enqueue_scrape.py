@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.taskscheduler.scraper_jobs import enqueue_job
+
+
+class Command(BaseCommand):
+    help = 'Queues a scraper run, executed by `manage.py run_scraper_workers`'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', default=None, help='Only scrape this category')
+        parser.add_argument('--config', default='listing', help="Key of SCRAPER_JOBS['CONFIGS']")
+
+    def handle(self, *args, **options):
+        try:
+            job, created = enqueue_job(category=options['category'], config=options['config'])
+        except ValueError as ex:
+            raise CommandError(str(ex))
+        self.stdout.write(f"{'Queued' if created else 'Already queued'}: scraper job {job.pk}")
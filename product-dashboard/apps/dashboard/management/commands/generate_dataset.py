@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.dashboard.synthetic import generate
+
+
+class Command(BaseCommand):
+    help = 'Fills the (SQLite) scraped and default DBs with a seeded synthetic dataset. Existing rows are deleted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1, help='Dataset size, 1 = 100 products per category')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='.', help='Directory for the sentiment / parameter files')
+
+    def handle(self, *args, **options):
+        try:
+            summary = generate(scale=options['scale'], seed=options['seed'], output_dir=options['output'])
+        except ValueError as ex:
+            raise CommandError(str(ex))
+        for model, count in summary['counts'].items():
+            self.stdout.write(f"{model}: {count} rows")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.dashboard.pipeline import refresh_derived_data
+
+
+class Command(BaseCommand):
+    help = 'Refreshes the tables derived from ProductAggregate / ReviewAggregate'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', action='append', dest='categories', help='Only refresh this category (can be repeated)')
+        parser.add_argument('--force', action='store_true', help='Rebuild even if the aggregates have not changed')
+
+    def handle(self, *args, **options):
+        refresh_derived_data(categories=options['categories'], force=options['force'])
@@ -0,0 +1,56 @@
+import multiprocessing
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from apps.taskscheduler.scraper_jobs import (job_settings, requeue_stale_jobs,
+                                             work)
+from apps.taskscheduler.worker import worker_process
+
+
+class Command(BaseCommand):
+    help = 'Runs the scraper job queue with a pool of worker processes, outside the web server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes (default SCRAPER_JOBS['WORKERS'])")
+        parser.add_argument('--once', action='store_true', help='Run the queued jobs in this process, then exit')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            requeue_stale_jobs()
+            work(f"{socket.gethostname()}:once", once=True)
+            return
+
+        num_workers = options['workers'] or job_settings().get('WORKERS', 1)
+        poll_interval = job_settings().get('POLL_INTERVAL', 5)
+
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+
+        # Workers set Django up on their own, no DB connection is shared with them
+        connections.close_all()
+        context = multiprocessing.get_context('spawn')
+        workers = {}
+        self.stdout.write(f"Starting {num_workers} scraper workers")
+        while not stopping:
+            for idx in range(num_workers):
+                if idx not in workers or not workers[idx].is_alive():
+                    if idx in workers:
+                        self.stdout.write(f"Worker {idx} exited with {workers[idx].exitcode}, restarting it")
+                    workers[idx] = context.Process(target=worker_process, args=(str(idx),), daemon=False)
+                    workers[idx].start()
+            recovered = requeue_stale_jobs()
+            if recovered:
+                self.stdout.write(f"Recovered {recovered} jobs of lost workers")
+            time.sleep(poll_interval)
+
+        # Workers kill their running scrape and queue it again
+        self.stdout.write("Stopping the scraper workers")
+        for process in workers.values():
+            process.terminate()
+        for process in workers.values():
+            process.join()
@@ -0,0 +1,239 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+# Per request instrumentation of the dashboard API: wall time, SQL queries and DB time per alias,
+# JSON decoding of aggregate blobs, serialization and response size, kept in in-process histograms.
+# Every worker process keeps (and exposes) its own histograms
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+UNMATCHED_ROUTE = '<unmatched>'
+
+_current = threading.local() # RequestMetrics of the request handled by this thread
+
+
+def metrics_settings():
+    return getattr(settings, 'DASHBOARD_METRICS', None) or {}
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket boundaries, in the Prometheus sense
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+# name -> (help, buckets, label names)
+HISTOGRAMS = {
+    'dashboard_request_seconds': ('Wall time of the request', SECONDS_BUCKETS, ('route', 'view', 'method', 'status')),
+    'dashboard_db_queries': ('SQL queries run by the request', QUERY_BUCKETS, ('route', 'alias')),
+    'dashboard_db_seconds': ('Time spent in SQL queries by the request', SECONDS_BUCKETS, ('route', 'alias')),
+    'dashboard_json_decode_seconds': ('Time spent decoding aggregate JSON blobs', SECONDS_BUCKETS, ('route',)),
+    'dashboard_serialize_seconds': ('Time spent rendering the response', SECONDS_BUCKETS, ('route',)),
+    'dashboard_response_bytes': ('Size of the response body', BYTES_BUCKETS, ('route',)),
+}
+
+
+class MetricsRegistry:
+
+    def __init__(self, slow_samples=50):
+        self.histograms = {}
+        self.slow_requests = deque(maxlen=slow_samples)
+        self.lock = threading.Lock()
+
+    def observe(self, observations, slow_request=None):
+        """Records [(name, label values, value)] at once
+        """
+        with self.lock:
+            for name, labels, value in observations:
+                histogram = self.histograms.get((name, labels))
+                if histogram is None:
+                    histogram = self.histograms[(name, labels)] = Histogram(HISTOGRAMS[name][1])
+                histogram.observe(value)
+            if slow_request is not None:
+                self.slow_requests.append(slow_request)
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+            self.slow_requests.clear()
+
+    def slow(self):
+        with self.lock:
+            return list(self.slow_requests)
+
+    def export(self):
+        """Returns the histograms in the Prometheus text exposition format
+        """
+        with self.lock:
+            histograms = {key: (list(histogram.cumulative()), histogram.sum, histogram.count) for key, histogram in self.histograms.items()}
+
+        lines = []
+        for name, (help_text, _, label_names) in HISTOGRAMS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for (key_name, labels), (buckets, total, count) in sorted(histograms.items()):
+                if key_name != name:
+                    continue
+                labels = ','.join(f'{label}="{escape_label(value)}"' for label, value in zip(label_names, labels))
+                for bound, cumulative in buckets:
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{labels}}} {total}')
+                lines.append(f'{name}_count{{{labels}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+_registry = None
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        _registry = MetricsRegistry(slow_samples=metrics_settings().get('SLOW_SAMPLES', 50))
+    return _registry
+
+
+class RequestMetrics:
+    """Counters of the request in flight, filled by the DB execute wrappers and the helpers below
+    """
+
+    def __init__(self, max_sample_queries):
+        self.queries = {}
+        self.db_seconds = {}
+        self.json_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.sql = []
+        self.max_sample_queries = max_sample_queries
+
+    def execute_wrapper(self, alias):
+        def wrapper(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.queries[alias] = self.queries.get(alias, 0) + 1
+                self.db_seconds[alias] = self.db_seconds.get(alias, 0.0) + elapsed
+                if len(self.sql) < self.max_sample_queries:
+                    self.sql.append((alias, sql, elapsed))
+        return wrapper
+
+
+def load_json(value):
+    """json.loads, timed as JSON decoding of the current request. Used for the blobs decoded while serving:
+    the snapshot of a category when (re)loaded, aspect scores, sentiments
+    """
+    state = getattr(_current, 'metrics', None)
+    if state is None:
+        return json.loads(value)
+    start = time.perf_counter()
+    try:
+        return json.loads(value)
+    finally:
+        state.json_seconds += time.perf_counter() - start
+
+
+def render_response(response):
+    """Renders a template response, timed as serialization of the current request
+    """
+    if not hasattr(response, 'render') or response.is_rendered:
+        return response
+    state = getattr(_current, 'metrics', None)
+    start = time.perf_counter()
+    try:
+        return response.render()
+    finally:
+        if state is not None:
+            state.serialize_seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    """Records the metrics of the requests under DASHBOARD_METRICS['PATH_PREFIXES']
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = metrics_settings()
+        if not options.get('ENABLED') or not request.path.startswith(tuple(options.get('PATH_PREFIXES', ()))):
+            return self.get_response(request)
+
+        state = _current.metrics = RequestMetrics(options.get('MAX_SAMPLE_QUERIES', 100))
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(state.execute_wrapper(alias)))
+                response = self.get_response(request)
+        finally:
+            _current.metrics = None
+        elapsed = time.perf_counter() - start
+
+        self.record(request, response, state, elapsed, options)
+        return response
+
+    def process_template_response(self, request, response):
+        # Rendered here rather than by the handler, so that the time spent is known
+        return render_response(response)
+
+    def record(self, request, response, state, elapsed, options):
+        match = request.resolver_match
+        if match is None:
+            route, view = UNMATCHED_ROUTE, ''
+        else:
+            route, view = match.route, f'{match.func.__module__}.{match.func.__name__}'
+
+        observations = [
+            ('dashboard_request_seconds', (route, view, request.method, str(response.status_code)), elapsed),
+            ('dashboard_json_decode_seconds', (route,), state.json_seconds),
+            ('dashboard_serialize_seconds', (route,), state.serialize_seconds),
+        ]
+        for alias in connections:
+            observations.append(('dashboard_db_queries', (route, alias), state.queries.get(alias, 0)))
+            observations.append(('dashboard_db_seconds', (route, alias), state.db_seconds.get(alias, 0.0)))
+        if not response.streaming:
+            observations.append(('dashboard_response_bytes', (route,), len(response.content)))
+
+        slow_request = None
+        if elapsed >= options.get('SLOW_REQUEST_SECONDS', 1.0):
+            slow_request = {
+                'path': request.get_full_path(),
+                'route': route,
+                'view': view,
+                'method': request.method,
+                'status': response.status_code,
+                'seconds': round(elapsed, 6),
+                'finished_on': time.time(),
+                'num_queries': sum(state.queries.values()),
+                'queries': [{'alias': alias, 'sql': sql, 'seconds': round(seconds, 6)} for alias, sql, seconds in state.sql],
+            }
+        get_registry().observe(observations, slow_request)
@@ -165,4 +165,54 @@ class ReviewAggregate(models.Model):
 
 class SubcategoryMap(models.Model):
     category = models.CharField(primary_key=True, max_length=100, db_column="category")
-    subcategory_map = models.TextField(blank=True, null=True, db_column="subcategory_map")
\ No newline at end of file
+    subcategory_map = models.TextField(blank=True, null=True, db_column="subcategory_map")
+
+class CanonicalProduct(models.Model):
+    # One row per duplicate cluster of a category (products linked by duplicate_set or short_title)
+    # Keyed by the representative, the most reviewed member, whose aggregates it carries. See canonical.py
+    product_id = models.CharField(max_length=16, primary_key=True, db_column="product_id")
+    category = models.CharField(max_length=100, db_column="category")
+    brand = models.CharField(blank=True, null=True, max_length=100, db_column="brand")
+    model = models.CharField(blank=True, null=True, max_length=100, db_column="model")
+    short_title = models.TextField(blank=True, null=True)
+    product_title = models.TextField(blank=True, null=True)
+    duplicate_set = models.IntegerField(blank=True, null=True)
+    num_reviews = models.IntegerField(blank=True, null=True)
+    curr_price = models.FloatField(blank=True, null=True)
+    review_info = models.TextField(blank=True, null=True)
+    total_reviews = models.TextField(blank=True, null=True)
+    featurewise_reviews = models.TextField(blank=True, null=True)
+    subcategories = models.TextField(blank=True, null=True)
+    member_ids = models.TextField(default='[]') # JSON list of the product_ids in the cluster
+
+    class Meta:
+        index_together = [
+            ('category', 'brand'),
+            ('category', 'num_reviews'),
+        ]
+
+
+class ReviewSeries(models.Model):
+    # Daily review counts / rating sums of a duplicate_set, from `first_day` onwards
+    # Stored as raw little endian arrays (int32 / float64), see timeseries.py
+    duplicate_set = models.IntegerField(primary_key=True, db_column="duplicate_set")
+    category = models.CharField(blank=True, null=True, max_length=100, db_column="category", db_index=True)
+    first_day = models.DateField()
+    num_reviews = models.BinaryField()
+    rating_sum = models.BinaryField()
+    fingerprint = models.CharField(max_length=40)
+
+
+class DataVersion(models.Model):
+    # Bumped whenever a data source is refreshed, see cache.py
+    source = models.CharField(primary_key=True, max_length=32, db_column="source")
+    version = models.IntegerField(default=0)
+    updated_on = models.DateTimeField(auto_now=True)
+
+
+class AggregateWatermark(models.Model):
+    # How far build_aggregates got through a scraped table ('details' / 'reviews'), see aggregates.py
+    source = models.CharField(primary_key=True, max_length=32, db_column="source")
+    last_date = models.DateTimeField(blank=True, null=True) # Latest date_completed / review_date processed
+    last_id = models.IntegerField(blank=True, null=True) # Latest Reviews.id processed
+    updated_on = models.DateTimeField(auto_now=True)
@@ -1,13 +1,206 @@
-from django.core.paginator import Paginator
+import functools
+import hashlib
+
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
 from django.utils.functional import cached_property
-from rest_framework.pagination import PageNumberPagination
+from rest_framework import status
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+
+from .cache import get_data_version, get_response_cache
+from .serializers import projected_fields
+
+# How a paginated view counts its rows, set with a `count_mode` attribute on the view
+COUNT_EXACT = 'exact' # COUNT(*), cached per filter and data version
+COUNT_ESTIMATED = 'estimated' # Row estimate of the DB planner / statistics, exact if there is none
+COUNT_HAS_NEXT = 'has_next' # No count, only whether there is a next page
+
+COUNT_MODES = (COUNT_EXACT, COUNT_ESTIMATED, COUNT_HAS_NEXT)
+
+
+def count_key(queryset):
+    # Same query (filters and params included) on the same DB, same key
+    raw = f"{queryset.db}:{queryset.order_by().query}"
+    return 'count:' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def exact_count(queryset):
+    cache = get_response_cache()
+    if cache is None:
+        return queryset.count()
+
+    version, key = get_data_version(), count_key(queryset)
+    value = cache.get(version, key)
+    if value is not None:
+        return int(value)
+    count = queryset.count()
+    cache.set(version, key, str(count).encode('utf-8'))
+    return count
+
+
+def estimated_count(queryset):
+    """Returns the planner / statistics row estimate of `queryset`, or None if the DB has none.
+    MySQL: information_schema for whole tables, EXPLAIN otherwise. SQLite: sqlite_stat1 (after ANALYZE), whole tables only
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    filtered = bool(queryset.query.where)
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            if not filtered:
+                cursor.execute("SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", [table])
+                row = cursor.fetchone()
+                return int(row[0]) if row is not None and row[0] is not None else None
+            sql, params = queryset.order_by().query.sql_with_params()
+            cursor.execute(f"EXPLAIN {sql}", params)
+            columns = [column[0] for column in cursor.description]
+            row = cursor.fetchone()
+            if row is None or 'rows' not in columns or row[columns.index('rows')] is None:
+                return None
+            return int(row[columns.index('rows')])
+
+        if connection.vendor == 'sqlite' and not filtered:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row is not None else None
+
+    return None
+
+
+def count_rows(queryset, mode=COUNT_EXACT):
+    """Counts `queryset` in the given mode. Returns None for COUNT_HAS_NEXT
+    """
+    if mode == COUNT_HAS_NEXT:
+        return None
+    if mode == COUNT_ESTIMATED:
+        count = estimated_count(queryset)
+        if count is not None:
+            return count
+    return exact_count(queryset)
+
+
+class HasNextPage(Page):
+    # A page which only knows whether a next page exists, see FasterDjangoPaginator
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def next_page_number(self):
+        if not self._has_next:
+            raise EmptyPage('That page contains no results')
+        return self.number + 1
+
 
 class FasterDjangoPaginator(Paginator):
+
+    def __init__(self, object_list, per_page, count_mode=COUNT_EXACT, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_mode = count_mode
+
     @cached_property
     def count(self):
-        # only select 'id' for counting, much cheaper
-        return self.object_list.values('id').count()
+        # Not used by `page` in COUNT_HAS_NEXT mode
+        return count_rows(self.object_list, self.count_mode)
+
+    def page(self, number):
+        if self.count_mode != COUNT_HAS_NEXT:
+            return super().page(number)
+
+        # Fetch one row more than a page to know if there is a next one
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        return HasNextPage(rows[:self.per_page], number, self, len(rows) > self.per_page)
 
 
 class FasterPageNumberPagination(PageNumberPagination):
     django_paginator_class = FasterDjangoPaginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_mode = getattr(view, 'count_mode', COUNT_EXACT)
+        self.django_paginator_class = functools.partial(FasterDjangoPaginator, count_mode=self.count_mode)
+        return super().paginate_queryset(queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        if self.count_mode == COUNT_HAS_NEXT:
+            return Response({'count': None, 'next': self.get_next_link(), 'previous': self.get_previous_link(), 'results': data})
+        return super().get_paginated_response(data)
+
+
+ITEMS_PER_PAGE = 10 # Page size of the legacy integer page routes
+
+
+class KeysetPagination(CursorPagination):
+    """Cursor pagination on a unique, indexed key: every page is a `key > last ORDER BY key LIMIT n` query,
+    so deep pages cost the same as the first one. Cursors are opaque, see `next` / `previous` in the response
+    """
+    page_size = ITEMS_PER_PAGE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def __init__(self, ordering='id', count_mode=COUNT_HAS_NEXT):
+        self.ordering = ordering
+        self.count_mode = count_mode
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = count_rows(queryset, self.count_mode)
+        return super().paginate_queryset(queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count_mode != COUNT_HAS_NEXT:
+            response.data['count'] = self.count
+        return response
+
+
+def wants_cursor(request):
+    return 'cursor' in request.query_params or 'page_size' in request.query_params
+
+
+def paginated_response(request, view, queryset, serializer_class, ordering='id', page_no=None):
+    """Serializes one page of `queryset`, ordered on `ordering`, with the fields of `serializer_class`
+    (only those of `?fields=a,b` if given, the others are not even read).
+    `?cursor=` / `?page_size=` give keyset pages, with a `count` unless `view.count_mode` is COUNT_HAS_NEXT.
+    Otherwise `page_no` is an (offset based) integer page
+    """
+    try:
+        fields = projected_fields(serializer_class, request.query_params.get('fields'))
+    except ValueError as ex:
+        return Response(str(ex), status=status.HTTP_400_BAD_REQUEST)
+    # Rows are plain dicts of the selected columns, the ordering key is read for the cursor and dropped
+    key = ordering.lstrip('-')
+    queryset = queryset.values(*fields) if key in fields else queryset.values(*fields, key)
+
+    def rows(page):
+        if key in fields:
+            return list(page)
+        return [{field: row[field] for field in fields} for row in page]
+
+    if page_no is None and wants_cursor(request):
+        paginator = KeysetPagination(ordering=ordering, count_mode=getattr(view, 'count_mode', COUNT_HAS_NEXT))
+        page = paginator.paginate_queryset(queryset, request, view=view)
+        return paginator.get_paginated_response(rows(page))
+
+    if page_no is None:
+        page_no = 1
+    if page_no <= 0:
+        return Response("Page Number must be >= 1", status=status.HTTP_400_BAD_REQUEST)
+
+    queryset = queryset.order_by(ordering)[(page_no - 1) * ITEMS_PER_PAGE : (page_no) * ITEMS_PER_PAGE]
+    return Response(rows(queryset), status=status.HTTP_200_OK)
@@ -0,0 +1,13 @@
+import json
+
+PERIODS = (1, 3, 6, 8, 9) # Months of the market share periods
+
+
+def parse_review_info(value, loads=json.loads):
+    """Returns {period: reviews} of a `ProductAggregate.review_info` blob, decoded with `loads`
+    """
+    try:
+        info = loads(value) if value else {}
+    except ValueError:
+        info = {}
+    return {period: int(info.get(str(period)) or 0) for period in PERIODS}
@@ -0,0 +1,33 @@
+from .aggregates import CHUNK_SIZE, build_aggregates
+from .cache import bump_data_version
+from .canonical import rebuild_canonical_products
+from .search import index_documents
+from .timeseries import rebuild_review_series
+
+
+def refresh_derived_data(categories=None, force=False):
+    """Refreshes every table derived from the aggregate DB.
+    Needs to run after each scrape / aggregate rebuild
+    """
+    written, deleted = rebuild_canonical_products(categories=categories)
+    print(f"Canonical products synced: {written} written, {deleted} removed")
+
+    num_series = rebuild_review_series(categories=categories, force=force)
+    print(f"Daily review series rebuilt for {num_series} duplicate sets")
+
+    # Cached dashboard responses are keyed by the data version
+    bump_data_version('aggregate')
+
+
+def refresh_from_scraped(full=False, chunk_size=CHUNK_SIZE):
+    """Brings the aggregates and the search index up to date with the scraped DB, then the tables derived from them.
+    Only the categories whose aggregates changed are refreshed
+    """
+    num_products, categories = build_aggregates(full=full, chunk_size=chunk_size)
+    print(f"Aggregates rebuilt for {num_products} products in {len(categories)} categories")
+
+    num_documents = index_documents()
+    print(f"Search index: {num_documents} reviews / questions added")
+
+    if categories:
+        refresh_derived_data(categories=sorted(categories), force=full)
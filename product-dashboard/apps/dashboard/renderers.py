@@ -0,0 +1,27 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON renderer of the API (settings.REST_FRAMEWORK). Compact bodies are written by orjson when it is installed,
+# with the same output as DRF's JSONRenderer: UTF-8, no spaces, \u2028 / \u2029 escaped. Anything orjson cannot
+# encode by itself goes through DRF's encoder (Decimal, lazy strings, querysets...). Indented bodies (browsable API,
+# `indent=` in the Accept header) and values orjson rejects (e.g. integers beyond 64 bits) use the json module
+
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson is not None else 0
+
+
+class FastJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if b'\xe2\x80' in ret:
+            ret = ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+        return ret
@@ -0,0 +1,140 @@
+import itertools
+import threading
+import time
+
+from django.conf import settings
+from django.db import Error, connections
+
+# Sends the unmanaged scraped models to their home alias (settings.DATABASE_ROUTING['HOMES']), so that views
+# do not need `.using()`. Reads go to a healthy replica of the home alias when there is one, and fail over to
+# the home alias otherwise. Writes, and reads inside a transaction on the home alias, always go to the home alias.
+# Replica health checks run in a background thread, requests only read their last result
+
+HEALTH_CHECK_INTERVAL = 10 # Seconds a replica health check is trusted
+
+PING_AFTER = 60 # Seconds a persistent connection can sit idle before it is pinged
+
+_health = {} # alias -> (healthy, checked_at)
+_probing = set() # Aliases with a health check in progress
+_health_lock = threading.Lock()
+
+_requests = itertools.count() # Spreads the requests over the replicas, see next_replica()
+_local = threading.local()
+
+
+def routing_settings():
+    return getattr(settings, 'DATABASE_ROUTING', None) or {}
+
+
+def home_alias(model):
+    return routing_settings().get('HOMES', {}).get(model._meta.label_lower)
+
+
+def replica_aliases(alias):
+    # Replicas missing from DATABASES (e.g. replaced by local settings) are ignored
+    return [replica for replica in routing_settings().get('REPLICAS', {}).get(alias, []) if replica in settings.DATABASES]
+
+
+def check_health(alias):
+    """Connects to `alias` and records whether it accepts connections.
+    Uses the connection of the calling thread, which is closed afterwards
+    """
+    healthy = False
+    connection = connections[alias]
+    try:
+        connection.ensure_connection()
+        healthy = connection.is_usable()
+    except Error as ex:
+        print(f"Database {alias} is unavailable: {ex}")
+    finally:
+        try:
+            connection.close()
+        except Error:
+            pass
+        with _health_lock:
+            _health[alias] = (healthy, time.monotonic())
+            _probing.discard(alias)
+    return healthy
+
+
+def is_healthy(alias):
+    """Returns whether `alias` accepted connections at its last health check, False if it was never checked.
+    A check older than HEALTH_CHECK_INTERVAL seconds is redone in a background thread, without waiting for it
+    """
+    interval = routing_settings().get('HEALTH_CHECK_INTERVAL', HEALTH_CHECK_INTERVAL)
+    with _health_lock:
+        healthy, checked_at = _health.get(alias, (False, None))
+        probe = (checked_at is None or time.monotonic() - checked_at >= interval) and alias not in _probing
+        if probe:
+            _probing.add(alias)
+    if probe:
+        threading.Thread(target=check_health, args=(alias,), name=f'health-check-{alias}', daemon=True).start()
+    return healthy
+
+
+def next_replica(**kwargs):
+    # On request_started: each request reads from the next healthy replica, and from that one only
+    _local.replica = next(_requests)
+
+
+def ping_idle_connections(**kwargs):
+    """Closes the persistent connections which died while idle (e.g. after MySQL's wait_timeout),
+    so that the request reconnects instead of failing on its first query
+    """
+    ping_after = routing_settings().get('PING_AFTER', PING_AFTER)
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None or not connection.settings_dict.get('CONN_MAX_AGE'):
+            continue
+        if now - getattr(connection, 'last_used_at', now) > ping_after and not connection.is_usable():
+            connection.close()
+
+
+def mark_connections_used(**kwargs):
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is not None:
+            connection.last_used_at = now
+
+
+class ScrapedRouter:
+
+    def db_for_read(self, model, **hints):
+        home = home_alias(model)
+        if home is None:
+            return None
+        if connections[home].in_atomic_block:
+            # Read your own writes
+            return home
+        healthy = [replica for replica in replica_aliases(home) if is_healthy(replica)]
+        if not healthy:
+            return home
+        # Outside of a request (commands, jobs), every read takes the next replica
+        replica = getattr(_local, 'replica', None)
+        if replica is None:
+            replica = next(_requests)
+        return healthy[replica % len(healthy)]
+
+    def db_for_write(self, model, **hints):
+        return home_alias(model)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = set()
+        for obj in (obj1, obj2):
+            home = home_alias(obj)
+            aliases.add(home or 'default')
+        if len(aliases) == 1:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        routing = routing_settings()
+        if any(db in replicas for replicas in routing.get('REPLICAS', {}).values()):
+            return False
+        homes = routing.get('HOMES', {})
+        if model_name is not None and f'{app_label}.{model_name}' in homes:
+            return db == homes[f'{app_label}.{model_name}']
+        # Nothing else belongs to the scraped DBs
+        if db in homes.values():
+            return False
+        return None
@@ -0,0 +1,185 @@
+import base64
+import html
+import json
+import re
+import sqlite3
+
+from django.conf import settings
+
+from .models import Qanda, Reviews
+
+# Full-text index of the review and Q&A text, in a SQLite FTS5 file next to the app (settings.SEARCH_INDEX).
+# `documents` holds one row per review / question with its filter columns, `documents_fts` indexes its text
+# (external content, so the text is stored once). Rows are added in id order from the scraped tables,
+# `watermarks` remembers the last id indexed per kind
+
+KINDS = {
+    # kind: (model, title field, body field, date field, rating field, rowid tag)
+    'review': (Reviews, 'title', 'body', 'review_date', 'rating', 0),
+    'qanda': (Qanda, 'question', 'answer', 'date', None, 1),
+}
+
+CHUNK_SIZE = 5000 # Rows read from the scraped DB per batch
+
+DEFAULT_LIMIT = 20
+
+MAX_LIMIT = 100
+
+SNIPPET_TOKENS = 16
+
+HIGHLIGHT_START, HIGHLIGHT_END = '\ue000', '\ue001' # Private use characters marking the matches, see highlighted()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    rowid INTEGER PRIMARY KEY, -- source id * 2 + rowid tag of the kind
+    kind TEXT NOT NULL,
+    source_id INTEGER NOT NULL,
+    product_id TEXT,
+    category TEXT,
+    rating REAL,
+    date TEXT,
+    title TEXT,
+    body TEXT
+);
+CREATE INDEX IF NOT EXISTS documents_category ON documents (category, product_id);
+CREATE INDEX IF NOT EXISTS documents_product ON documents (product_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    title, body, content='documents', content_rowid='rowid', tokenize='porter unicode61'
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    kind TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL
+);
+"""
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_settings():
+    return getattr(settings, 'SEARCH_INDEX', None) or {}
+
+
+def open_index(path=None):
+    connection = sqlite3.connect(path or search_settings().get('PATH', 'search_index.sqlite3'))
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def index_documents(full=False, chunk_size=None, path=None, using='scraped'):
+    """Adds the reviews / questions scraped since the last run to the index, or reindexes everything if `full`.
+    Each chunk is committed together with its watermark. Returns the number of indexed rows
+    """
+    chunk_size = chunk_size or search_settings().get('CHUNK_SIZE', CHUNK_SIZE)
+    connection = open_index(path)
+    try:
+        if full:
+            with connection:
+                connection.execute("DELETE FROM documents")
+                connection.execute("INSERT INTO documents_fts (documents_fts) VALUES ('delete-all')")
+                connection.execute("DELETE FROM watermarks")
+
+        num_indexed = 0
+        for kind, (model, title_field, body_field, date_field, rating_field, tag) in KINDS.items():
+            row = connection.execute("SELECT last_id FROM watermarks WHERE kind = ?", (kind,)).fetchone()
+            last_id = row[0] if row else 0
+            fields = ['id', 'product_id', 'product__category', title_field, body_field, date_field] + ([rating_field] if rating_field else [])
+            while True:
+                # Ids only grow, reading the primary keeps lagging replicas from skipping rows
+                rows = list(model.objects.using(using).filter(id__gt=last_id).order_by('id').values_list(*fields)[:chunk_size])
+                if not rows:
+                    break
+                documents = []
+                for values in rows:
+                    source_id, product_id, category, title, body, date = values[:6]
+                    rating = values[6] if rating_field else None
+                    documents.append((source_id * 2 + tag, kind, source_id, product_id, category, rating, date.isoformat() if date else None, title or '', body or ''))
+                last_id = rows[-1][0]
+                with connection:
+                    connection.executemany("INSERT INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", documents)
+                    connection.executemany("INSERT INTO documents_fts (rowid, title, body) VALUES (?, ?, ?)", [(document[0], document[7], document[8]) for document in documents])
+                    connection.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?)", (kind, last_id))
+                num_indexed += len(documents)
+
+        if full:
+            connection.execute("INSERT INTO documents_fts (documents_fts) VALUES ('optimize')")
+            connection.commit()
+        return num_indexed
+    finally:
+        connection.close()
+
+
+def match_expression(query):
+    # Every word must match, quoted so that user input is never parsed as FTS5 syntax
+    terms = TERM_RE.findall(query)
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def highlighted(text):
+    # The indexed text is raw user input: it is escaped, then only the match markers become markup
+    if text is None:
+        return None
+    return html.escape(text, quote=False).replace(HIGHLIGHT_START, '<b>').replace(HIGHLIGHT_END, '</b>')
+
+
+def encode_cursor(score, rowid):
+    return base64.urlsafe_b64encode(json.dumps([score, rowid]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        score, rowid = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        return float(score), int(rowid)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError(f"Invalid cursor {cursor}")
+
+
+def search(query, category=None, product_id=None, kind=None, min_rating=None, max_rating=None, limit=DEFAULT_LIMIT, cursor=None, path=None):
+    """Returns the documents matching every word of `query`, best BM25 score first, with HTML escaped titles / snippets
+    where the matches are in <b>, and the cursor of the next page (None on the last page)
+    """
+    expression = match_expression(query)
+    if not expression:
+        raise ValueError("The query has no words to search for")
+
+    where = ["documents_fts MATCH ?"]
+    params = [expression]
+    for column, value in (('documents.category', category), ('documents.product_id', product_id), ('documents.kind', kind)):
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if min_rating is not None:
+        where.append("documents.rating >= ?")
+        params.append(min_rating)
+    if max_rating is not None:
+        where.append("documents.rating <= ?")
+        params.append(max_rating)
+    if cursor is not None:
+        # Lower bm25() is better, ties are broken by rowid
+        score, rowid = decode_cursor(cursor)
+        where.append("(bm25(documents_fts) > ? OR (bm25(documents_fts) = ? AND documents.rowid > ?))")
+        params.extend([score, score, rowid])
+
+    sql = f"""
+        SELECT documents.rowid, bm25(documents_fts) AS score, documents.kind, documents.source_id, documents.product_id,
+               documents.category, documents.rating, documents.date, highlight(documents_fts, 0, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}'),
+               snippet(documents_fts, 1, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '...', {SNIPPET_TOKENS})
+        FROM documents_fts JOIN documents ON documents.rowid = documents_fts.rowid
+        WHERE {' AND '.join(where)}
+        ORDER BY score, documents.rowid
+        LIMIT ?
+    """
+    params.append(limit + 1)
+
+    connection = open_index(path)
+    try:
+        rows = connection.execute(sql, params).fetchall()
+    finally:
+        connection.close()
+
+    results = [{
+        'kind': row[2], 'id': row[3], 'product_id': row[4], 'category': row[5], 'rating': row[6], 'date': row[7],
+        'title': highlighted(row[8]), 'snippet': highlighted(row[9]), 'score': -row[1],
+    } for row in rows[:limit]]
+    next_cursor = encode_cursor(rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+    return results, next_cursor
+
@@ -33,3 +33,25 @@ class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reviews
         fields = '__all__'
+
+
+# The list endpoints do not instantiate the serializers above: pages are fetched as `values()` dicts of the same
+# fields, which render to the same JSON (a ForeignKey under its name, valued with the pk, as ModelSerializer does)
+
+def serializer_fields(serializer_class):
+    # The fields of a `fields = '__all__'` ModelSerializer, in its order
+    return [field.name for field in serializer_class.Meta.model._meta.concrete_fields]
+
+
+def projected_fields(serializer_class, requested=None):
+    """Returns the fields of `serializer_class` to send: all of them, or those listed in `requested`
+    (the comma separated `?fields=` param), in model order. Raises ValueError for an unknown field
+    """
+    fields = serializer_fields(serializer_class)
+    if not requested:
+        return fields
+    names = set(name.strip() for name in requested.split(',') if name.strip())
+    unknown = names.difference(fields)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}. Available fields: {', '.join(fields)}")
+    return [field for field in fields if field in names]
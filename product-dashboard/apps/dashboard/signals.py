@@ -0,0 +1,26 @@
+from django.core.signals import request_finished, request_started
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_data_version
+from .models import SubcategoryMap
+from .routers import mark_connections_used, next_replica, ping_idle_connections
+from .snapshot import clear_category_snapshots
+from .subcategories import clear_subcategory_resolvers
+
+
+@receiver(post_save, sender=SubcategoryMap)
+@receiver(post_delete, sender=SubcategoryMap)
+def update_subcategory_map(sender, instance, **kwargs):
+    # Other processes reload their resolvers when they see the new data version
+    clear_subcategory_resolvers()
+    clear_category_snapshots()
+    bump_data_version('aggregate')
+
+
+# Liveness pings of the persistent DB connections
+request_started.connect(ping_idle_connections)
+request_finished.connect(mark_connections_used)
+
+# Each request reads from one replica
+request_started.connect(next_replica)
@@ -0,0 +1,704 @@
+import datetime
+import threading
+import warnings
+
+import numpy as np
+from django.conf import settings
+
+from .cache import get_data_version
+from .metrics import load_json
+from .models import CanonicalProduct, ReviewSeries
+from .periods import PERIODS, parse_review_info
+from .subcategories import get_subcategory_resolver, parse_subcategories
+from .timeseries import COUNT_DTYPE, SUM_DTYPE, ReviewSeriesStore, parse_window
+
+# In-memory analytics engine of the dashboard. The canonical products of a category are read once per data version
+# into a CategorySnapshot of NumPy columns, shared by every request of the process. Each widget (named after the
+# endpoint it stands for) is a function of (snapshot, params) built on grouped vectorized operations, and the
+# endpoints / the batch endpoint are thin adapters over them
+
+SNAPSHOT_FIELDS = ('product_id', 'brand', 'model', 'short_title', 'product_title', 'duplicate_set', 'num_reviews',
+                   'curr_price', 'review_info', 'total_reviews', 'featurewise_reviews', 'subcategories')
+
+MAX_MONTHS = 12 # Months of `total_reviews` addressable by the review count
+
+MAX_WIDGETS = 20 # Widgets per batch
+
+MAX_WINDOWS = 104 # Defaults of DASHBOARD_WIDGETS['MAX_WINDOWS'] / ['MAX_WINDOW_DAYS'], see rating()
+
+MAX_WINDOW_DAYS = 366
+
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y")
+
+PERCENTILES = (25, 50, 75) # Default percentiles of the aspect comparison
+
+
+class WidgetError(Exception):
+    # Invalid widget params, reported as a 400
+    pass
+
+
+def parse_monthly_reviews(value):
+    """Returns [reviews of every month, reviews of month 1, ..., month MAX_MONTHS] of a `total_reviews` blob
+    """
+    try:
+        info = load_json(value) if value else {}
+    except ValueError:
+        info = {}
+    row = [0] * (MAX_MONTHS + 1)
+    for month, count in info.items():
+        try:
+            count = int(count or 0)
+        except (TypeError, ValueError):
+            continue
+        row[0] += count
+        if str(month).isdigit() and 0 < int(month) <= MAX_MONTHS:
+            row[int(month)] += count
+    return row
+
+
+def encode(values):
+    """Returns (codes, uniques) of a list of strings, with codes in the sort order of the values
+    """
+    uniques, codes = np.unique(np.array(values, dtype=object), return_inverse=True)
+    return codes.reshape(-1).astype(np.int64), list(uniques)
+
+
+class CategorySnapshot:
+    """The `CanonicalProduct` rows (one per duplicate cluster) of a category as columns, in product_id order
+    """
+
+    def __init__(self, category, products):
+        self.category = category
+        self.size = len(products)
+        self.product_ids = [product['product_id'] for product in products]
+        self.brands = [product['brand'] for product in products]
+        self.models = [product['model'] for product in products]
+        self.short_titles = [product['short_title'] for product in products]
+        self.product_titles = [product['product_title'] for product in products]
+        self.duplicate_sets = [product['duplicate_set'] for product in products]
+        self.featurewise_reviews = [product['featurewise_reviews'] for product in products]
+
+        # The market share endpoints only count products with a brand and a model
+        self.listed = np.array([brand is not None and model is not None for brand, model in zip(self.brands, self.models)], dtype=bool)
+        self.num_reviews = np.array([product['num_reviews'] or 0 for product in products], dtype=np.int64)
+        self.prices = np.array([product['curr_price'] if product['curr_price'] is not None else np.nan for product in products], dtype=np.float64)
+
+        # Brands are grouped by their exact name, and matched case insensitively. Codes follow the sort order of the names
+        self.brand_codes, self.brand_names = encode([brand or '' for brand in self.brands])
+        self.brand_key_codes, brand_keys = encode([(brand or '').lower() for brand in self.brands])
+        self.brand_keys = {key: code for code, key in enumerate(brand_keys)}
+        # Ties of the top-N rankings are broken by short_title
+        self.title_ranks, _ = encode([short_title or '' for short_title in self.short_titles])
+
+        # Reviews of the last N months, one column per PERIODS
+        periods = [parse_review_info(product['review_info'], loads=load_json) for product in products]
+        self.period_reviews = np.array([[info[period] for period in PERIODS] for info in periods], dtype=np.int64).reshape(self.size, len(PERIODS))
+        # Reviews of every month in column 0, then the reviews of month 1, 2, ...
+        self.monthly_reviews = np.array([parse_monthly_reviews(product['total_reviews']) for product in products], dtype=np.int64).reshape(self.size, MAX_MONTHS + 1)
+
+        # Subcategory membership, by lowercased name
+        memberships = [parse_subcategories(product['subcategories'], loads=load_json) for product in products]
+        self.subcategory_names = {name: idx for idx, name in enumerate(sorted(set().union(*memberships)))}
+        self.membership = np.zeros((self.size, len(self.subcategory_names)), dtype=bool)
+        for row, names in enumerate(memberships):
+            self.membership[row, [self.subcategory_names[name] for name in names]] = True
+
+        # Guards the data loaded lazily below, which is filled once and shared by the threads of the process.
+        # Reentrant: the lazy arrays are built from `series`
+        self._lock = threading.RLock()
+        self._series = {}
+        self._prefix = None
+        self._ratings = None
+        self._aspects = {}
+        self._aspect_matrix = None
+
+    @classmethod
+    def load(cls, category):
+        return cls(category, list(CanonicalProduct.objects.filter(category=category).values(*SNAPSHOT_FIELDS).order_by('product_id')))
+
+    @property
+    def resolver(self):
+        return get_subcategory_resolver(self.category)
+
+    def leaves(self, subcategory):
+        """Returns the leaves of `subcategory`, None for the whole category
+        """
+        if subcategory is None:
+            return None
+        resolver = self.resolver
+        leaves = resolver.resolve(subcategory) if resolver is not None else None
+        if leaves is None:
+            raise WidgetError(f"subcategory {subcategory} not found for category {self.category}")
+        return leaves
+
+    def members(self, leaves, listed_only=False):
+        """Mask of the products belonging to any of `leaves` (all of them if None).
+        `listed_only` keeps those with a brand and a model, as the market share endpoints do
+        """
+        if leaves is None:
+            mask = np.ones(self.size, dtype=bool)
+        else:
+            columns = [self.subcategory_names[name] for name in set(leaf.lower() for leaf in leaves) if name in self.subcategory_names]
+            mask = self.membership[:, columns].any(axis=1)
+        return mask & self.listed if listed_only else mask
+
+    def brand_mask(self, brand):
+        # Case insensitive
+        code = self.brand_keys.get(brand.lower())
+        if code is None:
+            return np.zeros(self.size, dtype=bool)
+        return self.brand_key_codes == code
+
+    def period_column(self, period):
+        return self.period_reviews[:, PERIODS.index(period)]
+
+    def ranked(self, mask, reviews):
+        """Indices of the products in `mask`, most reviewed first, ties by short_title then product_id
+        """
+        idx = np.flatnonzero(mask)
+        return idx[np.lexsort((self.title_ranks[idx], -reviews[idx]))]
+
+    def brand_totals(self, mask, reviews):
+        """Returns the (brand codes, totals) of the brands having products in `mask`
+        """
+        counts = np.bincount(self.brand_codes[mask], minlength=len(self.brand_names))
+        totals = np.bincount(self.brand_codes[mask], weights=reviews[mask], minlength=len(self.brand_names)).astype(np.int64)
+        codes = np.flatnonzero(counts)
+        return codes, totals[codes]
+
+    def series(self, duplicate_sets):
+        """`ReviewSeries` of `duplicate_sets`, reading only those not loaded by an earlier request
+        """
+        wanted = set(duplicate_sets) - {None}
+        with self._lock:
+            missing = wanted - set(self._series)
+            if missing:
+                loaded = {instance.duplicate_set: instance for instance in ReviewSeries.objects.filter(duplicate_set__in=missing)}
+                for duplicate_set in missing:
+                    self._series[duplicate_set] = loaded.get(duplicate_set)
+            return [self._series[duplicate_set] for duplicate_set in wanted if self._series[duplicate_set] is not None]
+
+    def review_prefix(self):
+        """Cumulative daily review counts of every product, from its review series, as one flat array.
+        Returns (offsets, first days as ordinals, lengths, cumulative): the count of the first k days of row i
+        is cumulative[offsets[i] + k]
+        """
+        if self._prefix is None:
+            with self._lock:
+                if self._prefix is None:
+                    self._prefix = self._load_prefix()
+        return self._prefix
+
+    def _load_prefix(self):
+        series = {instance.duplicate_set: instance for instance in self.series(self.duplicate_sets)}
+        offsets = np.zeros(self.size, dtype=np.int64)
+        first_days = np.zeros(self.size, dtype=np.int64)
+        lengths = np.zeros(self.size, dtype=np.int64)
+        chunks = []
+        position = 0
+        for row, duplicate_set in enumerate(self.duplicate_sets):
+            instance = series.get(duplicate_set)
+            counts = np.frombuffer(bytes(instance.num_reviews), dtype=COUNT_DTYPE) if instance is not None else np.zeros(0, dtype=COUNT_DTYPE)
+            # A leading zero, so that a range is the difference of two entries
+            chunks.append(np.concatenate([np.zeros(1, dtype=np.int64), np.cumsum(counts, dtype=np.int64)]))
+            offsets[row], lengths[row] = position, len(counts)
+            if instance is not None:
+                first_days[row] = instance.first_day.toordinal()
+            position += len(counts) + 1
+        cumulative = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64)
+        return offsets, first_days, lengths, cumulative
+
+    def range_reviews(self, start, end):
+        """Reviews of every product dated within [start, end], two lookups per product
+        """
+        offsets, first_days, lengths, cumulative = self.review_prefix()
+        lower = np.clip(start.toordinal() - first_days, 0, lengths)
+        upper = np.clip(end.toordinal() - first_days + 1, 0, lengths)
+        return cumulative[offsets + upper] - cumulative[offsets + lower]
+
+    @property
+    def ratings(self):
+        """Average rating of every product over its whole review series, NaN without reviews
+        """
+        if self._ratings is None:
+            with self._lock:
+                if self._ratings is None:
+                    self._ratings = self._load_ratings()
+        return self._ratings
+
+    def _load_ratings(self):
+        series = {instance.duplicate_set: instance for instance in self.series(self.duplicate_sets)}
+        ratings = np.full(self.size, np.nan)
+        for row, duplicate_set in enumerate(self.duplicate_sets):
+            instance = series.get(duplicate_set)
+            if instance is None:
+                continue
+            num_reviews = np.frombuffer(bytes(instance.num_reviews), dtype=COUNT_DTYPE).sum()
+            if num_reviews > 0:
+                ratings[row] = np.frombuffer(bytes(instance.rating_sum), dtype=SUM_DTYPE).sum() / num_reviews
+        return ratings
+
+    def aspects(self, row):
+        """Decoded `featurewise_reviews` of a product
+        """
+        aspects = self._aspects.get(row)
+        if aspects is None:
+            with self._lock:
+                aspects = self._aspects.get(row)
+                if aspects is None:
+                    try:
+                        aspects = load_json(self.featurewise_reviews[row] or '{}')
+                    except ValueError:
+                        aspects = {}
+                    aspects = aspects if isinstance(aspects, dict) else {}
+                    self._aspects[row] = aspects
+        return dict(aspects)
+
+    def aspect_matrix(self):
+        """Returns (aspect names, scores): the `featurewise_reviews` of every product as a float32 matrix,
+        one column per aspect, NaN where the product has no score
+        """
+        if self._aspect_matrix is None:
+            with self._lock:
+                if self._aspect_matrix is None:
+                    self._aspect_matrix = self._load_aspect_matrix()
+        return self._aspect_matrix
+
+    def _load_aspect_matrix(self):
+        decoded = [self.aspects(row) for row in range(self.size)]
+        names = sorted(set(str(name) for aspects in decoded for name in aspects))
+        columns = {name: idx for idx, name in enumerate(names)}
+        scores = np.full((self.size, len(names)), np.nan, dtype=np.float32)
+        for row, aspects in enumerate(decoded):
+            for name, value in aspects.items():
+                try:
+                    scores[row, columns[str(name)]] = float(value)
+                except (TypeError, ValueError):
+                    continue
+        return names, scores
+
+
+_snapshots = {'version': None, 'categories': {}}
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot(category):
+    """Returns the `CategorySnapshot` of `category`, loaded once per data version and shared by all requests of the process
+    """
+    version = get_data_version()
+    with _snapshots_lock:
+        if _snapshots['version'] != version:
+            _snapshots['categories'] = {}
+            _snapshots['version'] = version
+        snapshot = _snapshots['categories'].get(category)
+    if snapshot is None:
+        snapshot = CategorySnapshot.load(category)
+        # Unknown categories are not kept, they are user input
+        if snapshot.size:
+            with _snapshots_lock:
+                if _snapshots['version'] == version:
+                    snapshot = _snapshots['categories'].setdefault(category, snapshot)
+    return snapshot
+
+
+def clear_category_snapshots():
+    with _snapshots_lock:
+        _snapshots['version'] = None
+        _snapshots['categories'] = {}
+
+
+def get_int(params, name, default=None):
+    value = params.get(name, default)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise WidgetError(f"{name} must be an integer")
+
+
+def widget_settings():
+    return getattr(settings, 'DASHBOARD_WIDGETS', None) or {}
+
+
+def get_list(params, name):
+    value = params.get(name)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def get_str(params, name):
+    # Batch params are JSON, not query params: names (brands, models, subcategories...) need to be checked
+    value = params.get(name)
+    if value is not None and not isinstance(value, str):
+        raise WidgetError(f"{name} must be a string")
+    return value
+
+
+def get_str_list(params, name):
+    values = get_list(params, name)
+    if not all(isinstance(value, str) for value in values):
+        raise WidgetError(f"{name} must be a string or a list of strings")
+    return values
+
+
+def get_date(params, name):
+    value = params.get(name)
+    if value is None:
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(str(value), date_format).date()
+        except ValueError:
+            continue
+    raise WidgetError(f"{name} must be YYYY-MM-DD or dd/mm/YYYY")
+
+
+def market_share_params(params, default_period=1):
+    max_products = get_int(params, 'max_products', 10)
+    if max_products <= 0:
+        raise WidgetError("max_products must be a positive integer")
+    period = get_int(params, 'period', default_period)
+    if period not in PERIODS:
+        raise WidgetError("Period must be one of 1, 3 or 6, 8, 9")
+    return max_products, period
+
+
+def share_reviews(snapshot, params, period):
+    """Review counts the market shares rank on: those dated within [`start`, `end`] when either is given
+    (open ended otherwise), else those of the last `period` months
+    """
+    start, end = get_date(params, 'start'), get_date(params, 'end')
+    if start is None and end is None:
+        return snapshot.period_column(period)
+    if start is not None and end is not None and start > end:
+        raise WidgetError("start must not be after end")
+    return snapshot.range_reviews(start or datetime.date.min, end or datetime.date.max)
+
+
+def model_rows(snapshot, rows, reviews):
+    return [{'product_title': snapshot.product_titles[row], 'model': snapshot.short_titles[row], 'brand': snapshot.brands[row], 'num_reviews': int(reviews[row])} for row in rows]
+
+
+def brand_list(snapshot, params):
+    # Same as `brandlist`: brands with a model, most reviewed model first
+    mask = snapshot.members(snapshot.leaves(get_str(params, 'subcategory')), listed_only=True)
+    return list(dict.fromkeys(snapshot.brands[row] for row in snapshot.ranked(mask, snapshot.num_reviews)))
+
+
+def model_list(snapshot, params):
+    # Same as `modellist`
+    brand = get_str(params, 'brand')
+    if brand is None:
+        raise WidgetError("Need to specify a brand")
+    mask = snapshot.members(snapshot.leaves(get_str(params, 'subcategory')), listed_only=True) & snapshot.brand_mask(brand)
+    return list(dict.fromkeys(snapshot.short_titles[row] for row in snapshot.ranked(mask, snapshot.num_reviews)))
+
+
+def brand_model_list(snapshot, params):
+    # Same as `brand-model`
+    mask = snapshot.members(snapshot.leaves(get_str(params, 'subcategory')), listed_only=True)
+    results = {}
+    for row in snapshot.ranked(mask, snapshot.num_reviews):
+        results.setdefault(snapshot.brands[row], {})[snapshot.short_titles[row]] = None
+    return {brand: list(models) for brand, models in results.items()}
+
+
+def brand_market_share(snapshot, params):
+    # Same as `brandmarketshare`
+    max_products, period = market_share_params(params)
+    mask = snapshot.members(snapshot.leaves(get_str(params, 'subcategory')), listed_only=True)
+    codes, totals = snapshot.brand_totals(mask, share_reviews(snapshot, params, period))
+    # Codes are in the order of the brand names
+    order = np.lexsort((codes, -totals))[:max_products]
+    return [{'brand': snapshot.brand_names[codes[idx]], 'num_reviews': int(totals[idx])} for idx in order]
+
+
+def model_market_share(snapshot, params):
+    # Same as `modelmarketshare`
+    max_products, period = market_share_params(params)
+    mask = snapshot.members(snapshot.leaves(get_str(params, 'subcategory')), listed_only=True)
+    brand = get_str(params, 'brand')
+    if brand is not None:
+        mask &= np.array([name == brand for name in snapshot.brands], dtype=bool)
+    reviews = share_reviews(snapshot, params, period)
+    return model_rows(snapshot, snapshot.ranked(mask, reviews)[:max_products], reviews)
+
+
+def subcategory_market_share(snapshot, params):
+    # Same as `subcategorymarketshare`, 'all' being the whole category
+    max_products, period = market_share_params(params)
+    subcategory = get_str(params, 'subcategory')
+    if subcategory is None:
+        raise WidgetError("Need to specify a subcategory")
+    mask = snapshot.members(None if subcategory == 'all' else snapshot.leaves(subcategory), listed_only=True)
+    reviews = share_reviews(snapshot, params, period)
+    rows = model_rows(snapshot, snapshot.ranked(mask, reviews)[:max_products], reviews)
+    return {subcategory: rows} if rows else {}
+
+
+def individual_market_share(snapshot, params):
+    # Same as `individualmarketshare`: the products of one `model`
+    model = get_str(params, 'model')
+    if model is None:
+        raise WidgetError("Need to send model")
+    max_products, period = market_share_params(params, default_period=6)
+    subcategory = get_str(params, 'subcategory')
+    mask = snapshot.members(snapshot.leaves(subcategory), listed_only=True)
+    mask &= np.array([name == model for name in snapshot.models], dtype=bool)
+    reviews = share_reviews(snapshot, params, period)
+    return [{'subcategory': subcategory, **row} for row in model_rows(snapshot, snapshot.ranked(mask, reviews)[:max_products], reviews)]
+
+
+def review_count(snapshot, params):
+    # Same as `review-count`
+    try:
+        period = get_int(params, 'period')
+        assert period is None or 0 < period <= MAX_MONTHS
+    except (AssertionError, WidgetError):
+        raise WidgetError("period query param must be an integer")
+    mask = snapshot.members(snapshot.leaves(get_str(params, 'subcategory')), listed_only=True)
+    return {'total_reviews': int(snapshot.monthly_reviews[mask, period or 0].sum())}
+
+
+def brand_models(snapshot, brands, leaves):
+    """Rows of the canonical products of every brand (matched case insensitively), as the rating endpoints list them
+    """
+    members = snapshot.members(leaves)
+    return {brand: np.flatnonzero(members & snapshot.brand_mask(brand)) for brand in brands}
+
+
+def rating(snapshot, params):
+    # Same as `rating`
+    brands = get_str_list(params, 'brand')
+    if not brands:
+        raise WidgetError("Need to specify a brand")
+    try:
+        window = parse_window(params.get('window'))
+        num_windows = int(params['windows']) if 'windows' in params else int(params.get('weeks', 8)) + 1
+        assert num_windows > 0
+    except (AssertionError, TypeError, ValueError):
+        raise WidgetError("`weeks`, `window` and `windows` must be positive integers")
+    # The windows are computed over a dense (products x days) matrix, their number and length are capped
+    options = widget_settings()
+    max_windows, max_window_days = options.get('MAX_WINDOWS', MAX_WINDOWS), options.get('MAX_WINDOW_DAYS', MAX_WINDOW_DAYS)
+    if num_windows > max_windows:
+        raise WidgetError(f"At most {max_windows} windows")
+    if window != 'month' and window > max_window_days:
+        raise WidgetError(f"`window` must be at most {max_window_days} days")
+
+    end_date = get_date(params, 'end_date')
+
+    models = brand_models(snapshot, brands, snapshot.leaves(get_str(params, 'subcategory')))
+    store = ReviewSeriesStore(snapshot.series([snapshot.duplicate_sets[row] for brand in models for row in models[brand]]))
+    if end_date is None:
+        # Default to the latest day we have reviews for
+        end_date = store.last_day() or datetime.date.today()
+
+    results = {}
+    for brand in models:
+        boundaries, windows = store.windows([snapshot.duplicate_sets[row] for row in models[brand]], end_date, window=window, num_windows=num_windows)
+        results[brand] = []
+        for row in models[brand]:
+            duplicate_set = snapshot.duplicate_sets[row]
+            # Windows are listed newest first: `start_date` is the latest day of the window
+            ratings = [
+                {"start_date": _end_date.strftime("%d/%m/%Y"), "end_date": start_date.strftime("%d/%m/%Y"), "rating": value, "num_reviews": num_reviews}
+                for (start_date, _end_date), (num_reviews, value) in zip(boundaries, windows[duplicate_set])
+            ]
+            results[brand].append({"product_title": snapshot.product_titles[row], "model": snapshot.short_titles[row], "ratings": ratings, "duplicate_set": duplicate_set})
+    return results
+
+
+def aspect_rating(snapshot, params):
+    # Same as `aspect-rating`
+    brands = get_str_list(params, 'brand')
+    if not brands:
+        raise WidgetError("Need to specify a brand")
+    models = brand_models(snapshot, brands, snapshot.leaves(get_str(params, 'subcategory')))
+    return {
+        brand: [{"product_title": snapshot.product_titles[row], "model": snapshot.short_titles[row], "aspect_rating": snapshot.aspects(row)} for row in models[brand]]
+        for brand in models
+    }
+
+
+def fetch_subcategories(snapshot, params):
+    # `fetchsubcategories`: the GET listing, or the POST market share when `subcategories` is sent
+    resolver = snapshot.resolver
+    requested = get_str(params, 'subcategories')
+    if requested is None:
+        features, prices = set(), set()
+        # Like the endpoint always did, a `subcategory` filter lists nothing
+        if resolver is not None and get_str(params, 'subcategory') is None:
+            for name, leaves in resolver.groups.items():
+                (prices if name == "Price" else features).update(leaves)
+        return {'features': list(features), 'price': list(prices)}
+
+    max_products, period = market_share_params(params)
+    if resolver is None:
+        return {}
+    subcategories = resolver.leaves if requested == "all" else resolver.resolve(requested)
+    if subcategories is None:
+        raise WidgetError(f"subcategory {requested} not found for category {snapshot.category}")
+
+    reviews = share_reviews(snapshot, params, period)
+    results = {}
+    for subcategory in subcategories:
+        ranked = snapshot.ranked(snapshot.members([subcategory], listed_only=True), reviews)
+        if not len(ranked):
+            continue
+        # Each brand is shown with its most reviewed model, brands are ordered by their total then by that model's rank
+        codes, first = np.unique(snapshot.brand_codes[ranked], return_index=True)
+        totals = np.bincount(snapshot.brand_codes[ranked], weights=reviews[ranked], minlength=len(snapshot.brand_names)).astype(np.int64)[codes]
+        order = np.lexsort((first, -totals))[:max_products]
+        results[subcategory] = [
+            {'product_title': snapshot.product_titles[ranked[first[idx]]], 'brand': snapshot.brands[ranked[first[idx]]], 'model': snapshot.short_titles[ranked[first[idx]]], 'num_reviews': int(totals[idx])}
+            for idx in order
+        ]
+    return results
+
+
+def group_aspect_stats(scores, weights, groups, rows, num_groups, percentiles):
+    """Per group and aspect: the number of scored products, the mean score, the mean weighted by review count and
+    the percentiles of the scores. `groups` / `rows` pair every group with its products, a product may be in several
+    groups. Every group is computed in the same pass
+    """
+    num_aspects = scores.shape[1]
+    values = scores[rows].astype(np.float64)
+    scored = ~np.isnan(values)
+    filled = np.where(scored, values, 0.0)
+    weighted = weights[rows].astype(np.float64)[:, None] * scored
+
+    counts = np.zeros((num_groups, num_aspects))
+    sums = np.zeros((num_groups, num_aspects))
+    weighted_sums = np.zeros((num_groups, num_aspects))
+    total_weights = np.zeros((num_groups, num_aspects))
+    np.add.at(counts, groups, scored)
+    np.add.at(sums, groups, filled)
+    np.add.at(weighted_sums, groups, filled * weighted)
+    np.add.at(total_weights, groups, weighted)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / counts
+        weighted_means = weighted_sums / total_weights
+
+    # Percentiles over the groups padded with NaN to the size of the largest one
+    sizes = np.bincount(groups, minlength=num_groups)
+    quantiles = np.full((len(percentiles), num_groups, num_aspects), np.nan)
+    if len(rows) and num_aspects and percentiles:
+        order = np.argsort(groups, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        padded = np.full((num_groups, sizes.max(), num_aspects), np.nan)
+        padded[groups[order], np.arange(len(order)) - starts[groups[order]]] = values[order]
+        with warnings.catch_warnings():
+            # Aspects without any score in a group
+            warnings.simplefilter('ignore', RuntimeWarning)
+            quantiles = np.nanpercentile(padded, percentiles, axis=1)
+    return sizes, counts, means, weighted_means, quantiles
+
+
+def scores_list(values):
+    return [round(float(value), 2) if not np.isnan(value) else None for value in values]
+
+
+def aspect_comparison(snapshot, params):
+    """Aspect scores compared across brands (all of them, or `brand`), or across the leaves of `subcategory`
+    with `group_by=subcategory`: mean, mean weighted by review count and percentiles per group and aspect
+    """
+    group_by = get_str(params, 'group_by') or 'brand'
+    if group_by not in ('brand', 'subcategory'):
+        raise WidgetError("group_by must be brand or subcategory")
+    try:
+        percentiles = [float(value) for value in get_list(params, 'percentile')] or list(PERCENTILES)
+        assert all(0 <= value <= 100 for value in percentiles)
+    except (AssertionError, TypeError, ValueError):
+        raise WidgetError("percentile must be a number between 0 and 100")
+
+    names, scores = snapshot.aspect_matrix()
+    requested = get_str_list(params, 'aspect')
+    if requested:
+        columns = [names.index(name) for name in requested if name in names]
+        names, scores = [names[column] for column in columns], scores[:, columns]
+
+    leaves = snapshot.leaves(get_str(params, 'subcategory'))
+    mask = snapshot.members(leaves)
+    if group_by == 'brand':
+        brands = get_str_list(params, 'brand')
+        if brands:
+            # Matched case insensitively, labelled as requested
+            labels = brands
+            members = [np.flatnonzero(mask & snapshot.brand_mask(brand)) for brand in brands]
+        else:
+            rows = np.flatnonzero(mask & snapshot.listed)
+            codes, inverse = np.unique(snapshot.brand_codes[rows], return_inverse=True)
+            labels = [snapshot.brand_names[code] for code in codes]
+            members = [rows[inverse.reshape(-1) == idx] for idx in range(len(codes))]
+    else:
+        resolver = snapshot.resolver
+        labels = list(leaves) if leaves is not None else (resolver.leaves if resolver is not None else [])
+        members = [np.flatnonzero(snapshot.members([leaf])) for leaf in labels]
+
+    groups = np.repeat(np.arange(len(labels)), [len(rows) for rows in members]).astype(np.int64)
+    rows = np.concatenate(members).astype(np.int64) if members else np.zeros(0, dtype=np.int64)
+    sizes, counts, means, weighted_means, quantiles = group_aspect_stats(scores, snapshot.num_reviews, groups, rows, len(labels), percentiles)
+
+    results = {}
+    for idx, label in enumerate(labels):
+        results[label] = {
+            'num_products': int(sizes[idx]),
+            'num_scored': [int(count) for count in counts[idx]],
+            'mean': scores_list(means[idx]),
+            'weighted_mean': scores_list(weighted_means[idx]),
+            **{f"p{percentile:g}": scores_list(quantiles[position, idx]) for position, percentile in enumerate(percentiles)},
+        }
+    return {'aspects': names, 'groups': results}
+
+
+# Widget type -> function(snapshot, params), named after the endpoints they stand for
+WIDGETS = {
+    'brandlist': brand_list,
+    'modellist': model_list,
+    'brand-model': brand_model_list,
+    'brandmarketshare': brand_market_share,
+    'modelmarketshare': model_market_share,
+    'subcategorymarketshare': subcategory_market_share,
+    'individualmarketshare': individual_market_share,
+    'review-count': review_count,
+    'rating': rating,
+    'aspect-rating': aspect_rating,
+    'aspect-comparison': aspect_comparison,
+    'fetchsubcategories': fetch_subcategories,
+}
+
+
+def compute_widget(category, widget_type, params):
+    """Computes one widget of `category`. Raises WidgetError on invalid params
+    """
+    return WIDGETS[widget_type](get_snapshot(category), params)
+
+
+def compute_widgets(category, widgets):
+    """Computes every widget spec ({'id', 'type', 'params'}) of a batch over one snapshot of `category`.
+    Returns {id: {'status', 'data' or 'error'}}
+    """
+    snapshot = get_snapshot(category)
+    results = {}
+    for idx, widget in enumerate(widgets):
+        widget_id = str(widget.get('id', idx))
+        widget_type = widget.get('type')
+        func = WIDGETS.get(widget_type) if isinstance(widget_type, str) else None
+        if func is None:
+            results[widget_id] = {'status': 400, 'error': f"Unknown widget type {widget_type}"}
+            continue
+        params = widget.get('params')
+        if params is None:
+            params = {}
+        elif not isinstance(params, dict):
+            results[widget_id] = {'status': 400, 'error': "params must be an object"}
+            continue
+        try:
+            results[widget_id] = {'status': 200, 'data': func(snapshot, params)}
+        except WidgetError as ex:
+            results[widget_id] = {'status': 400, 'error': str(ex)}
+    return results
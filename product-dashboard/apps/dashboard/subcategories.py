@@ -0,0 +1,79 @@
+import json
+import threading
+
+from .cache import get_data_version
+from .models import SubcategoryMap
+
+
+def parse_subcategories(value, loads=json.loads):
+    """Returns the lowercased subcategory names of a `ProductAggregate.subcategories` blob, decoded with `loads`
+    """
+    if not value:
+        return set()
+    try:
+        names = loads(value)
+    except ValueError:
+        return set()
+    if isinstance(names, str):
+        names = [names]
+    return set(str(name).lower() for name in names)
+
+
+class SubcategoryResolver:
+    """Parsed `SubcategoryMap` of a category: {group: [leaves]} plus the reverse {leaf: group}
+    """
+
+    def __init__(self, subcategory_map):
+        self.groups = {name: list(leaves) for name, leaves in subcategory_map.items()}
+        self.leaf_groups = {}
+        for name, leaves in self.groups.items():
+            for leaf in leaves:
+                self.leaf_groups.setdefault(leaf, name)
+
+    @property
+    def leaves(self):
+        return list(self.leaf_groups)
+
+    def resolve(self, subcategory):
+        """Returns the leaves a `subcategory` param stands for: every leaf of a group, or the leaf itself.
+        None if it is neither
+        """
+        if not isinstance(subcategory, str):
+            return None
+        if subcategory in self.groups:
+            return self.groups[subcategory]
+        if subcategory in self.leaf_groups:
+            return [subcategory]
+        return None
+
+
+_resolvers = {'version': None, 'categories': {}}
+_resolvers_lock = threading.Lock()
+
+
+def load_resolvers():
+    resolvers = {}
+    for category, subcategory_map in SubcategoryMap.objects.values_list('category', 'subcategory_map'):
+        try:
+            resolvers[category] = SubcategoryResolver(json.loads(subcategory_map) if subcategory_map else {})
+        except (TypeError, ValueError, AttributeError) as ex:
+            print(f"Error: {ex}. Invalid subcategory_map for category {category}")
+    return resolvers
+
+
+def get_subcategory_resolver(category):
+    """Returns the `SubcategoryResolver` of `category`, or None if it has no (valid) SubcategoryMap.
+    Every map is parsed once per data version and shared by all requests of the process
+    """
+    version = get_data_version()
+    with _resolvers_lock:
+        if _resolvers['version'] != version:
+            _resolvers['categories'] = load_resolvers()
+            _resolvers['version'] = version
+        return _resolvers['categories'].get(category)
+
+
+def clear_subcategory_resolvers():
+    with _resolvers_lock:
+        _resolvers['version'] = None
+        _resolvers['categories'] = {}
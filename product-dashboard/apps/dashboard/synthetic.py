@@ -0,0 +1,255 @@
+import datetime
+import json
+import os
+import pickle
+import random
+
+import pandas as pd
+from django.db import connections, transaction
+
+from .models import (Dailyproductlisting, ProductAggregate, Productdetails,
+                     Productlisting, Qanda, ReviewAggregate, Reviews,
+                     SubcategoryMap, Sponsoredproductdetails)
+
+# Seeded synthetic data for the `scraped` and default DBs, used by the benchmarks.
+# Only ever run this against SQLite stand-ins: every table it fills is emptied first
+
+PRODUCTS_PER_SCALE = 100 # Products per category at scale 1
+
+END_DATE = datetime.date(2020, 10, 1) # Day of the latest review
+
+NUM_DAYS = 270 # Days of reviews before END_DATE
+
+DAILY_LISTING_DAYS = 14
+
+CATEGORIES = {
+    'headphones': {
+        'brands': ['boat', 'sony', 'jbl', 'sennheiser', 'skullcandy', 'philips', 'realme', 'mi', 'boult', 'ptron', 'infinity', 'zebronics'],
+        'types': ['Wireless', 'Wired', 'True Wireless', 'Neckband'],
+        'features': ['sound', 'bass', 'battery', 'comfort', 'build', 'connectivity', 'noise cancellation', 'mic'],
+    },
+    'speakers': {
+        'brands': ['jbl', 'boat', 'sony', 'bose', 'marshall', 'philips', 'mi', 'zebronics', 'f&d', 'portronics'],
+        'types': ['Portable', 'Party', 'Soundbar', 'Smart'],
+        'features': ['sound', 'bass', 'battery', 'build', 'connectivity', 'volume', 'design', 'value'],
+    },
+}
+
+PRICE_BANDS = [('Under 1000', 0, 1000), ('1000 - 3000', 1000, 3000), ('Above 3000', 3000, None)]
+
+SCRAPED_MODELS = [Productlisting, Dailyproductlisting, Productdetails, Sponsoredproductdetails, Qanda, Reviews]
+
+AGGREGATE_MODELS = [ProductAggregate, ReviewAggregate, SubcategoryMap]
+
+
+def ensure_sqlite(*aliases):
+    for alias in aliases:
+        if connections[alias].vendor != 'sqlite':
+            raise ValueError(f"Refusing to generate synthetic data into the {connections[alias].vendor} DB '{alias}', only SQLite stand-ins are supported")
+
+
+def ensure_scraped_tables(using='scraped'):
+    # The scraped models are unmanaged, so their tables are not created by migrate
+    connection = connections[using]
+    existing = set(connection.introspection.table_names())
+    with connection.schema_editor() as schema_editor:
+        for model in SCRAPED_MODELS:
+            if model._meta.db_table not in existing:
+                schema_editor.create_model(model)
+
+
+def price_band(price):
+    for name, low, high in PRICE_BANDS:
+        if price >= low and (high is None or price < high):
+            return name
+    return PRICE_BANDS[-1][0]
+
+
+def months_ago(day):
+    # 1 for the last 30 days, 2 for the 30 before, ...
+    return (END_DATE - day).days // 30 + 1
+
+
+def generate_category(rng, category, spec, num_products, first_set_id, first_review_id, first_daily_id, first_qanda_id):
+    """Returns the rows of every table for one category, plus the (review id, product id, sentiment) triples
+    """
+    rows = {model: [] for model in SCRAPED_MODELS + AGGREGATE_MODELS}
+    sentiments = []
+    review_id, daily_id, qanda_id = first_review_id, first_daily_id, first_qanda_id
+
+    subcategory_map = {'Type': spec['types'], 'Price': [name for name, _, _ in PRICE_BANDS]}
+    rows[SubcategoryMap].append(SubcategoryMap(category=category, subcategory_map=json.dumps(subcategory_map)))
+
+    prefix = category[:2].upper()
+    idx = 0
+    duplicate_set = 0
+    while idx < num_products:
+        # A model is listed 1 to 3 times (duplicate listings share a duplicate_set)
+        brand = rng.choice(spec['brands'])
+        model_no = f"{brand[:3].upper()}-{rng.randint(100, 999)}"
+        short_title = f"{brand} {model_no}"
+        product_type = rng.choice(spec['types'])
+        price = int(rng.lognormvariate(7.3, 0.8))
+        popularity = rng.paretovariate(1.2)
+        quality = rng.uniform(2.8, 4.7)
+        set_id = first_set_id + duplicate_set
+
+        for copy in range(min(rng.choice([1, 1, 1, 2, 2, 3]), num_products - idx)):
+            product_id = f"{prefix}{idx:08d}"
+            idx += 1
+            title = f"{brand.title()} {model_no} {product_type} {category.rstrip('s')} ({['Black', 'Blue', 'Red', 'White'][copy % 4]})"
+            subcategories = json.dumps([product_type, price_band(price)])
+
+            # Reviews, skewed towards the recent days and the popular models
+            num_reviews = min(int(popularity * rng.uniform(2, 12)), 400)
+            day_counts = {}
+            for _ in range(num_reviews):
+                day = END_DATE - datetime.timedelta(days=min(int(rng.expovariate(1 / 60)), NUM_DAYS - 1))
+                rating = max(1, min(5, int(round(rng.gauss(quality, 1.1)))))
+                rows[Reviews].append(Reviews(
+                    id=review_id, product_id=product_id, rating=float(rating),
+                    review_date=datetime.datetime.combine(day, datetime.time(12)), country='India',
+                    title=f"{['Bad', 'Poor', 'Okay', 'Good', 'Great'][rating - 1]} {category.rstrip('s')}",
+                    body=' '.join(rng.choice(spec['features']) for _ in range(rng.randint(5, 40))),
+                    product_info=json.dumps({'Colour': 'Black'}), verified_purchase=rng.randint(0, 1),
+                    helpful_votes=rng.randint(0, 20), page_num=review_id % 10 + 1, is_duplicate=False, duplicate_set=set_id,
+                ))
+                count, total = day_counts.get(day, (0, 0.0))
+                day_counts[day] = (count + 1, total + rating)
+
+                scores = {feature: rng.choice([-1.0, -0.5, 0.5, 1.0]) for feature in rng.sample(spec['features'], rng.randint(0, 3))}
+                sentiments.append((review_id, product_id, scores))
+                review_id += 1
+
+            review_info = {day.strftime("%d/%m/%Y"): {'num_reviews': count, 'rating': round(total / count, 2)} for day, (count, total) in day_counts.items()}
+            period_reviews = {str(period): sum(count for day, (count, _) in day_counts.items() if months_ago(day) <= period) for period in (1, 3, 6, 8, 9)}
+            total_reviews = {}
+            for day, (count, _) in day_counts.items():
+                total_reviews[str(months_ago(day))] = total_reviews.get(str(months_ago(day)), 0) + count
+            featurewise_reviews = {feature: round(min(5.0, max(1.0, rng.gauss(quality, 0.5))), 1) for feature in spec['features']}
+            feature_sentiments = {feature: {'pos': rng.randint(0, num_reviews), 'neg': rng.randint(0, num_reviews // 2)} for feature in spec['features']}
+            avg_rating = round(sum(total for _, total in day_counts.values()) / num_reviews, 1) if num_reviews else None
+
+            rows[Productlisting].append(Productlisting(
+                product_id=product_id, category=category, title=title, product_url=f"https://www.amazon.in/dp/{product_id}",
+                avg_rating=avg_rating, total_ratings=num_reviews * 3, price=price, old_price=int(price * 1.3),
+                secondary_information='', image=f"https://images.example.com/{product_id}.jpg", is_duplicate=copy > 0,
+                short_title=short_title, duplicate_set=set_id, brand=brand,
+            ))
+            details = dict(
+                product_id=product_id, product_title=title, byline_info=json.dumps({'info': f"Brand: {brand}"}),
+                num_reviews=num_reviews, answered_questions=f"{rng.randint(0, 50)} answered questions", curr_price=float(price),
+                features=json.dumps(rng.sample(spec['features'], 3)), offers='', description=title, product_details=json.dumps({'Brand': brand}),
+                featurewise_reviews=json.dumps(featurewise_reviews), customer_qa='', customer_lazy=0, histogram=json.dumps({}),
+                reviews_url=f"https://www.amazon.in/product-reviews/{product_id}", created_on=datetime.datetime.combine(END_DATE, datetime.time()),
+                subcategories=subcategories, is_sponsored=False,
+            )
+            rows[Productdetails].append(Productdetails(**details, completed=1, brand=brand, model=model_no, date_completed=datetime.datetime.combine(END_DATE, datetime.time()), is_duplicate=copy > 0))
+            if rng.random() < 0.05:
+                rows[Sponsoredproductdetails].append(Sponsoredproductdetails(**dict(details, is_sponsored=True)))
+
+            for offset in range(DAILY_LISTING_DAYS):
+                rows[Dailyproductlisting].append(Dailyproductlisting(
+                    id=daily_id, product_id=product_id, category=category, avg_rating=avg_rating, total_ratings=num_reviews * 3,
+                    price=int(price * rng.uniform(0.9, 1.1)), old_price=int(price * 1.3),
+                    date=datetime.datetime.combine(END_DATE - datetime.timedelta(days=offset), datetime.time()), serial_no=offset,
+                ))
+                daily_id += 1
+
+            for page_num in range(rng.randint(0, 5)):
+                rows[Qanda].append(Qanda(
+                    id=qanda_id, product_id=product_id, question=f"Does it support {rng.choice(spec['features'])}?", answer=rng.choice(['Yes', 'No']),
+                    date=datetime.datetime.combine(END_DATE, datetime.time()), page_num=page_num + 1, duplicate_set=set_id,
+                ))
+                qanda_id += 1
+
+            aggregate = dict(
+                product_id=product_id, brand=brand, model=model_no, subcategories=subcategories, category=category,
+                product_title=title, num_reviews=num_reviews, curr_price=float(price), is_duplicate=copy > 0,
+                short_title=short_title, duplicate_set=set_id, total_reviews=json.dumps(total_reviews),
+            )
+            rows[ProductAggregate].append(ProductAggregate(
+                **aggregate, review_info=json.dumps(period_reviews), featurewise_reviews=json.dumps(featurewise_reviews),
+                listing_reviews=num_reviews, sentiments=json.dumps(feature_sentiments),
+            ))
+            rows[ReviewAggregate].append(ReviewAggregate(**aggregate, review_info=json.dumps(review_info)))
+
+        duplicate_set += 1
+
+    return rows, sentiments
+
+
+def write_sentiment_files(sentiments, output_dir):
+    """Writes the fake `sentiment_analysis.csv` / `indexed_sentiments.pkl` pair, plus its converted index
+    """
+    from apps.taskscheduler.management import construct_indexed_df
+    from apps.taskscheduler.sentiments import SentimentIndex
+
+    df = pd.DataFrame({'id': [review_id for review_id, _, _ in sentiments], 'product_id': [product_id for _, product_id, _ in sentiments]})
+    indexed_sentiments = [scores for _, _, scores in sentiments]
+    df.to_csv(os.path.join(output_dir, 'sentiment_analysis.csv'), index=False)
+    with open(os.path.join(output_dir, 'indexed_sentiments.pkl'), 'wb') as f:
+        pickle.dump(indexed_sentiments, f)
+
+    if any(indexed_sentiments):
+        index = SentimentIndex.from_dataframe(construct_indexed_df(df, indexed_sentiments))
+        index.save(os.path.join(output_dir, 'sentiment_index'))
+
+
+def write_parameter_files(output_dir):
+    # `{category}_parameters.csv`, as read by GetFeaturesAPI
+    for category, spec in CATEGORIES.items():
+        columns = [category] + [f"{category}.{idx}" for idx in range(1, len(spec['features']))]
+        pd.DataFrame([spec['features'], spec['features']], columns=columns).to_csv(os.path.join(output_dir, f"{category}_parameters.csv"), index=False)
+
+
+def generate(scale=1, seed=0, output_dir=None, using='default', scraped='scraped'):
+    """Empties and refills the scraped / aggregate tables with `scale` * PRODUCTS_PER_SCALE products per category.
+    The same (scale, seed) always gives the same data. Returns a summary with sample values for requests
+    """
+    ensure_sqlite(using, scraped)
+    ensure_scraped_tables(scraped)
+
+    rng = random.Random(seed)
+    num_products = max(1, int(scale * PRODUCTS_PER_SCALE))
+    all_rows = {model: [] for model in SCRAPED_MODELS + AGGREGATE_MODELS}
+    all_sentiments = []
+    next_ids = [0, 1, 1, 1]
+    for category, spec in CATEGORIES.items():
+        rows, sentiments = generate_category(rng, category, spec, num_products, *next_ids)
+        for model, instances in rows.items():
+            all_rows[model].extend(instances)
+        all_sentiments.extend(sentiments)
+        next_ids = [len(all_rows[ProductAggregate]), len(all_rows[Reviews]) + 1, len(all_rows[Dailyproductlisting]) + 1, len(all_rows[Qanda]) + 1]
+
+    for models, alias in ((SCRAPED_MODELS, scraped), (AGGREGATE_MODELS, using)):
+        with transaction.atomic(using=alias):
+            for model in reversed(models):
+                model.objects.using(alias).all().delete()
+            for model in models:
+                model.objects.using(alias).bulk_create(all_rows[model])
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        write_sentiment_files(all_sentiments, output_dir)
+        write_parameter_files(output_dir)
+
+    # Derived tables and data version, as after a real scrape
+    from .cache import bump_data_version
+    from .pipeline import refresh_derived_data
+    bump_data_version('scraped')
+    refresh_derived_data(force=True)
+
+    top = max(all_rows[ProductAggregate], key=lambda instance: instance.num_reviews)
+    feature = next((feature for _, product_id, scores in all_sentiments if product_id == top.product_id for feature in scores), CATEGORIES[top.category]['features'][0])
+    return {
+        'scale': scale,
+        'seed': seed,
+        'counts': {model.__name__: len(instances) for model, instances in all_rows.items()},
+        'category': top.category,
+        'brand': top.brand,
+        'product_id': top.product_id,
+        'model': top.short_title,
+        'subcategory': CATEGORIES[top.category]['types'][0],
+        'feature': feature,
+    }
@@ -1,3 +1,689 @@
-from django.test import TestCase
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+from django.core import mail
+from django.db import connection, connections
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from apps.accounts.models import User
+
+from .aggregates import build_aggregates
+from .cache import FileCache, LocMemLRUCache, bump_data_version, get_response_cache
+from .canonical import rebuild_canonical_products
+from .charts import pie_slices, render_pie_chart
+from .metrics import get_registry
+from .models import (CanonicalProduct, ProductAggregate, Productdetails,
+                     Productlisting, Qanda, ReviewAggregate, Reviews,
+                     SubcategoryMap)
+from . import routers
+from .paginator import (COUNT_ESTIMATED, COUNT_EXACT, COUNT_HAS_NEXT,
+                        FasterDjangoPaginator, count_rows, estimated_count)
+from .renderers import FastJSONRenderer
+from .search import index_documents
+from .serializers import ReviewSerializer
+from .snapshot import clear_category_snapshots, get_snapshot
+from .subcategories import SubcategoryResolver, get_subcategory_resolver
+from .synthetic import ensure_scraped_tables
+from .timeseries import rebuild_review_series
+
+# Maximum number of queries per endpoint, independent of how many brands / models are requested
+# Resolving a subcategory costs one read of the data version, the parsed SubcategoryMap is shared
+QUERY_BUDGETS = {
+    'rating': 2,
+    'rating-subcategory': 3,
+    'review-count': 1,
+    'review-count-subcategory': 2,
+}
+
+
+def create_products(category, brands, models_per_brand):
+    idx = 0
+    for brand in brands:
+        for model in range(models_per_brand):
+            # Two listings per model, sharing a duplicate_set
+            for copy in range(2):
+                product_id = f'{brand[:3].upper()}{model:04d}{copy}'
+                review_info = {'29/09/2020': {'num_reviews': 2, 'rating': 4.0}, '20/09/2020': {'num_reviews': 1, 'rating': 3.0}}
+                ProductAggregate.objects.create(
+                    product_id=product_id, category=category, brand=brand, model=f'{brand}-{model}', short_title=f'{brand} {model}',
+                    product_title=f'{brand} model {model}', subcategories=json.dumps(['Wireless' if model % 2 else 'Wired']),
+                    review_info=json.dumps({'1': model, '3': model, '6': model, '8': model, '9': model}), num_reviews=10 * model + copy,
+                    total_reviews=json.dumps({'1': 1, '2': 2}), duplicate_set=idx, is_duplicate=bool(copy),
+                )
+                ReviewAggregate.objects.create(
+                    product_id=product_id, category=category, brand=brand, model=f'{brand}-{model}', short_title=f'{brand} {model}',
+                    review_info=json.dumps(review_info), num_reviews=10 * model + copy, duplicate_set=idx,
+                )
+            idx += 1
+
+
+@override_settings(DASHBOARD_CACHE={})
+class QueryBudgetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        SubcategoryMap.objects.create(category='headphones', subcategory_map=json.dumps({'Type': ['Wireless', 'Wired']}))
+        create_products('headphones', ['boat', 'sony', 'jbl'], 25)
+        rebuild_canonical_products()
+        rebuild_review_series()
+
+    def setUp(self):
+        # The SubcategoryMap is parsed, and the snapshot loaded, on first use after a data version change, not per request
+        get_subcategory_resolver('headphones')
+        get_snapshot('headphones')
+
+    def assertWithinBudget(self, budget, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(context.captured_queries), QUERY_BUDGETS[budget], '\n'.join(query['sql'] for query in context.captured_queries))
+        return response.json()
+
+    def test_rating(self):
+        results = self.assertWithinBudget('rating', '/api/dashboard/rating/headphones?brand=boat&brand=SONY&brand=jbl&end_date=2020-09-30&weeks=1')
+        self.assertEqual(len(results['boat']), 25)
+        self.assertEqual(len(results['SONY']), 25)
+        self.assertEqual(results['jbl'][0]['ratings'][0], {'start_date': '30/09/2020', 'end_date': '24/09/2020', 'rating': 4.0, 'num_reviews': 2})
+        self.assertEqual(results['jbl'][0]['ratings'][1]['num_reviews'], 1)
+
+    def test_rating_subcategory(self):
+        results = self.assertWithinBudget('rating-subcategory', '/api/dashboard/rating/headphones?brand=boat&brand=jbl&subcategory=Type')
+        self.assertEqual(len(results['boat']), 25)
+        results = self.assertWithinBudget('rating-subcategory', '/api/dashboard/rating/headphones?brand=boat&subcategory=Wired')
+        self.assertEqual(len(results['boat']), 13)
+
+    def test_review_count(self):
+        results = self.assertWithinBudget('review-count', '/api/dashboard/review-count/headphones')
+        self.assertEqual(results['total_reviews'], 3 * 25 * 3)
+        results = self.assertWithinBudget('review-count', '/api/dashboard/review-count/headphones?period=2')
+        self.assertEqual(results['total_reviews'], 3 * 25 * 2)
+
+    def test_review_count_subcategory(self):
+        results = self.assertWithinBudget('review-count-subcategory', '/api/dashboard/review-count/headphones?subcategory=Wireless')
+        self.assertEqual(results['total_reviews'], 3 * 12 * 3)
+
+    def test_unknown_subcategory(self):
+        response = self.client.get('/api/dashboard/brandlist/headphones?subcategory=wireless')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/dashboard/brandlist/speakers?subcategory=Wireless')
+        self.assertEqual(response.status_code, 400)
+
+
+class SubcategoryResolverTest(TestCase):
+
+    def test_resolve(self):
+        resolver = SubcategoryResolver({'Type': ['Wireless', 'Wired'], 'Price': ['Under 1000']})
+        self.assertEqual(resolver.resolve('Type'), ['Wireless', 'Wired'])
+        self.assertEqual(resolver.resolve('Under 1000'), ['Under 1000'])
+        self.assertEqual(resolver.leaf_groups['Wired'], 'Type')
+        self.assertEqual(resolver.leaves, ['Wireless', 'Wired', 'Under 1000'])
+        self.assertIsNone(resolver.resolve('Bluetooth'))
+        self.assertIsNone(resolver.resolve(['Type']))
+
+    def test_reloaded_on_change(self):
+        instance = SubcategoryMap.objects.create(category='speakers', subcategory_map=json.dumps({'Type': ['Portable']}))
+        self.assertEqual(get_subcategory_resolver('speakers').resolve('Type'), ['Portable'])
+        with CaptureQueriesContext(connection) as context:
+            get_subcategory_resolver('speakers')
+        self.assertEqual(len(context.captured_queries), 0)
+
+        instance.subcategory_map = json.dumps({'Type': ['Portable', 'Party']})
+        instance.save()
+        self.assertEqual(get_subcategory_resolver('speakers').resolve('Type'), ['Portable', 'Party'])
+
+
+class CanonicalProductTest(TestCase):
+
+    def create(self, product_id, duplicate_set, short_title, num_reviews, brand='boat'):
+        ProductAggregate.objects.create(product_id=product_id, category='headphones', brand=brand, model=short_title, short_title=short_title,
+                                        duplicate_set=duplicate_set, num_reviews=num_reviews, total_reviews=json.dumps({'1': num_reviews}))
+
+    def test_clusters(self):
+        # A and B share a duplicate_set, C shares its short_title with B, D is alone
+        self.create('A', 1, 'rockerz 450', 5)
+        self.create('B', 1, 'rockerz 255', 9)
+        self.create('C', 2, 'rockerz 255', 7)
+        self.create('D', None, 'airdopes 131', 3)
+        self.create('E', None, None, 1, brand=None)
+        self.assertEqual(rebuild_canonical_products(), (3, 0))
+
+        rows = {row.product_id: row for row in CanonicalProduct.objects.all()}
+        self.assertEqual(sorted(rows), ['B', 'D', 'E'])
+        self.assertEqual(json.loads(rows['B'].member_ids), ['A', 'B', 'C'])
+        self.assertEqual(rows['B'].total_reviews, json.dumps({'1': 9}))
+
+        # Only the changed cluster is rewritten
+        ProductAggregate.objects.filter(product_id='A').update(num_reviews=12)
+        self.assertEqual(rebuild_canonical_products(), (1, 1))
+        self.assertEqual(sorted(CanonicalProduct.objects.values_list('product_id', flat=True)), ['A', 'D', 'E'])
+        self.assertEqual(rebuild_canonical_products(), (0, 0))
+
+
+class AggregateBuilderTest(TestCase):
+    databases = {'default', 'scraped'}
+
+    @classmethod
+    def setUpClass(cls):
+        # The scraped tables are unmanaged, they need to exist before the test transaction starts
+        ensure_scraped_tables('scraped')
+        super().setUpClass()
+
+    def create(self, product_id, completed, review_days):
+        Productlisting.objects.using('scraped').create(product_id=product_id, category='headphones', short_title=f'boat {product_id}', duplicate_set=1, brand='boat', total_ratings=30)
+        Productdetails.objects.using('scraped').create(product_id=product_id, product_title=f'boAt {product_id}', model=product_id, num_reviews=len(review_days),
+                                                      subcategories=json.dumps(['Wireless']), date_completed=completed)
+        for day, rating in review_days:
+            self.review(product_id, day, rating)
+
+    def review(self, product_id, day, rating):
+        Reviews.objects.using('scraped').create(product_id=product_id, rating=rating, review_date=datetime.datetime.combine(day, datetime.time(12)))
+
+    def test_incremental(self):
+        completed = datetime.datetime(2020, 9, 30)
+        self.create('A', completed, [(datetime.date(2020, 8, 1), 5.0), (datetime.date(2020, 9, 29), 4.0), (datetime.date(2020, 9, 29), 3.0)])
+        self.create('B', completed, [(datetime.date(2020, 9, 10), 2.0)])
+        self.assertEqual(build_aggregates(), (2, {'headphones'}))
+
+        product = ProductAggregate.objects.get(product_id='A')
+        self.assertEqual((product.brand, product.model, product.duplicate_set, product.listing_reviews), ('boat', 'A', 1, 30))
+        self.assertEqual(json.loads(product.review_info), {'1': 2, '3': 3, '6': 3, '8': 3, '9': 3})
+        self.assertEqual(json.loads(product.total_reviews), {'1': 2, '2': 1})
+        daily = json.loads(ReviewAggregate.objects.get(product_id='A').review_info)
+        self.assertEqual(daily['29/09/2020'], {'num_reviews': 2, 'rating': 3.5})
+
+        # Nothing was scraped since
+        self.assertEqual(build_aggregates(), (0, set()))
+
+        # A new review of B only rebuilds B, the periods of A move with the latest review date
+        self.review('B', datetime.date(2020, 10, 1), 1.0)
+        self.assertEqual(build_aggregates(), (1, {'headphones'}))
+        self.assertEqual(json.loads(ProductAggregate.objects.get(product_id='B').review_info)['1'], 2)
+        self.assertEqual(json.loads(ProductAggregate.objects.get(product_id='A').total_reviews), {'1': 2, '3': 1})
+        # Reviews dated before the latest one are found too
+        self.review('B', datetime.date(2020, 9, 2), 1.0)
+        Productdetails.objects.using('scraped').filter(product_id='A').update(date_completed=datetime.datetime(2020, 10, 1))
+        self.assertEqual(build_aggregates()[0], 2)
+
+        Productdetails.objects.using('scraped').filter(product_id='B').delete()
+        self.assertEqual(build_aggregates(full=True), (1, {'headphones'}))
+        self.assertEqual(list(ReviewAggregate.objects.values_list('product_id', flat=True)), ['A'])
+
+
+class ScrapedRouterTest(SimpleTestCase):
+    # Not in a transaction: reads inside one go to the home alias
+    databases = {'default', 'scraped'}
+
+    def tearDown(self):
+        routers._health.clear()
+        routers._local.__dict__.clear()
+
+    def test_routes(self):
+        router = routers.ScrapedRouter()
+        self.assertEqual((router.db_for_read(Reviews), router.db_for_write(Reviews)), ('scraped', 'scraped'))
+        self.assertIsNone(router.db_for_read(ProductAggregate))
+        self.assertFalse(router.allow_migrate('scraped', 'dashboard', model_name='productaggregate'))
+        self.assertFalse(router.allow_migrate('default', 'dashboard', model_name='reviews'))
+        self.assertIsNone(router.allow_migrate('default', 'dashboard', model_name='productaggregate'))
+        self.assertEqual(Productlisting.objects.all().db, 'scraped')
+
+    def test_replicas(self):
+        router = routers.ScrapedRouter()
+        routing = {**routers.routing_settings(), 'REPLICAS': {'scraped': ['default', 'missing']}}
+        with self.settings(DATABASE_ROUTING=routing):
+            # Replicas are used once a background health check found them up
+            self.assertEqual(router.db_for_read(Reviews), 'scraped')
+            for thread in threading.enumerate():
+                if thread.name.startswith('health-check-'):
+                    thread.join()
+            self.assertEqual(router.db_for_read(Reviews), 'default')
+            self.assertEqual(router.db_for_write(Reviews), 'scraped')
+            self.assertFalse(router.allow_migrate('default', 'dashboard', model_name='productaggregate'))
+            # Failover to the home alias while the replica is down
+            routers._health['default'] = (False, time.monotonic())
+            self.assertEqual(router.db_for_read(Reviews), 'scraped')
+
+    def test_requests_spread_over_replicas(self):
+        router = routers.ScrapedRouter()
+        routing = {**routers.routing_settings(), 'REPLICAS': {'scraped': ['default', 'scraped']}}
+        with self.settings(DATABASE_ROUTING=routing):
+            for alias in ('default', 'scraped'):
+                routers._health[alias] = (True, time.monotonic())
+            replicas = []
+            for _ in range(4):
+                routers.next_replica()
+                replicas.append(router.db_for_read(Reviews))
+                # The same replica for the whole request
+                self.assertEqual(router.db_for_read(Qanda), replicas[-1])
+            self.assertEqual(sorted(replicas), ['default', 'default', 'scraped', 'scraped'])
+
+
+class SearchTest(TestCase):
+    databases = {'default', 'scraped'}
+
+    @classmethod
+    def setUpClass(cls):
+        ensure_scraped_tables('scraped')
+        super().setUpClass()
+
+    def setUp(self):
+        self.path = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False).name
+        self.override = override_settings(SEARCH_INDEX={'PATH': self.path, 'MAX_LIMIT': 100})
+        self.override.enable()
+        for product_id, category in (('A', 'headphones'), ('B', 'speakers')):
+            Productlisting.objects.create(product_id=product_id, category=category)
+        reviews = [('A', 5.0, 'Great bass', 'The bass is deep and the battery lasts'), ('A', 2.0, 'Weak bass', 'Bass is weak'),
+                   ('A', 4.0, 'Comfortable', 'Fits well'), ('B', 5.0, 'Loud', 'Loud with punchy bass')]
+        for product_id, rating, title, body in reviews:
+            Reviews.objects.create(product_id=product_id, rating=rating, title=title, body=body, review_date=datetime.datetime(2020, 9, 1))
+        Qanda.objects.create(product_id='A', question='How is the bass?', answer='Very good')
+
+    def tearDown(self):
+        self.override.disable()
+        os.remove(self.path)
+
+    def test_search(self):
+        self.assertEqual(index_documents(), 5)
+        self.assertEqual(index_documents(), 0)
+
+        response = self.client.get('/api/dashboard/search?q=bass&category=headphones')
+        results = response.json()['results']
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0]['title'], 'Weak <b>bass</b>')
+        self.assertIn('<b>bass</b>', results[1]['snippet'])
+
+        results = self.client.get('/api/dashboard/search?q=bass battery&min_rating=4').json()['results']
+        self.assertEqual([(result['kind'], result['id']) for result in results], [('review', 1)])
+        results = self.client.get('/api/dashboard/search?q=bass&kind=qanda').json()['results']
+        self.assertEqual([(result['product_id'], result['title']) for result in results], [('A', 'How is the <b>bass</b>?')])
+
+        # Pages of 2 until the cursor runs out, new reviews are picked up incrementally
+        Reviews.objects.create(product_id='B', rating=3.0, title='Bass', body='bass bass')
+        self.assertEqual(index_documents(), 1)
+        seen, cursor = [], ''
+        while cursor is not None:
+            page = self.client.get(f'/api/dashboard/search?q=bass&limit=2&cursor={cursor}' if cursor else '/api/dashboard/search?q=bass&limit=2').json()
+            seen.extend((result['kind'], result['id']) for result in page['results'])
+            cursor = page['next']
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+
+        # The text is HTML escaped, only the matches are markup
+        Reviews.objects.create(product_id='A', rating=1.0, title='<script>alert(1)</script> bass', body='<img src=x onerror=alert(1)> & bass')
+        self.assertEqual(index_documents(), 1)
+        result = self.client.get('/api/dashboard/search?q=alert bass').json()['results'][0]
+        self.assertEqual(result['title'], '&lt;script&gt;<b>alert</b>(1)&lt;/script&gt; <b>bass</b>')
+        self.assertEqual(result['snippet'], '&lt;img src=x onerror=<b>alert</b>(1)&gt; &amp; <b>bass</b>')
+
+        self.assertEqual(self.client.get('/api/dashboard/search?q=%22').status_code, 400)
+        self.assertEqual(self.client.get('/api/dashboard/search?q=bass&cursor=abc').status_code, 400)
+
+
+@override_settings(DASHBOARD_CACHE={'BACKEND': 'locmem', 'OPTIONS': {'max_bytes': 1024 * 1024}})
+class ResponseCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        SubcategoryMap.objects.create(category='headphones', subcategory_map=json.dumps({'Type': ['Wireless', 'Wired']}))
+        create_products('headphones', ['boat', 'sony'], 3)
+        rebuild_canonical_products()
+        rebuild_review_series()
+
+    def setUp(self):
+        get_response_cache().clear()
+
+    def test_hit_and_invalidation(self):
+        url = '/api/dashboard/review-count/headphones?subcategory=Wireless&period=2'
+        first = self.client.get(url)
+        self.assertEqual(first['X-Cache'], 'MISS')
+
+        # Only the data version is read on a hit, whatever the order of the query params
+        with CaptureQueriesContext(connection) as context:
+            second = self.client.get('/api/dashboard/review-count/headphones?period=2&subcategory=Wireless')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(second.json(), first.json())
+
+        bump_data_version('aggregate')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        stats = get_response_cache().stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 2))
+
+    def test_stats_endpoint(self):
+        self.client.get('/api/dashboard/review-count/headphones')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get('/api/dashboard/cache-stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['enabled'], response.json()['misses']), (True, 1))
+
+    def test_errors_are_not_cached(self):
+        url = '/api/dashboard/rating/headphones'
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+    def test_lru_eviction(self):
+        cache = LocMemLRUCache(max_bytes=10)
+        cache.set('1', 'a', b'aaaa')
+        cache.set('1', 'b', b'bbbb')
+        cache.get('1', 'a')
+        cache.set('1', 'c', b'cccc')
+        self.assertIsNone(cache.get('1', 'b'))
+        self.assertEqual(cache.get('1', 'a'), b'aaaa')
+        self.assertEqual(cache.stats()['size'], 8)
+
+    def test_file_cache(self):
+        with tempfile.TemporaryDirectory() as location:
+            cache = FileCache(location)
+            cache.set('1', 'abcd', b'old')
+            self.assertEqual(cache.get('1', 'abcd'), b'old')
+            cache.set('2', 'abcd', b'new')
+            self.assertIsNone(cache.get('1', 'abcd'))
+            self.assertEqual(cache.get('2', 'abcd'), b'new')
+
+
+class ChartTest(TestCase):
+
+    def test_pie_chart(self):
+        labels, sizes = pie_slices({'boat': 5, 'sony': 9, 'jbl': 1, 'philips': 3}, top_n=2)
+        self.assertEqual(labels, ['sony', 'boat', 'others'])
+        self.assertEqual(sizes, [9, 5, 4])
+        self.assertTrue(render_pie_chart(labels, sizes).startswith(b'\x89PNG'))
+
+
+@override_settings(DASHBOARD_CACHE={'BACKEND': 'locmem'})
+class RowCountTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_products('headphones', ['boat', 'sony'], 6)
+
+    def setUp(self):
+        get_response_cache().clear()
+
+    def test_exact_count_is_cached(self):
+        queryset = ProductAggregate.objects.filter(brand='boat')
+        self.assertEqual(count_rows(queryset, COUNT_EXACT), 12)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(count_rows(ProductAggregate.objects.filter(brand='boat'), COUNT_EXACT), 12)
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertEqual(count_rows(ProductAggregate.objects.filter(brand='sony', is_duplicate=False), COUNT_EXACT), 6)
+
+        # A new data version counts again
+        bump_data_version('aggregate')
+        ProductAggregate.objects.filter(brand='boat', is_duplicate=True).delete()
+        self.assertEqual(count_rows(queryset, COUNT_EXACT), 6)
+
+    def test_estimated_count(self):
+        # No statistics yet: falls back to an exact count
+        self.assertIsNone(estimated_count(ProductAggregate.objects.all()))
+        self.assertEqual(count_rows(ProductAggregate.objects.all(), COUNT_ESTIMATED), 24)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(estimated_count(ProductAggregate.objects.all()), 24)
+
+    def test_has_next(self):
+        paginator = FasterDjangoPaginator(ProductAggregate.objects.order_by('pk'), 10, count_mode=COUNT_HAS_NEXT)
+        with CaptureQueriesContext(connection) as context:
+            first, last = paginator.page(1), paginator.page(3)
+        self.assertEqual(len(context.captured_queries), 2)
+        self.assertTrue(first.has_next())
+        self.assertEqual(first.next_page_number(), 2)
+        self.assertFalse(last.has_next())
+        self.assertEqual(len(last), 4)
+        self.assertIsNone(count_rows(ProductAggregate.objects.all(), COUNT_HAS_NEXT))
+
+
+@override_settings(DASHBOARD_CACHE={})
+class ListSerializationTest(TestCase):
+    databases = {'default', 'scraped'}
+
+    @classmethod
+    def setUpClass(cls):
+        ensure_scraped_tables('scraped')
+        super().setUpClass()
+
+    def setUp(self):
+        Productlisting.objects.create(product_id='A', category='headphones')
+        for idx in range(5):
+            Reviews.objects.create(product_id='A', rating=4.0 + idx % 2, title=f'Review {idx}', body='Good\u2028bass', product_info='x' * 100, review_date=datetime.datetime(2020, 9, 1, 10, 30))
+
+    def test_same_as_model_serializer(self):
+        queryset = Reviews.objects.order_by('id')
+        expected = json.loads(JSONRenderer().render(ReviewSerializer(queryset[:10], many=True).data))
+        response = self.client.get('/api/dashboard/reviews/A?type=positive')
+        self.assertEqual(response.json(), expected)
+        self.assertIn(b'Good\\u2028bass', response.content)
+        self.assertEqual(json.loads(FastJSONRenderer().render(expected)), json.loads(JSONRenderer().render(expected)))
+
+    def test_fields(self):
+        with CaptureQueriesContext(connections['scraped']) as context:
+            page = self.client.get('/api/dashboard/reviews/A?type=positive&page_size=2&fields=title,rating').json()
+        self.assertEqual(page['results'], [{'rating': 4.0, 'title': 'Review 0'}, {'rating': 5.0, 'title': 'Review 1'}])
+        self.assertNotIn('product_info', context.captured_queries[-1]['sql'])
+        # The cursor still pages on the (unsent) id
+        page = self.client.get(page['next']).json()
+        self.assertEqual([row['title'] for row in page['results']], ['Review 2', 'Review 3'])
+
+        response = self.client.get('/api/dashboard/reviews/A?type=positive&fields=title,secret')
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportTest(TestCase):
+    databases = {'default', 'scraped'}
+
+    @classmethod
+    def setUpClass(cls):
+        ensure_scraped_tables('scraped')
+        super().setUpClass()
+
+    def setUp(self):
+        for idx in range(50):
+            Productlisting.objects.create(product_id=f'P{idx:03d}', category='headphones', title=f'Product {idx}')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def test_stream(self):
+        response = self.client.get('/api/dashboard/export/productlisting?category=headphones')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 51)
+        self.assertIn('Product 49', lines[-1])
+
+    def test_email(self):
+        response = self.client.get('/api/dashboard/email/headphones')
+        self.assertEqual(response.status_code, 200)
+        part = mail.outbox[0].attachments[0]
+        self.assertEqual(part.get_filename(), 'ProductListing.csv.gz')
+        self.assertEqual(len(gzip.decompress(part.get_payload(decode=True)).decode('utf-8').splitlines()), 51)
+
+        with override_settings(EXPORTS={'MAX_ATTACHMENT_SIZE': 100}):
+            response = self.client.get('/api/dashboard/email/headphones')
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('/api/dashboard/export/productlisting?category=headphones', response.json())
+        self.assertEqual(len(mail.outbox), 1)
+
+
+@override_settings(DASHBOARD_CACHE={}, DASHBOARD_METRICS={'ENABLED': True, 'PATH_PREFIXES': ['/api/dashboard/'], 'SLOW_REQUEST_SECONDS': 0})
+class MetricsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_products('headphones', ['boat', 'sony'], 3)
+        rebuild_canonical_products()
+
+    def setUp(self):
+        get_registry().clear()
+        # Every test starts with a cold snapshot, whatever ran before
+        clear_category_snapshots()
+
+    def test_request_metrics(self):
+        response = self.client.get('/api/dashboard/aspect-rating/headphones?brand=boat')
+        self.assertEqual(response.status_code, 200)
+        text = get_registry().export()
+        route = 'api/dashboard/aspect-rating/<str:category>'
+        self.assertIn(f'dashboard_request_seconds_count{{route="{route}",view="apps.dashboard.api.AspectBasedRatingAPI",method="GET",status="200"}} 1', text)
+        self.assertIn(f'dashboard_db_queries_bucket{{route="{route}",alias="default",le="+Inf"}} 1', text)
+        self.assertIn(f'dashboard_db_queries_sum{{route="{route}",alias="scraped"}} 0', text)
+        self.assertIn(f'dashboard_response_bytes_sum{{route="{route}"}} {len(response.content)}', text)
+        # Loading the snapshot decoded the JSON blobs of the category
+        decode_sum = f'dashboard_json_decode_seconds_sum{{route="{route}"}} '
+        self.assertGreater(float(text.split(decode_sum)[1].split()[0]), 0)
+
+        slow = get_registry().slow()
+        self.assertEqual(len(slow), 1)
+        self.assertEqual(slow[0]['status'], 200)
+        # The data version, then the snapshot of the category
+        self.assertTrue(any('canonicalproduct' in query['sql'].lower() for query in slow[0]['queries']))
+
+    def test_endpoints_need_an_admin(self):
+        self.assertEqual(self.client.get('/api/dashboard/metrics').status_code, 401)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.client.get('/api/dashboard/aspect-rating/headphones?brand=boat')
+        response = self.client.get('/api/dashboard/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'dashboard_request_seconds_count', response.content)
+        response = self.client.get('/api/dashboard/metrics/slow')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any(request['path'] == '/api/dashboard/aspect-rating/headphones?brand=boat' for request in response.json()))
+
+    def test_other_paths_are_ignored(self):
+        self.client.get('/api/missing')
+        self.assertEqual(get_registry().export().count('_count{'), 0)
+
+
+@override_settings(DASHBOARD_CACHE={})
+class BatchWidgetsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        SubcategoryMap.objects.create(category='headphones', subcategory_map=json.dumps({'Type': ['Wireless', 'Wired'], 'Price': ['Under 1000']}))
+        create_products('headphones', ['boat', 'sony', 'jbl'], 6)
+        rebuild_canonical_products()
+        rebuild_review_series()
+
+    def setUp(self):
+        get_subcategory_resolver('headphones')
+
+    def test_same_as_endpoints(self):
+        widgets = [
+            ('brandmarketshare', {'period': 3, 'max_products': 2, 'subcategory': 'Type'}, '/api/dashboard/brandmarketshare/headphones/3/2?subcategory=Type'),
+            ('modelmarketshare', {'period': 6, 'max_products': 5, 'brand': 'sony'}, '/api/dashboard/modelmarketshare/headphones/6/5?brand=sony'),
+            ('review-count', {'subcategory': 'Wireless', 'period': 2}, '/api/dashboard/review-count/headphones?subcategory=Wireless&period=2'),
+            ('rating', {'brand': ['boat', 'JBL'], 'subcategory': 'Wired', 'end_date': '2020-09-30', 'weeks': 2}, '/api/dashboard/rating/headphones?brand=boat&brand=JBL&subcategory=Wired&end_date=2020-09-30&weeks=2'),
+            ('aspect-rating', {'brand': 'sony'}, '/api/dashboard/aspect-rating/headphones?brand=sony'),
+            ('fetchsubcategories', {}, '/api/dashboard/fetchsubcategories/headphones'),
+        ]
+        body = {'widgets': [{'id': str(idx), 'type': widget_type, 'params': params} for idx, (widget_type, params, _) in enumerate(widgets)]}
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/dashboard/batch/headphones', json.dumps(body), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        # Aggregates, data version and review series, whatever the number of widgets
+        self.assertLessEqual(len(context.captured_queries), 3)
+
+        results = response.json()
+        for idx, (widget_type, _, url) in enumerate(widgets):
+            self.assertEqual(results[str(idx)], {'status': 200, 'data': self.client.get(url).json()}, widget_type)
+        self.assertEqual(len(results['0']['data']), 2)
+
+        params = {'subcategories': 'all', 'period': 3, 'max_products': 2}
+        body = {'widgets': [{'id': 'share', 'type': 'fetchsubcategories', 'params': params}]}
+        results = self.client.post('/api/dashboard/batch/headphones', json.dumps(body), content_type='application/json').json()
+        expected = self.client.post('/api/dashboard/fetchsubcategories/headphones', json.dumps(params), content_type='application/json').json()
+        self.assertEqual(results['share'], {'status': 200, 'data': expected})
+
+    def test_snapshot_endpoints(self):
+        get_snapshot('headphones')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/dashboard/brand-model/headphones?subcategory=Wired')
+        # Only the data version is read once the snapshot is loaded
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(response.json()['sony'], ['sony 4', 'sony 2', 'sony 0'])
+
+        self.assertEqual(sorted(self.client.get('/api/dashboard/brandlist/headphones').json()), ['boat', 'jbl', 'sony'])
+        self.assertEqual(self.client.get('/api/dashboard/modellist/headphones/SONY?subcategory=Wireless').json(), ['sony 5', 'sony 3', 'sony 1'])
+        results = self.client.get('/api/dashboard/subcategorymarketshare/headphones/all/3/2').json()
+        self.assertEqual([(item['model'], item['num_reviews']) for item in results['all']], [('boat 5', 5), ('jbl 5', 5)])
+        response = self.client.post('/api/dashboard/individualmarketshare/headphones', json.dumps({'model': 'jbl-2'}), content_type='application/json')
+        self.assertEqual(response.json(), [{'subcategory': None, 'product_title': 'jbl model 2', 'model': 'jbl 2', 'brand': 'jbl', 'num_reviews': 2}])
+
+    def test_date_range_share(self):
+        # Every product has 1 review on 20/09/2020 and 2 on 29/09/2020
+        results = self.client.get('/api/dashboard/brandmarketshare/headphones/1/10?start=2020-09-25&end=2020-09-30').json()
+        self.assertEqual(results, [{'brand': 'boat', 'num_reviews': 12}, {'brand': 'jbl', 'num_reviews': 12}, {'brand': 'sony', 'num_reviews': 12}])
+        results = self.client.get('/api/dashboard/modelmarketshare/headphones/1/2?brand=sony&start=20/09/2020&end=2020-09-20').json()
+        self.assertEqual([(item['model'], item['num_reviews']) for item in results], [('sony 0', 1), ('sony 1', 1)])
+        results = self.client.get('/api/dashboard/subcategorymarketshare/headphones/Wired/1/1?start=2020-09-21').json()
+        self.assertEqual(results['Wired'][0]['num_reviews'], 2)
+        response = self.client.get('/api/dashboard/brandmarketshare/headphones/1/10?start=2020-10-01&end=2020-09-01')
+        self.assertEqual(response.status_code, 400)
+
+    def test_aspect_comparison(self):
+        # Sony model m scores m on sound, the even models 4 on battery
+        for product in ProductAggregate.objects.filter(category='headphones', brand='sony'):
+            model = int(product.model.split('-')[1])
+            product.featurewise_reviews = json.dumps({'sound': model, **({'battery': 4} if model % 2 == 0 else {})})
+            product.save()
+        rebuild_canonical_products()
+
+        results = self.client.get('/api/dashboard/aspect-comparison/headphones?brand=Sony&brand=boat&percentile=50').json()
+        self.assertEqual(results['aspects'], ['battery', 'sound'])
+        sony, boat = results['groups']['Sony'], results['groups']['boat']
+        self.assertEqual(sony['num_scored'], [3, 6])
+        self.assertEqual(sony['mean'], [4.0, 2.5])
+        # Weighted by the num_reviews of the canonical listing (10 * model + 1)
+        self.assertEqual(sony['weighted_mean'], [4.0, round(565 / 156, 2)])
+        self.assertEqual(sony['p50'], [4.0, 2.5])
+        self.assertEqual(boat['num_scored'], [0, 0])
+        self.assertEqual(boat['mean'], [None, None])
+
+        results = self.client.get('/api/dashboard/aspect-comparison/headphones?group_by=subcategory&aspect=sound').json()
+        self.assertEqual(results['aspects'], ['sound'])
+        self.assertEqual(results['groups']['Wired']['mean'], [2.0])
+        self.assertEqual(results['groups']['Wireless']['p25'], [2.0])
+        response = self.client.get('/api/dashboard/aspect-comparison/headphones?percentile=101')
+        self.assertEqual(response.status_code, 400)
+
+    def test_lazy_data_is_built_once(self):
+        snapshot = get_snapshot('headphones')
+        snapshot._aspect_matrix = None
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(snapshot.aspect_matrix())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    @override_settings(DASHBOARD_WIDGETS={'MAX_WINDOWS': 10, 'MAX_WINDOW_DAYS': 30})
+    def test_rating_windows_are_capped(self):
+        self.assertEqual(self.client.get('/api/dashboard/rating/headphones?brand=sony&windows=10&window=30').status_code, 200)
+        for query in ('windows=11', 'weeks=10', 'windows=10000000', 'window=31'):
+            response = self.client.get(f'/api/dashboard/rating/headphones?brand=sony&{query}')
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_invalid_widgets(self):
+        body = {'widgets': [{'type': 'rating', 'params': {}}, {'type': 'brandmarketshare', 'params': {'subcategory': 'Bluetooth'}}, {'type': 'unknown'}]}
+        results = self.client.post('/api/dashboard/batch/headphones', json.dumps(body), content_type='application/json').json()
+        self.assertEqual([results[key]['status'] for key in ('0', '1', '2')], [400, 400, 400])
+        response = self.client.post('/api/dashboard/batch/headphones', json.dumps({'widgets': 'rating'}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_malformed_widgets(self):
+        widgets = [
+            {'type': ['rating']}, {'type': 'brandlist', 'params': ['Wireless']}, {'type': 'modellist', 'params': {'brand': 5}},
+            {'type': 'rating', 'params': {'brand': [{'name': 'sony'}]}}, {'type': 'brandlist', 'params': {'subcategory': ['Wireless']}},
+            {'type': 'individualmarketshare', 'params': {'model': None}}, {'type': 'aspect-comparison', 'params': {'aspect': [1]}},
+            {'type': 'brandlist', 'params': None},
+        ]
+        response = self.client.post('/api/dashboard/batch/headphones', json.dumps({'widgets': widgets}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([response.json()[str(idx)]['status'] for idx in range(len(widgets))], [400] * 7 + [200])
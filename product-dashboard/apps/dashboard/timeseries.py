@@ -0,0 +1,197 @@
+import datetime
+import hashlib
+import json
+
+import numpy as np
+from django.db import transaction
+
+from .models import ReviewAggregate, ReviewSeries
+
+DATE_FORMAT = "%d/%m/%Y"
+
+COUNT_DTYPE = np.dtype('<i4')
+SUM_DTYPE = np.dtype('<f8')
+
+
+def merge_review_info(review_infos):
+    """Merges the daily `review_info` of every product in a duplicate_set.
+    A day with a valid rating wins over a day without one
+    """
+    review_info = {}
+    for temp in review_infos:
+        for val in temp:
+            if "rating" not in temp[val] or temp[val]['rating'] in (None, "NaN", 0,):
+                if val not in review_info:
+                    review_info[val] = temp[val]
+            else:
+                review_info[val] = temp[val]
+    return review_info
+
+
+def series_from_review_info(review_info):
+    """Converts a `{"dd/mm/YYYY": {"num_reviews", "rating"}}` dict into (first_day, num_reviews, rating_sum) arrays
+    """
+    days = {}
+    for _date, value in review_info.items():
+        try:
+            day = datetime.datetime.strptime(_date, DATE_FORMAT).date()
+        except (TypeError, ValueError):
+            continue
+        days[day] = value
+
+    if not days:
+        return None, np.zeros(0, dtype=COUNT_DTYPE), np.zeros(0, dtype=SUM_DTYPE)
+
+    first_day = min(days)
+    length = (max(days) - first_day).days + 1
+    num_reviews = np.zeros(length, dtype=COUNT_DTYPE)
+    rating_sum = np.zeros(length, dtype=SUM_DTYPE)
+
+    for day, value in days.items():
+        idx = (day - first_day).days
+        count = value.get("num_reviews") or 0
+        num_reviews[idx] = count
+        try:
+            if value.get("rating") not in (None, "NaN"):
+                rating_sum[idx] = float(value["rating"]) * float(count)
+        except (TypeError, ValueError):
+            pass
+
+    return first_day, num_reviews, rating_sum
+
+
+def rebuild_review_series(categories=None, force=False):
+    """Rebuilds the daily series of every duplicate_set whose `ReviewAggregate` rows have changed.
+    Returns the number of rewritten series
+    """
+    queryset = ReviewAggregate.objects.filter(duplicate_set__isnull=False)
+    if categories is not None:
+        queryset = queryset.filter(category__in=categories)
+
+    groups = {}
+    for duplicate_set, category, review_info in queryset.values_list('duplicate_set', 'category', 'review_info').order_by('duplicate_set', 'num_reviews', 'product_id').iterator():
+        group = groups.setdefault(duplicate_set, {'category': category, 'review_info': []})
+        group['review_info'].append(review_info or '')
+
+    existing = ReviewSeries.objects.all()
+    if categories is not None:
+        existing = existing.filter(category__in=categories)
+    fingerprints = dict(existing.values_list('duplicate_set', 'fingerprint'))
+
+    changed = []
+    for duplicate_set, group in groups.items():
+        digest = hashlib.sha1('\n'.join(group['review_info']).encode('utf-8')).hexdigest()
+        if not force and fingerprints.get(duplicate_set) == digest:
+            continue
+        review_info = merge_review_info([json.loads(value) for value in group['review_info'] if value])
+        first_day, num_reviews, rating_sum = series_from_review_info(review_info)
+        changed.append(ReviewSeries(
+            duplicate_set=duplicate_set,
+            category=group['category'],
+            first_day=first_day or datetime.date.today(),
+            num_reviews=num_reviews.tobytes(),
+            rating_sum=rating_sum.tobytes(),
+            fingerprint=digest,
+        ))
+
+    stale = [duplicate_set for duplicate_set in fingerprints if duplicate_set not in groups]
+
+    with transaction.atomic():
+        for idx in range(0, len(stale), 500):
+            ReviewSeries.objects.filter(duplicate_set__in=stale[idx:idx + 500]).delete()
+        for idx in range(0, len(changed), 500):
+            batch = changed[idx:idx + 500]
+            ReviewSeries.objects.filter(duplicate_set__in=[series.duplicate_set for series in batch]).delete()
+            ReviewSeries.objects.bulk_create(batch)
+
+    return len(changed)
+
+
+def window_boundaries(end_date, window, num_windows):
+    """Returns the (first_day, last_day) of `num_windows` consecutive windows ending on `end_date`, newest first.
+    `window` is a number of days, or 'month' for calendar months
+    """
+    boundaries = []
+    last_day = end_date
+    for _ in range(num_windows):
+        if window == 'month':
+            first_day = last_day.replace(day=1)
+        else:
+            first_day = last_day - datetime.timedelta(days=window - 1)
+        boundaries.append((first_day, last_day))
+        last_day = first_day - datetime.timedelta(days=1)
+    return boundaries
+
+
+def parse_window(value):
+    if value in ('week', None):
+        return 7
+    if value == 'month':
+        return 'month'
+    window = int(value)
+    if window <= 0:
+        raise ValueError("window must be a positive number of days")
+    return window
+
+
+class ReviewSeriesStore:
+    """Daily (num_reviews, rating_sum) series of a set of duplicate_sets, aligned on a common day axis
+    """
+
+    def __init__(self, series):
+        self.series = {instance.duplicate_set: instance for instance in series}
+
+    @classmethod
+    def load(cls, duplicate_sets):
+        return cls(ReviewSeries.objects.filter(duplicate_set__in=[duplicate_set for duplicate_set in duplicate_sets if duplicate_set is not None]))
+
+    def last_day(self):
+        last_days = [instance.first_day + datetime.timedelta(days=len(instance.num_reviews) // COUNT_DTYPE.itemsize - 1) for instance in self.series.values() if len(instance.num_reviews) > 0]
+        return max(last_days) if last_days else None
+
+    def matrix(self, duplicate_sets, first_day, last_day):
+        # Rows are duplicate_sets, columns are days in [first_day, last_day]
+        length = (last_day - first_day).days + 1
+        num_reviews = np.zeros((len(duplicate_sets), length), dtype=np.int64)
+        rating_sum = np.zeros((len(duplicate_sets), length), dtype=np.float64)
+        for row, duplicate_set in enumerate(duplicate_sets):
+            instance = self.series.get(duplicate_set)
+            if instance is None:
+                continue
+            counts = np.frombuffer(bytes(instance.num_reviews), dtype=COUNT_DTYPE)
+            sums = np.frombuffer(bytes(instance.rating_sum), dtype=SUM_DTYPE)
+            offset = (instance.first_day - first_day).days
+            start, end = max(offset, 0), min(offset + len(counts), length)
+            if start >= end:
+                continue
+            num_reviews[row, start:end] = counts[start - offset:end - offset]
+            rating_sum[row, start:end] = sums[start - offset:end - offset]
+        return num_reviews, rating_sum
+
+    def windows(self, duplicate_sets, end_date, window=7, num_windows=9):
+        """Returns the windows and, per duplicate_set, the (num_reviews, rating) of every window.
+        Window sums are differences of a cumulative sum, so any set of windows costs one pass
+        """
+        boundaries = window_boundaries(end_date, window, num_windows)
+        first_day = boundaries[-1][0]
+        num_reviews, rating_sum = self.matrix(duplicate_sets, first_day, end_date)
+
+        # Prefix sums with a leading zero column: sum(a..b) = C[b + 1] - C[a]
+        review_prefix = np.concatenate([np.zeros((len(duplicate_sets), 1), dtype=np.int64), np.cumsum(num_reviews, axis=1)], axis=1)
+        rating_prefix = np.concatenate([np.zeros((len(duplicate_sets), 1)), np.cumsum(rating_sum, axis=1)], axis=1)
+
+        starts = np.array([(start - first_day).days for start, _ in boundaries])
+        ends = np.array([(end - first_day).days + 1 for _, end in boundaries])
+
+        window_reviews = review_prefix[:, ends] - review_prefix[:, starts]
+        window_ratings = rating_prefix[:, ends] - rating_prefix[:, starts]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            averages = window_ratings / window_reviews
+
+        results = {}
+        for row, duplicate_set in enumerate(duplicate_sets):
+            results[duplicate_set] = [
+                (int(window_reviews[row, idx]), float(averages[row, idx]) if window_reviews[row, idx] > 0 else "NaN")
+                for idx in range(len(boundaries))
+            ]
+        return boundaries, results
@@ -46,7 +46,7 @@ class DashboardProductListing(APIView):
     def get(self, request, page_no=None):
         """Lists the Product Listing in the Dashboard
         """
-        queryset = Productlisting.objects.using('scraped').all()
+        queryset = Productlisting.objects.all()
         if page_no is None:
             page_no = 1
         if page_no <= 0:
@@ -68,12 +68,12 @@ class DashboardDailyProductListing(APIView):
         query_params = request.query_params
         
         if query_params in ({}, None):
-            queryset = Dailyproductlisting.objects.using('scraped').all()
+            queryset = Dailyproductlisting.objects.all()
         else:
             if 'category' in query_params:
-                queryset = Dailyproductlisting.objects.using('scraped').filter(category=query_params['category'])
+                queryset = Dailyproductlisting.objects.filter(category=query_params['category'])
             elif 'product_id' in query_params:
-                queryset = Dailyproductlisting.objects.using('scraped').filter(product_id=query_params['product_id'])
+                queryset = Dailyproductlisting.objects.filter(product_id=query_params['product_id'])
         
         if page_no is None:
             page_no = 1
@@ -111,9 +111,9 @@ class DashboardReviews(APIView):
             # Positive Reviews
             threshold = 3.0
             if product_id == 'all':
-                queryset = Reviews.objects.using('scraped').filter(rating__isnull=False, rating__gte=threshold)
+                queryset = Reviews.objects.filter(rating__isnull=False, rating__gte=threshold)
             else:
-                queryset = Reviews.objects.using('scraped').filter(product_id=product_id, rating__isnull=False, rating__gte=threshold)
+                queryset = Reviews.objects.filter(product_id=product_id, rating__isnull=False, rating__gte=threshold)
             
             ITEMS_PER_PAGE = 10
             queryset = queryset[(page_no - 1) * ITEMS_PER_PAGE : (page_no) * ITEMS_PER_PAGE]
@@ -124,9 +124,9 @@ class DashboardReviews(APIView):
             # Negative Reviews
             threshold = 3.0
             if product_id == 'all':
-                queryset = Reviews.objects.using('scraped').filter(rating__isnull=False, rating__lt=threshold)
+                queryset = Reviews.objects.filter(rating__isnull=False, rating__lt=threshold)
             else:
-                queryset = Reviews.objects.using('scraped').filter(product_id=product_id, rating__isnull=False, rating__lt=threshold)
+                queryset = Reviews.objects.filter(product_id=product_id, rating__isnull=False, rating__lt=threshold)
 
             ITEMS_PER_PAGE = 10
             queryset = queryset[(page_no - 1) * ITEMS_PER_PAGE : (page_no) * ITEMS_PER_PAGE]
@@ -150,7 +150,7 @@ class DashboardQandA(APIView):
         if page_no <= 0:
             return Response("Page Number must be >= 1", status=status.HTTP_400_BAD_REQUEST)
 
-        queryset = Qanda.objects.using('scraped').filter(product_id=product_id)
+        queryset = Qanda.objects.filter(product_id=product_id)
         if queryset.count() == 0:
             return Response(f"No QandA exists for this product - {product_id}", status=status.HTTP_404_NOT_FOUND)
         
@@ -184,9 +184,9 @@ class CategoryMarketShareAPI(APIView):
         
 
         # Filter on only non NULL completed fields
-        #queryset = Productdetails.objects.using('scraped').filter(category=category, completed__isnull=False).order_by("-num_reviews")
-        #queryset = Productdetails.objects.using('scraped').filter(completed__isnull=False, model__isnull=False, brand__isnull=False).values('brand', 'model').annotate(num_reviews=F('num_reviews')).order_by('-num_reviews')
-        queryset = Productdetails.objects.using('scraped').filter(completed__isnull=False, model__isnull=False, brand__isnull=False).values('product_title', 'brand', 'model', 'product_id', 'num_reviews').order_by('-num_reviews').distinct()[:2*max_products]
+        #queryset = Productdetails.objects.filter(category=category, completed__isnull=False).order_by("-num_reviews")
+        #queryset = Productdetails.objects.filter(completed__isnull=False, model__isnull=False, brand__isnull=False).values('brand', 'model').annotate(num_reviews=F('num_reviews')).order_by('-num_reviews')
+        queryset = Productdetails.objects.filter(completed__isnull=False, model__isnull=False, brand__isnull=False).values('product_title', 'brand', 'model', 'product_id', 'num_reviews').order_by('-num_reviews').distinct()[:2*max_products]
 
         models = dict()
         results = []
@@ -203,10 +203,10 @@ class CategoryMarketShareAPI(APIView):
                 models[result['model']]['product_title'] = result['product_title']
             # Get Num reviews
             try:
-                num_reviews_none = Reviews.objects.using('scraped').filter(product_id=item['product_id'], review_date__range=[first_date, last_date], page_num__isnull=False).count()
-                num_reviews_not_none = Reviews.objects.using('scraped').filter(product_id=item['product_id'], review_date__range=[first_date, last_date], page_num__isnull=True).count()
+                num_reviews_none = Reviews.objects.filter(product_id=item['product_id'], review_date__range=[first_date, last_date], page_num__isnull=False).count()
+                num_reviews_not_none = Reviews.objects.filter(product_id=item['product_id'], review_date__range=[first_date, last_date], page_num__isnull=True).count()
                 num_reviews = max(num_reviews_none, num_reviews_not_none)
-                #num_reviews = Reviews.objects.using('scraped').filter(product_id=item['product_id'], review_date__range=[first_date, last_date]).count()
+                #num_reviews = Reviews.objects.filter(product_id=item['product_id'], review_date__range=[first_date, last_date]).count()
             except Exception as ex:
                 print(ex)
                 num_reviews = 0
@@ -244,13 +244,13 @@ class SubCategoryMarketShareAPI(APIView):
 
         # Filter on only non NULL completed fields
         # NOTE: Here, subcategory is assumed to be a ManyToMany field
-        #queryset = Productdetails.objects.using('scraped').filter(subcategory__in=[subcategory], completed__isnull=False)
-        #queryset = Productdetails.objects.using('scraped').filter(model__isnull=False, brand__isnull=False).values('brand').annotate(num_reviews=F('num_reviews')).order_by('-num_reviews')
+        #queryset = Productdetails.objects.filter(subcategory__in=[subcategory], completed__isnull=False)
+        #queryset = Productdetails.objects.filter(model__isnull=False, brand__isnull=False).values('brand').annotate(num_reviews=F('num_reviews')).order_by('-num_reviews')
 
         if subcategory == 'all':
-            queryset = Productdetails.objects.using('scraped').filter(completed__isnull=False, model__isnull=False, brand__isnull=False).values('product_title', 'brand', 'model', 'product_id', 'num_reviews', 'subcategories').order_by('-num_reviews').distinct()[:max_products]
+            queryset = Productdetails.objects.filter(completed__isnull=False, model__isnull=False, brand__isnull=False).values('product_title', 'brand', 'model', 'product_id', 'num_reviews', 'subcategories').order_by('-num_reviews').distinct()[:max_products]
         else:
-            queryset = Productdetails.objects.using('scraped').filter(completed__isnull=False, model__isnull=False, brand__isnull=False, subcategories__in=[subcategory]).values('product_title', 'brand', 'model', 'product_id', 'num_reviews', 'subcategories').order_by('-num_reviews').distinct()[:max_products]
+            queryset = Productdetails.objects.filter(completed__isnull=False, model__isnull=False, brand__isnull=False, subcategories__in=[subcategory]).values('product_title', 'brand', 'model', 'product_id', 'num_reviews', 'subcategories').order_by('-num_reviews').distinct()[:max_products]
 
         results = {}
         subcategory_results = []
@@ -274,10 +274,10 @@ class SubCategoryMarketShareAPI(APIView):
                 models[result['model']]['subcategories'] = subcategories
             # Get Num reviews
             try:
-                num_reviews_none = Reviews.objects.using('scraped').filter(product_id=item['product_id'], review_date__range=[first_date, last_date], page_num__isnull=False).count()
-                num_reviews_not_none = Reviews.objects.using('scraped').filter(product_id=item['product_id'], review_date__range=[first_date, last_date], page_num__isnull=True).count()
+                num_reviews_none = Reviews.objects.filter(product_id=item['product_id'], review_date__range=[first_date, last_date], page_num__isnull=False).count()
+                num_reviews_not_none = Reviews.objects.filter(product_id=item['product_id'], review_date__range=[first_date, last_date], page_num__isnull=True).count()
                 num_reviews = max(num_reviews_none, num_reviews_not_none)
-                #num_reviews = Reviews.objects.using('scraped').filter(product_id=item['product_id'], review_date__range=[first_date, last_date]).count()
+                #num_reviews = Reviews.objects.filter(product_id=item['product_id'], review_date__range=[first_date, last_date]).count()
             except Exception as ex:
                 print(ex)
                 num_reviews = 0
@@ -472,7 +472,7 @@ class AspectBasedRatingAPI(APIView):
         final_results = {}
 
         for brand in brands:
-            queryset = Productdetails.objects.using('scraped').filter(completed__isnull=False, brand=brand, category=category).values('product_title', 'model', 'featurewise_reviews')
+            queryset = Productdetails.objects.filter(completed__isnull=False, brand=brand, category=category).values('product_title', 'model', 'featurewise_reviews')
             results = []
             models = set()
             for item in queryset:
@@ -737,9 +737,9 @@ class SendEmailAPI(APIView):
         writer.writerow(headers)
 
         if category is not None:
-            queryset = Productlisting.objects.using('scraped').filter(category=category)
+            queryset = Productlisting.objects.filter(category=category)
         else:
-            queryset = Productlisting.objects.using('scraped').all()
+            queryset = Productlisting.objects.all()
         
         # Now write the data
         for obj in queryset:
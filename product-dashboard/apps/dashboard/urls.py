@@ -1,6 +1,7 @@
 from django.urls import path
 
 from . import api, views
+from .cache import cache_response
 
 urlpatterns = [
     path('home', api.DashboardListing.as_view()),
@@ -8,6 +9,9 @@ urlpatterns = [
     path('home/<str:category>/piechart', views.pie_chart),
     path('home/<str:category>/chart', views.categorypage),
     path('home/<str:category>/piechart/<int:top_n>', views.pie_chart),
+    path('home/<str:category>/barchart.png', views.bar_chart_image, name='bar-chart-image'),
+    path('home/<str:category>/piechart.png', views.pie_chart_image, name='pie-chart-image'),
+    path('home/<str:category>/piechart/<int:top_n>.png', views.pie_chart_image, name='pie-chart-image'),
     
     path('productlisting', api.DashboardProductListing.as_view()),
     path('productlisting/<int:page_no>', api.DashboardProductListing.as_view()),
@@ -18,26 +22,36 @@ urlpatterns = [
     path('qanda/<str:product_id>', api.DashboardQandA.as_view()),
     path('qanda/<str:product_id>/<int:page_no>', api.DashboardQandA.as_view()),
     path('email/<str:category>', api.SendEmailAPI.as_view()),
+    path('export/<str:table>', api.ExportCSVAPI.as_view()),
+    path('cache-stats', api.CacheStatsAPI.as_view()),
+    path('metrics', api.MetricsAPI.as_view()),
+    path('metrics/slow', api.SlowRequestsAPI.as_view()),
 
-    path('brandlist/<str:category>', api.BrandListAPI.as_view()),
-    path('modellist/<str:category>/<str:brand>', api.ModelListAPI.as_view()),
+    path('brandlist/<str:category>', cache_response(api.BrandListAPI.as_view())),
+    path('modellist/<str:category>/<str:brand>', cache_response(api.ModelListAPI.as_view())),
 
-    path('brand-model/<str:category>', api.BrandandModelListAPI.as_view()),
+    path('brand-model/<str:category>', cache_response(api.BrandandModelListAPI.as_view())),
 
-    path('fetchsubcategories/<str:category>', api.FetchSubcategories.as_view()),
+    path('fetchsubcategories/<str:category>', cache_response(api.FetchSubcategories.as_view())),
 
-    path('modelmarketshare/<str:category>/<int:period>/<int:max_products>', api.CummulativeModelMarketShare.as_view()),
-    path('subcategorymarketshare/<str:category>/<str:subcategory>/<int:period>/<int:max_products>', api.SubCategoryMarketShare.as_view()),
+    path('modelmarketshare/<str:category>/<int:period>/<int:max_products>', cache_response(api.CummulativeModelMarketShare.as_view())),
+    path('subcategorymarketshare/<str:category>/<str:subcategory>/<int:period>/<int:max_products>', cache_response(api.SubCategoryMarketShare.as_view())),
 
-    path('brandmarketshare/<str:category>/<int:period>/<int:max_products>', api.BrandMarketShare.as_view()),
+    path('brandmarketshare/<str:category>/<int:period>/<int:max_products>', cache_response(api.BrandMarketShare.as_view())),
     
     path('individualmarketshare', api.IndividualModelMarketShare.as_view()),
-    path('rating/<str:category>', api.RatingsoverTimeAPI.as_view()),
-    path('review-count/<str:category>', api.ReviewCount.as_view()),
-    path('aspect-rating/<str:category>', api.AspectBasedRatingAPI.as_view()),
+    path('individualmarketshare/<str:category>', api.IndividualModelMarketShare.as_view()),
+    path('rating/<str:category>', cache_response(api.RatingsoverTimeAPI.as_view())),
+    path('review-count/<str:category>', cache_response(api.ReviewCount.as_view())),
+    path('aspect-rating/<str:category>', cache_response(api.AspectBasedRatingAPI.as_view())),
+    path('aspect-comparison/<str:category>', cache_response(api.AspectComparisonAPI.as_view())),
 
-    path('review-breakdown/<str:category>', api.ReviewBreakDownAPI.as_view()),
+    path('review-breakdown/<str:category>', cache_response(api.ReviewBreakDownAPI.as_view())),
     path('fetch-reviews/<str:category>', api.SentimentReviewsAPI.as_view()),
 
     path('featurelist/<str:category>', api.GetFeaturesAPI.as_view()),
+
+    path('search', api.SearchAPI.as_view()),
+
+    path('batch/<str:category>', api.BatchWidgetsAPI.as_view()),
 ]
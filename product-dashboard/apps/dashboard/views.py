@@ -1,21 +1,48 @@
-import base64
-import io
-import json
-
-import matplotlib
-import numpy as np
-import pandas as pd
-from django.db.models import Count
+import hashlib
+
 from django.http import HttpResponse
 from django.shortcuts import render
-from matplotlib import pyplot as plt
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from . import charts
+from .cache import get_data_version, get_response_cache
+from .loaders import load_brand_review_totals
+
+# Labels / values of the demo bar chart
+BAR_CHART_DATA = (
+    ('#hcsm', '#ukmedlibs', '#ImmunoChat', '#HCLDR', '#ICTD2015', '#hpmglobal', '#BRCA', '#BCSM', '#BTSM', '#OTalk',),
+    tuple(range(1, 11)),
+)
+
+
+def is_admin(request):
+    return hasattr(request.user, 'is_superuser') and request.user.is_superuser
+
+
+def chart_response(request, key, render_chart):
+    """Serves the PNG of a chart, rendered by `render_chart()` at most once per data version.
+    The ETag only depends on the key and the data version, so revalidations never render anything
+    """
+    version = get_data_version()
+    etag = '"%s"' % hashlib.sha1(f"{key}:{version}".encode('utf-8')).hexdigest()[:20]
 
-from .models import (Dailyproductlisting, Productdetails, Productlisting,
-                     Qanda, Reviews)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        cache = get_response_cache()
+        image_png = cache.get(version, key) if cache is not None else None
+        if image_png is None:
+            image_png = render_chart()
+            if isinstance(image_png, HttpResponse):
+                return image_png
+            if cache is not None:
+                cache.set(version, key, image_png)
+        response = HttpResponse(bytes(image_png), content_type='image/png')
 
-matplotlib.use('Agg') # Refer https://stackoverflow.com/questions/27147300/matplotlib-tcl-asyncdelete-async-handler-deleted-by-the-wrong-thread
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
-plt.ioff()
 
 # Create your views here.
 def dashboard(request, category=None):
@@ -24,51 +51,19 @@ def dashboard(request, category=None):
     
     if category is None:
         return HttpResponse("Please Enter the category", status=400)
-    
-    #queryset = Productlisting.objects.using('scraped').filter(category=category).distinct()
-    #queryset = queryset.values_list('product_id', flat=True)
-    
-    #if queryset.count() == 0:
-    #    return HttpResponse(f"No products found for category - {category}", status=204)
-
-    pos = np.arange(10) + 2 
-
-    fig = plt.figure(figsize=(8, 3))
-    ax = fig.add_subplot(111)
-
-    ax.barh(pos, np.arange(1, 11), align='center')
-    ax.set_yticks(pos)
-    ax.set_yticklabels(('#hcsm',
-        '#ukmedlibs',
-        '#ImmunoChat',
-        '#HCLDR',
-        '#ICTD2015',
-        '#hpmglobal',
-        '#BRCA',
-        '#BCSM',
-        '#BTSM',
-        '#OTalk',), 
-        fontsize=15)
-    ax.set_xticks([])
-    ax.invert_yaxis()
-
-    ax.set_xlabel('Popularity')
-    ax.set_ylabel('Hashtags')
-    ax.set_title('Hashtags')
 
-    plt.tight_layout()
+    return render(request, 'bar_chart.html', {'image_url': reverse('bar-chart-image', kwargs={'category': category})})
 
-    with io.BytesIO() as buffer:
-        plt.savefig(buffer, format='png')
-        buffer.seek(0)
-        image_png = buffer.getvalue()
 
-    graphic = base64.b64encode(image_png)
-    graphic = graphic.decode('utf-8')
+def bar_chart_image(request, category=None):
+    if not is_admin(request):
+        return HttpResponse("Unauthorized. Only Admins can access this", status=401)
 
-    plt.close(fig)
+    def render_chart():
+        labels, values = BAR_CHART_DATA
+        return charts.render(charts.render_bar_chart, labels, values, 'Hashtags', 'Popularity', 'Hashtags')
 
-    return render(request, 'bar_chart.html', {'graphic': graphic})
+    return chart_response(request, 'chart:bar', render_chart)
 
 
 def categorypage(request, category):
@@ -76,75 +71,32 @@ def categorypage(request, category):
     
 
 def pie_chart(request, category=None, top_n=None):
-    if not hasattr(request.user, 'is_superuser') or not request.user.is_superuser:
+    if not is_admin(request):
         return HttpResponse("Unauthorized. Only Admins can access this", status=401)
     
     if category is None:
         return HttpResponse("Please Enter the category", status=400)
-    
-    queryset = Productlisting.objects.using('scraped').filter(category=category).distinct()
-    queryset = queryset.values_list('product_id', flat=True)
-
-    if queryset.count() == 0:
-        return HttpResponse(f"No products found for category - {category}", status=204)
-    
-    detail_queryset = Productdetails.objects.using('scraped').filter(product_id__in=queryset)
-    results = [{'num_reviews': instance.num_reviews, 'brand': json.loads(instance.byline_info)['info'].replace('Brand:', '').strip(), 'product_id': instance.product_id} for instance in detail_queryset if instance.num_reviews is not None]
-
-    # Now annotate the review count
-    #review_queryset = Reviews.objects.using('scraped').values("product_id").annotate(Count("product_id"))
-
-    #cache = dict()
-
-    #for review_dict in review_queryset:
-    #    if review_dict['product_id'] is not None:
-    #        cache[review_dict['product_id']] = review_dict['product_id__count']
-    
-    #for result in results:
-    #    if result['product_id'] in cache:
-    #        result['num_reviews'] = cache[result['product_id']]
-    
-    # Add up only unique brands now
-    unique_results = dict()
-    for result in results:
-        if result['brand'] is None:
-            continue
-        if result['brand'] not in unique_results:
-            unique_results[result['brand']] = result['num_reviews']
-        else:
-            unique_results[result['brand']] += result['num_reviews']
-
-    # Pie chart, where the slices will be ordered and plotted counter-clockwise:
-    #labels = [brand for brand in unique_results]
-    #sizes = [num_reviews for _, num_reviews in unique_results.items()]
-    #explode = [0 for _ in unique_results]
-
-    df = pd.DataFrame(data={'brand': list(unique_results.keys()), 'reviews': list(unique_results.values())}).sort_values('reviews', ascending=False)
 
     if top_n is None or top_n <= 0:
-        TOP_N = 4
+        image_url = reverse('pie-chart-image', kwargs={'category': category})
     else:
-        TOP_N = top_n
-
-    new_df = df[:TOP_N].copy() # Get the top N
-    others = pd.DataFrame(data={'brand': ['others'], 'reviews': [df['reviews'][TOP_N:].sum()]})
+        image_url = reverse('pie-chart-image', kwargs={'category': category, 'top_n': top_n})
+    return render(request, 'pie_chart.html', {'image_url': image_url})
 
-    new_df = pd.concat([new_df, others])
 
-    fig, ax = plt.subplots(figsize = (12, 5))
-    new_df.plot(kind = 'pie', y = 'reviews', labels = new_df['brand'], autopct='%1.1f%%', shadow=True, startangle=90, ax=ax)
-    #ax.pie(sizes, explode=explode, labels=labels, autopct='%1.1f%%',
-    #        shadow=True, startangle=90)
-    ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
-
-    with io.BytesIO() as buffer:
-        plt.savefig(buffer, format='png')
-        buffer.seek(0)
-        image_png = buffer.getvalue()
+def pie_chart_image(request, category=None, top_n=None):
+    if not is_admin(request):
+        return HttpResponse("Unauthorized. Only Admins can access this", status=401)
 
-    graphic = base64.b64encode(image_png)
-    graphic = graphic.decode('utf-8')
+    if top_n is None or top_n <= 0:
+        top_n = charts.DEFAULT_TOP_N
 
-    plt.close(fig)
+    def render_chart():
+        # Reviews per brand, summed in SQL
+        totals = load_brand_review_totals(category)
+        if not totals:
+            return HttpResponse(f"No products found for category - {category}", status=204)
+        labels, sizes = charts.pie_slices(totals, top_n)
+        return charts.render(charts.render_pie_chart, labels, sizes)
 
-    return render(request, 'pie_chart.html', {'graphic': graphic})
+    return chart_response(request, f'chart:pie:{category}:{top_n}', render_chart)
@@ -0,0 +1,62 @@
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from apps.accounts.api import AdminAuthenticationPermission
+
+from .models import ScraperJob
+from .scraper_jobs import LOG_TAIL_BYTES, cancel_job, enqueue_job, tail_log
+from .serializers import ScraperJobSerializer
+
+MAX_LISTED_JOBS = 100
+
+
+class ScraperJobListAPI(APIView):
+    authentication_classes = [BasicAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated, AdminAuthenticationPermission]
+
+    def get(self, request):
+        """Latest scraper jobs, optionally only those with `?status=`
+        """
+        queryset = ScraperJob.objects.order_by('-id')
+        if 'status' in request.query_params:
+            queryset = queryset.filter(status=request.query_params['status'])
+        if 'category' in request.query_params:
+            queryset = queryset.filter(category=request.query_params['category'])
+        return Response(ScraperJobSerializer(queryset[:MAX_LISTED_JOBS], many=True).data, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        """Queues a scrape. Body: {"category": optional, "config": optional, key of SCRAPER_JOBS['CONFIGS']}
+        """
+        try:
+            job, created = enqueue_job(category=request.data.get('category') or None, config=request.data.get('config') or 'listing')
+        except ValueError as ex:
+            return Response(str(ex), status=status.HTTP_400_BAD_REQUEST)
+        return Response(ScraperJobSerializer(job).data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+class ScraperJobAPI(APIView):
+    authentication_classes = [BasicAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated, AdminAuthenticationPermission]
+
+    def get(self, request, pk):
+        """Status of a job, with the end of its log
+        """
+        job = get_object_or_404(ScraperJob, pk=pk)
+        try:
+            num_bytes = int(request.query_params.get('log_bytes', LOG_TAIL_BYTES))
+        except ValueError:
+            return Response("log_bytes must be an integer", status=status.HTTP_400_BAD_REQUEST)
+        return Response({**ScraperJobSerializer(job).data, 'log': tail_log(job, num_bytes)}, status=status.HTTP_200_OK)
+
+    def delete(self, request, pk):
+        """Cancels a queued or running job
+        """
+        job = get_object_or_404(ScraperJob, pk=pk)
+        if not cancel_job(job):
+            return Response(f"Job {pk} is already {job.status}", status=status.HTTP_400_BAD_REQUEST)
+        job.refresh_from_db()
+        return Response(ScraperJobSerializer(job).data, status=status.HTTP_200_OK)
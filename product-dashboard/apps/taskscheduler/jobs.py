@@ -1,5 +1,3 @@
-import csv
-import io
 from datetime import datetime
 
 from decouple import UndefinedValueError, config
@@ -10,6 +8,8 @@ from django.utils.encoding import force_bytes, force_text
 from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 
 from apps.accounts.models import User
+from apps.dashboard.exports import (attachment_part, file_size,
+                                    max_attachment_size, spooled_export)
 from apps.dashboard.models import (Dailyproductlisting, Productdetails,
                                    Productlisting, Qanda, Reviews)
 
@@ -28,27 +28,26 @@ def send_email():
     message = render_to_string('send_email.html')
 
     email = EmailMessage(mail_subject, message, from_email=from_email, to=to_email)
+    # The cap is on the attachments of the whole mail
+    too_large, attached_size = [], 0
 
     for _model in [Dailyproductlisting, Productdetails, Productlisting, Qanda, Reviews]:
-        fields = [field.get_attname_column()[1] for field in _model._meta.fields]
         file_name = _model.__name__
         file_name = file_name.replace('"', r'\"')
-        csvfile = io.StringIO()
-        writer = csv.writer(csvfile)
-
-        # Write the headers first
-        headers = fields
-        
-        writer.writerow(headers)
-
-        queryset = _model.objects.using('scraped').all()
-        
-        # Now write the data
-        for obj in queryset:
-            row = [getattr(obj, field) for field in fields]
-            writer.writerow(row)
-        
-        email.attach(f'{file_name}.csv', csvfile.getvalue(), 'text/csv')
+
+        # Stream the table in chunks into a gzipped temporary file
+        queryset = _model.objects.all()
+        with spooled_export(_model, queryset) as csvfile:
+            size = file_size(csvfile)
+            if attached_size + size > max_attachment_size():
+                too_large.append(_model.__name__.lower())
+                continue
+            email.attach(attachment_part(csvfile, f'{file_name}.csv.gz'))
+            attached_size += size
+
+    if too_large:
+        print(f"Too large to be attached: {', '.join(too_large)}")
+        email.body += f"\nToo large to be attached, download them from api/dashboard/export/<table>: {', '.join(too_large)}\n"
     
     if len(to_email) > 0:
         email.send()
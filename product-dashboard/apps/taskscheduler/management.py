@@ -1,7 +1,7 @@
 import datetime
 import os
-import subprocess
-import sys
+import threading
+import time
 
 import pandas as pd
 import pickle
@@ -10,13 +10,18 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from decouple import UndefinedValueError, config
 
 from apps.taskscheduler.jobs import heartbeat, send_email
+from apps.taskscheduler.sentiments import SentimentIndex
 
 ist = pytz.timezone('Asia/Kolkata')
 
 scheduler = BackgroundScheduler()
 
-def run_scraper():
-    subprocess.check_call((sys.executable, os.path.join(os.getcwd(), 'scraper', 'scraper.py'), '--config', str(os.path.join(os.getcwd(), 'scraper', 'listing.conf'))))
+def run_scraper(category=None):
+    # Only queues the scrape: it runs in `manage.py run_scraper_workers`, never in the web process,
+    # which also refreshes the dashboard tables afterwards
+    from apps.taskscheduler.scraper_jobs import enqueue_job
+    job, _ = enqueue_job(category=category)
+    return job
 
 
 def construct_indexed_df(df, indexed_sentiments=None): # From CLEANED_UP file
@@ -29,13 +34,37 @@ def construct_indexed_df(df, indexed_sentiments=None): # From CLEANED_UP file
     return indexed_df
 
 
-REVIEW_DATAFRAME = None # Shared Dataframe
+SENTIMENT_INDEX_DIR = 'sentiment_index' # Written by `manage.py convert_sentiments`
 
+_REVIEW_INDEX = None # Shared sentiment index, see get_review_index()
+_REVIEW_INDEX_FAILED_AT = None # time.monotonic() of the last failed load
+_REVIEW_INDEX_LOCK = threading.Lock()
 
-def start():
-    global REVIEW_DATAFRAME
-    try:
-        df = pd.read_csv('sentiment_analysis.csv', sep=",", encoding="utf-8")
-        REVIEW_DATAFRAME = construct_indexed_df(df)
-    except Exception as ex:
-        print(f"Error: {ex}. Exception during opening/processing sentiment_analysis.csv")
+RETRY_AFTER = 60 # Seconds before a failed load of the sentiment index is tried again
+
+
+def load_review_index():
+    if os.path.exists(os.path.join(SENTIMENT_INDEX_DIR, 'meta.json')):
+        return SentimentIndex.load(SENTIMENT_INDEX_DIR)
+
+    # Slow path: parse the raw files in this process
+    print(f"{SENTIMENT_INDEX_DIR} not found, building the sentiment index from sentiment_analysis.csv. Run `manage.py convert_sentiments` to speed this up")
+    df = pd.read_csv('sentiment_analysis.csv', sep=",", encoding="utf-8")
+    return SentimentIndex.from_dataframe(construct_indexed_df(df))
+
+
+def get_review_index(retry_after=RETRY_AFTER):
+    """Returns the `SentimentIndex`, loading it on first use, or None if it could not be loaded.
+    A failed load (e.g. the index is not converted yet) is tried again after `retry_after` seconds
+    """
+    global _REVIEW_INDEX, _REVIEW_INDEX_FAILED_AT
+    if _REVIEW_INDEX is None:
+        with _REVIEW_INDEX_LOCK:
+            if _REVIEW_INDEX is None and (_REVIEW_INDEX_FAILED_AT is None or time.monotonic() - _REVIEW_INDEX_FAILED_AT >= retry_after):
+                try:
+                    _REVIEW_INDEX = load_review_index()
+                    _REVIEW_INDEX_FAILED_AT = None
+                except Exception as ex:
+                    print(f"Error: {ex}. Exception during loading the sentiment index, retrying in {retry_after} seconds")
+                    _REVIEW_INDEX_FAILED_AT = time.monotonic()
+    return _REVIEW_INDEX
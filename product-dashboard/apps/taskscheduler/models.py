@@ -1,3 +1,40 @@
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
+
+
+class ScraperJob(models.Model):
+    # A scraper run, queued by the API / scheduler and executed by `manage.py run_scraper_workers`
+    # See scraper_jobs.py
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    ]
+
+    category = models.CharField(blank=True, null=True, max_length=100) # None scrapes every category of the config
+    config = models.CharField(max_length=100, default='listing') # Key of SCRAPER_JOBS['CONFIGS']
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now) # Retries are delayed
+    created_on = models.DateTimeField(auto_now_add=True)
+    started_on = models.DateTimeField(blank=True, null=True)
+    finished_on = models.DateTimeField(blank=True, null=True)
+    heartbeat_on = models.DateTimeField(blank=True, null=True)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    exit_code = models.IntegerField(blank=True, null=True)
+    error = models.TextField(blank=True, default='')
+    log_file = models.CharField(max_length=255, blank=True, default='')
+
+    class Meta:
+        index_together = [('status', 'run_after')]
@@ -0,0 +1,269 @@
+import contextlib
+import datetime
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import Error, close_old_connections, connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ScraperJob
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Persistent queue of scraper runs. Jobs are rows of ScraperJob, claimed by the worker processes of
+# `manage.py run_scraper_workers` with a conditional UPDATE, so any number of workers can share the queue.
+# Scrapes never run in the web process: the API and the scheduler only enqueue
+
+ACTIVE_STATUSES = (ScraperJob.QUEUED, ScraperJob.RUNNING)
+
+CLAIM_CANDIDATES = 20 # Queued jobs looked at per claim
+
+LOG_TAIL_BYTES = 16 * 1024
+
+
+def job_settings():
+    return getattr(settings, 'SCRAPER_JOBS', None) or {}
+
+
+def enqueue_job(category=None, config='listing', max_attempts=None):
+    """Queues a scrape of `category` (every category if None) with the scraper config `config`.
+    An identical job which is still queued is returned instead of a new one. Returns (job, created)
+    """
+    options = job_settings()
+    if config not in options.get('CONFIGS', {}):
+        raise ValueError(f"Unknown scraper config {config}")
+
+    job = ScraperJob.objects.filter(status=ScraperJob.QUEUED, category=category, config=config).order_by('id').first()
+    if job is not None:
+        return job, False
+    job = ScraperJob.objects.create(category=category, config=config, max_attempts=max_attempts or options.get('MAX_ATTEMPTS', 3))
+    return job, True
+
+
+def cancel_job(job):
+    """Cancels a queued or running job. A running scrape is killed by its worker on the next heartbeat
+    """
+    return ScraperJob.objects.filter(pk=job.pk, status__in=ACTIVE_STATUSES).update(status=ScraperJob.CANCELLED, finished_on=timezone.now()) > 0
+
+
+def conflicting_jobs(job):
+    """Running jobs, other than `job`, which may not run at the same time: those of the same category,
+    and any of them if either is a scrape of every category
+    """
+    running = ScraperJob.objects.filter(status=ScraperJob.RUNNING).exclude(pk=job.pk)
+    if job.category is None:
+        return running
+    return running.filter(Q(category=job.category) | Q(category__isnull=True))
+
+
+def claim_job(worker):
+    """Marks the next runnable job as running on `worker` and returns it, or None.
+    At most MAX_CONCURRENT jobs run at once, and never two of the same category
+    """
+    limit = job_settings().get('MAX_CONCURRENT', 1)
+    running = ScraperJob.objects.filter(status=ScraperJob.RUNNING)
+    busy = set(running.values_list('category', flat=True))
+    if running.count() >= limit:
+        return None
+
+    now = timezone.now()
+    for job in ScraperJob.objects.filter(status=ScraperJob.QUEUED, run_after__lte=now).order_by('run_after', 'id')[:CLAIM_CANDIDATES]:
+        # A scrape of every category (None) excludes any other
+        if job.category in busy or None in busy or (job.category is None and busy):
+            continue
+        claimed = ScraperJob.objects.filter(pk=job.pk, status=ScraperJob.QUEUED).update(
+            status=ScraperJob.RUNNING, worker=worker, started_on=now, heartbeat_on=now, finished_on=None, attempts=F('attempts') + 1,
+        )
+        if not claimed:
+            continue
+        # Another worker may have claimed a job at the same time, both give it up then
+        if ScraperJob.objects.filter(status=ScraperJob.RUNNING).count() > limit or conflicting_jobs(job).exists():
+            ScraperJob.objects.filter(pk=job.pk, status=ScraperJob.RUNNING).update(status=ScraperJob.QUEUED, worker='', attempts=F('attempts') - 1)
+            return None
+        job.refresh_from_db()
+        return job
+    return None
+
+
+def build_command(job):
+    options = job_settings()
+    values = {'python': sys.executable, 'config': options['CONFIGS'][job.config], 'category': job.category or ''}
+    return [part.format(**values) for part in options['COMMAND']]
+
+
+def log_path(job):
+    return os.path.join(job_settings().get('LOG_DIR', 'scraper_logs'), f'job-{job.pk}-{job.attempts}.log')
+
+
+def tail_log(job, num_bytes=LOG_TAIL_BYTES):
+    """Returns the end of the log of the latest attempt of `job`
+    """
+    if not job.log_file or not os.path.exists(job.log_file):
+        return ''
+    with open(job.log_file, 'rb') as f:
+        f.seek(max(os.path.getsize(job.log_file) - num_bytes, 0))
+        return f.read().decode('utf-8', errors='replace')
+
+
+def run_job(job, stop=None):
+    """Runs the scraper of a claimed job to completion, heartbeating meanwhile, and records the outcome.
+    Failed runs are queued again until `max_attempts` is reached. If `stop()` turns True the scrape is
+    killed and the job queued again, without using up an attempt
+    """
+    options = job_settings()
+    heartbeat_interval = options.get('HEARTBEAT_INTERVAL', 30)
+    timeout = options.get('TIMEOUT')
+
+    path = log_path(job)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    ScraperJob.objects.filter(pk=job.pk).update(log_file=path)
+
+    env = dict(os.environ, SCRAPER_CATEGORY=job.category or '', SCRAPER_JOB_ID=str(job.pk))
+    error = ''
+    start = time.monotonic()
+    with open(path, 'ab') as log:
+        try:
+            process = subprocess.Popen(build_command(job), stdout=log, stderr=subprocess.STDOUT, env=env, cwd=options.get('CWD') or None)
+        except OSError as ex:
+            process, exit_code, error = None, None, f"Could not start the scraper: {ex}"
+
+        while process is not None:
+            try:
+                exit_code = process.wait(timeout=heartbeat_interval)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            # The row is the only channel with the API: a cancelled job is killed here
+            alive = ScraperJob.objects.filter(pk=job.pk, status=ScraperJob.RUNNING).update(heartbeat_on=timezone.now())
+            if stop is not None and stop():
+                process.kill()
+                process.wait()
+                ScraperJob.objects.filter(pk=job.pk, status=ScraperJob.RUNNING).update(status=ScraperJob.QUEUED, worker='', attempts=F('attempts') - 1, error='Interrupted by a worker shutdown')
+                job.refresh_from_db()
+                return job
+            if not alive or (timeout and time.monotonic() - start > timeout):
+                process.kill()
+                exit_code = process.wait()
+                error = 'Cancelled' if not alive else f"Killed after {timeout} seconds"
+                break
+
+    now = timezone.now()
+    job.refresh_from_db()
+    if job.status != ScraperJob.RUNNING:
+        # Cancelled meanwhile
+        ScraperJob.objects.filter(pk=job.pk).update(exit_code=exit_code, error=error or job.error)
+        return job
+
+    if exit_code == 0:
+        job.status = ScraperJob.SUCCEEDED
+        if options.get('REFRESH_AFTER_SCRAPE', True):
+            # The job stays running until the refresh is done, so that no other scrape of its category starts
+            try:
+                with heartbeating(job, heartbeat_interval), refresh_lock():
+                    refresh_after_scrape(job)
+            except Exception as ex:
+                error = f"Scrape succeeded, refreshing the dashboard tables failed: {ex}"
+    elif job.attempts < job.max_attempts:
+        job.status = ScraperJob.QUEUED
+        job.run_after = now + datetime.timedelta(seconds=options.get('RETRY_DELAY', 300) * job.attempts)
+        error = error or f"Exited with {exit_code}, retrying"
+    else:
+        job.status = ScraperJob.FAILED
+        error = error or f"Exited with {exit_code}"
+
+    job.exit_code = exit_code
+    job.error = error
+    job.finished_on = now
+    ScraperJob.objects.filter(pk=job.pk, status=ScraperJob.RUNNING).update(
+        status=job.status, exit_code=exit_code, error=error, finished_on=now, run_after=job.run_after,
+    )
+    return job
+
+
+@contextlib.contextmanager
+def heartbeating(job, interval):
+    """Heartbeats a running `job` from a background thread, for the work done after its scrape.
+    Otherwise a long refresh would be taken for a dead worker by requeue_stale_jobs()
+    """
+    done = threading.Event()
+
+    def beat():
+        while not done.wait(interval):
+            try:
+                ScraperJob.objects.filter(pk=job.pk, status=ScraperJob.RUNNING).update(heartbeat_on=timezone.now())
+            except Error as ex:
+                print(f"Could not heartbeat scraper job {job.pk}: {ex}")
+        # The connections of this thread
+        connections.close_all()
+
+    thread = threading.Thread(target=beat, name=f'heartbeat-{job.pk}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+
+@contextlib.contextmanager
+def refresh_lock():
+    """Runs the dashboard refreshes of the workers of this host one at a time (a lock file in LOG_DIR).
+    Across hosts, MAX_CONCURRENT = 1 already runs one scrape, refresh included, at a time
+    """
+    if fcntl is None:
+        yield
+        return
+    log_dir = job_settings().get('LOG_DIR', 'scraper_logs')
+    os.makedirs(log_dir, exist_ok=True)
+    with open(os.path.join(log_dir, 'refresh.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def refresh_after_scrape(job):
+    # Bring the aggregates and the precomputed dashboard tables up to date with the new scrape
+    from apps.dashboard.cache import bump_data_version
+    from apps.dashboard.pipeline import refresh_from_scraped
+    bump_data_version('scraped')
+    refresh_from_scraped()
+
+
+def requeue_stale_jobs():
+    """Running jobs whose worker stopped heartbeating (it died) are queued again, or failed if out of attempts.
+    Returns the number of jobs recovered
+    """
+    options = job_settings()
+    now = timezone.now()
+    deadline = now - datetime.timedelta(seconds=options.get('STALE_AFTER', 300))
+    stale = ScraperJob.objects.filter(status=ScraperJob.RUNNING, heartbeat_on__lt=deadline)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(status=ScraperJob.FAILED, finished_on=now, error='Worker lost')
+    requeued = stale.update(status=ScraperJob.QUEUED, worker='', error='Worker lost, retrying')
+    return failed + requeued
+
+
+def work(worker, stop=None, once=False):
+    """Claims and runs jobs until `stop()` returns True, or the queue is drained when `once`
+    """
+    poll_interval = job_settings().get('POLL_INTERVAL', 5)
+    while stop is None or not stop():
+        close_old_connections()
+        job = claim_job(worker)
+        if job is not None:
+            print(f"{worker}: running scraper job {job.pk} ({job.category or 'all categories'}, attempt {job.attempts})")
+            job = run_job(job, stop=stop)
+            print(f"{worker}: scraper job {job.pk} {job.status}")
+            continue
+        if once:
+            break
+        time.sleep(poll_interval)
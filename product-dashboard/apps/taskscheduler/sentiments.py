@@ -0,0 +1,144 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+POLARITIES = ('pos', 'neg')
+
+FORMAT_VERSION = 1
+
+KEY_SEPARATOR = '\x1f'
+
+
+class SortedSlots:
+    """Read only (product_id, feature, polarity) -> (start, end) mapping over sorted key arrays.
+    The arrays can be memory-mapped, so nothing is built per process
+    """
+
+    def __init__(self, keys, starts, ends):
+        self.keys = keys
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key, default=None):
+        key = KEY_SEPARATOR.join(key)
+        idx = int(np.searchsorted(self.keys, key))
+        if idx < len(self.keys) and self.keys[idx] == key:
+            return int(self.starts[idx]), int(self.ends[idx])
+        return default
+
+    def items(self, product_id=None):
+        # Keys are sorted, so the keys of a product are contiguous
+        start, end = 0, len(self.keys)
+        if product_id is not None:
+            start = int(np.searchsorted(self.keys, product_id + KEY_SEPARATOR))
+            end = int(np.searchsorted(self.keys, product_id + chr(ord(KEY_SEPARATOR) + 1)))
+        for idx in range(start, end):
+            yield tuple(str(self.keys[idx]).split(KEY_SEPARATOR)), (int(self.starts[idx]), int(self.ends[idx]))
+
+
+class SentimentIndex:
+    """Posting lists of review ids keyed by (product_id, feature, polarity).
+    All the lists live back to back in one sorted-per-key `ids` array, `slots` maps a key to its (start, end)
+    """
+
+    def __init__(self, ids, slots):
+        self.ids = ids
+        self.slots = slots
+
+    @classmethod
+    def from_dataframe(cls, indexed_df):
+        """Builds the index from the output of `construct_indexed_df`
+        """
+        features = [column for column in indexed_df.columns if column not in ('id', 'product_id')]
+        review_ids = indexed_df['id'].to_numpy(dtype=np.int64)
+        product_codes, product_ids = pd.factorize(indexed_df['product_id'].astype(str))
+
+        chunks = []
+        slots = {}
+        offset = 0
+        for feature in features:
+            scores = pd.to_numeric(indexed_df[feature], errors='coerce').to_numpy(dtype=np.float64)
+            for polarity, mask in (('pos', scores > 0), ('neg', scores < 0)):
+                if not mask.any():
+                    continue
+                codes, ids = product_codes[mask], review_ids[mask]
+                order = np.lexsort((ids, codes))
+                codes, ids = codes[order], ids[order]
+
+                starts = np.concatenate([[0], np.flatnonzero(np.diff(codes)) + 1])
+                ends = np.concatenate([starts[1:], [len(codes)]])
+                for start, end in zip(starts, ends):
+                    slots[(product_ids[codes[start]], feature, polarity)] = (offset + int(start), offset + int(end))
+
+                chunks.append(ids)
+                offset += len(ids)
+
+        ids = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64)
+        return cls(ids, slots)
+
+    def save(self, path):
+        """Writes the index as plain .npy files into the directory `path`, replacing it atomically
+        """
+        items = sorted((KEY_SEPARATOR.join(key), start, end) for key, (start, end) in self.slots.items())
+        keys = np.array([item[0] for item in items], dtype=np.str_) if items else np.zeros(0, dtype='<U1')
+
+        tmp_path = f"{path}.tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        np.save(os.path.join(tmp_path, 'ids.npy'), np.ascontiguousarray(self.ids, dtype=np.int64))
+        np.save(os.path.join(tmp_path, 'keys.npy'), keys)
+        np.save(os.path.join(tmp_path, 'starts.npy'), np.array([item[1] for item in items], dtype=np.int64))
+        np.save(os.path.join(tmp_path, 'ends.npy'), np.array([item[2] for item in items], dtype=np.int64))
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'version': FORMAT_VERSION, 'num_ids': len(self.ids), 'num_keys': len(items)}, f)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-maps an index written by `save`. Pages are shared by every process mapping the same files
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported sentiment index version {meta.get('version')} in {path}")
+
+        def _load(name):
+            return np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+
+        return cls(_load('ids'), SortedSlots(_load('keys'), _load('starts'), _load('ends')))
+
+    def product_counts(self, product_id):
+        """Returns the number of reviews of a product per feature and polarity, as `{feature: {'pos': n, 'neg': n}}`
+        """
+        if isinstance(self.slots, SortedSlots):
+            items = self.slots.items(product_id)
+        else:
+            items = ((key, slot) for key, slot in self.slots.items() if key[0] == product_id)
+        counts = {}
+        for (_, feature, polarity), (start, end) in items:
+            counts.setdefault(feature, {name: 0 for name in POLARITIES})[polarity] = end - start
+        return counts
+
+    def lookup(self, product_id, feature, polarity='pos', after=None, limit=None):
+        """Returns the sorted review ids for a key, optionally only those > `after`, at most `limit` of them
+        """
+        slot = self.slots.get((product_id, feature, polarity))
+        if slot is None:
+            return self.ids[:0]
+        ids = self.ids[slot[0]:slot[1]]
+        if after is not None:
+            ids = ids[np.searchsorted(ids, after, side='right'):]
+        if limit is not None:
+            ids = ids[:limit]
+        return ids
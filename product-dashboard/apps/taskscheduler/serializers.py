@@ -0,0 +1,9 @@
+from rest_framework import serializers
+
+from .models import ScraperJob
+
+
+class ScraperJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ScraperJob
+        fields = '__all__'
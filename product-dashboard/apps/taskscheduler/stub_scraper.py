@@ -0,0 +1,28 @@
+import argparse
+import os
+import sys
+import time
+
+# Stand-in for scraper/scraper.py, to run the scraper job queue locally, e.g. with
+# SCRAPER_COMMAND="{python} apps/taskscheduler/stub_scraper.py --config {config} --seconds 5"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pretends to scrape, then exits with the given code')
+    parser.add_argument('--config', default='')
+    parser.add_argument('--seconds', type=float, default=0, help='How long the scrape takes')
+    parser.add_argument('--exit-code', type=int, default=int(os.environ.get('STUB_SCRAPER_EXIT_CODE', 0)))
+    args = parser.parse_args()
+
+    category = os.environ.get('SCRAPER_CATEGORY') or 'all categories'
+    print(f"Scraping {category} with config {args.config}", flush=True)
+    steps = 5
+    for step in range(steps):
+        time.sleep(args.seconds / steps)
+        print(f"Progress: {100 * (step + 1) // steps}%", flush=True)
+    print(f"Done, exit code {args.exit_code}", flush=True)
+    sys.exit(args.exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,141 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import time
 
-# Create your tests here.
+import pandas as pd
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.utils import timezone
+
+from apps.accounts.models import User
+
+from . import management
+from .models import ScraperJob
+from .scraper_jobs import (claim_job, conflicting_jobs, enqueue_job,
+                           heartbeating, requeue_stale_jobs, run_job, work)
+from .sentiments import SentimentIndex
+
+STUB_SCRAPER = os.path.join(os.path.dirname(__file__), 'stub_scraper.py')
+
+LOG_DIR = tempfile.mkdtemp()
+
+
+def tearDownModule():
+    shutil.rmtree(LOG_DIR, ignore_errors=True)
+
+
+def scraper_settings(**options):
+    return {
+        'COMMAND': ['{python}', STUB_SCRAPER, '--config', '{config}', *options.pop('args', [])],
+        'CONFIGS': {'listing': 'listing.conf'},
+        'MAX_CONCURRENT': 1,
+        'MAX_ATTEMPTS': 2,
+        'RETRY_DELAY': 0,
+        'HEARTBEAT_INTERVAL': 0.1,
+        'LOG_DIR': LOG_DIR,
+        'REFRESH_AFTER_SCRAPE': False,
+        **options,
+    }
+
+
+class ScraperJobTest(TestCase):
+
+    @override_settings(SCRAPER_JOBS=scraper_settings())
+    def test_run(self):
+        job, created = enqueue_job(category='headphones')
+        self.assertTrue(created)
+        self.assertEqual(enqueue_job(category='headphones'), (job, False))
+
+        work('test', once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.exit_code, job.attempts), (ScraperJob.SUCCEEDED, 0, 1))
+        with open(job.log_file) as f:
+            self.assertIn('Scraping headphones with config listing.conf', f.read())
+
+    @override_settings(SCRAPER_JOBS=scraper_settings(args=['--exit-code', '3']))
+    def test_retries(self):
+        job, _ = enqueue_job()
+        self.assertEqual(run_job(claim_job('test')).status, ScraperJob.QUEUED)
+        job = run_job(claim_job('test'))
+        self.assertEqual((job.status, job.exit_code, job.attempts), (ScraperJob.FAILED, 3, 2))
+        self.assertIsNone(claim_job('test'))
+
+    @override_settings(SCRAPER_JOBS=scraper_settings(MAX_CONCURRENT=2))
+    def test_concurrency(self):
+        enqueue_job(category='headphones')
+        ScraperJob.objects.create(category='headphones', config='listing')
+        enqueue_job(category='speakers')
+        enqueue_job(category='earphones')
+
+        # One scrape per category, at most MAX_CONCURRENT at once
+        self.assertEqual(claim_job('a').category, 'headphones')
+        self.assertEqual(claim_job('b').category, 'speakers')
+        self.assertIsNone(claim_job('c'))
+
+    def test_claim_race(self):
+        # Jobs claimed by two workers in the same instant, as if both had seen no running job
+        headphones = ScraperJob.objects.create(category='headphones', config='listing', status=ScraperJob.RUNNING)
+        other = ScraperJob.objects.create(category='headphones', config='listing', status=ScraperJob.RUNNING)
+        speakers = ScraperJob.objects.create(category='speakers', config='listing', status=ScraperJob.RUNNING)
+        self.assertEqual(list(conflicting_jobs(headphones)), [other])
+        self.assertFalse(conflicting_jobs(speakers).exists())
+        everything = ScraperJob.objects.create(category=None, config='listing', status=ScraperJob.RUNNING)
+        self.assertEqual(set(conflicting_jobs(speakers)), {everything})
+        self.assertEqual(set(conflicting_jobs(everything)), {headphones, other, speakers})
+
+    @override_settings(SCRAPER_JOBS=scraper_settings(args=['--seconds', '0.5']))
+    def test_api(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+
+        response = self.client.post('/api/scraper/jobs', json.dumps({'category': 'speakers'}), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        pk = response.json()['id']
+        self.assertEqual(self.client.post('/api/scraper/jobs', json.dumps({'config': 'daily'}), content_type='application/json').status_code, 400)
+
+        work('test', once=True)
+        response = self.client.get(f'/api/scraper/jobs/{pk}')
+        self.assertEqual(response.json()['status'], ScraperJob.SUCCEEDED)
+        self.assertIn('Progress: 100%', response.json()['log'])
+        self.assertEqual(self.client.delete(f'/api/scraper/jobs/{pk}').status_code, 400)
+
+
+class HeartbeatTest(TransactionTestCase):
+    # The heartbeat thread has its own connection, it needs to see the committed job
+
+    @override_settings(SCRAPER_JOBS=scraper_settings(STALE_AFTER=0.5))
+    def test_refresh_keeps_heartbeating(self):
+        job = ScraperJob.objects.create(category='headphones', status=ScraperJob.RUNNING, attempts=1, heartbeat_on=timezone.now())
+        # A refresh outlasting STALE_AFTER
+        with heartbeating(job, 0.1):
+            time.sleep(1)
+            self.assertEqual(requeue_stale_jobs(), 0)
+        time.sleep(0.6)
+        self.assertEqual(requeue_stale_jobs(), 1)
+
+
+class ReviewIndexLoadTest(SimpleTestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        # Sentiment files are read from the working directory
+        os.chdir(self.directory)
+        management._REVIEW_INDEX, management._REVIEW_INDEX_FAILED_AT = None, None
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        management._REVIEW_INDEX, management._REVIEW_INDEX_FAILED_AT = None, None
+
+    def test_failed_load_is_retried(self):
+        # Nothing converted yet
+        self.assertIsNone(management.get_review_index())
+        SentimentIndex.from_dataframe(pd.DataFrame({'id': [1], 'product_id': ['A'], 'bass': [1.0]})).save(management.SENTIMENT_INDEX_DIR)
+        # Not before the backoff is over
+        self.assertIsNone(management.get_review_index())
+        index = management.get_review_index(retry_after=0)
+        self.assertEqual(list(index.lookup('A', 'bass')), [1])
+        self.assertIs(management.get_review_index(), index)
@@ -0,0 +1,8 @@
+from django.urls import path
+
+from . import api
+
+urlpatterns = [
+    path('jobs', api.ScraperJobListAPI.as_view()),
+    path('jobs/<int:pk>', api.ScraperJobAPI.as_view()),
+]
@@ -0,0 +1,19 @@
+import os
+import signal
+import socket
+
+# Entry point of the worker processes of `manage.py run_scraper_workers`. They are spawned, so this
+# module must not import Django models before `django.setup()`
+
+
+def worker_process(name):
+    import django
+    django.setup()
+
+    from apps.taskscheduler.scraper_jobs import work
+
+    # The supervisor decides when to stop, by sending SIGTERM
+    stopping = []
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    work(f"{socket.gethostname()}:{os.getpid()}:{name}", stop=lambda: bool(stopping))